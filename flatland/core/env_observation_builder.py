@@ -7,7 +7,14 @@ The ObservationBuilder-derived custom classes implement 2 functions, reset() and
 + `get()` is called whenever an observation has to be computed, potentially for each agent independently in case of \
 multi-agent environments.
 
++ `prepare()` is called before `get()` is called for single agents outside of `get_many()`, e.g. by \
+`LazyObservations`, to compute the data shared by the observations of all agents.
+
++ `set_perf_stats()` is called when the environment starts or stops measuring the phases of its steps, builders \
+with phases of their own, e.g. the prediction, lap them into the stats.
+
 """
+from collections.abc import Mapping
 from typing import Optional, List
 
 import numpy as np
@@ -32,6 +39,13 @@ class ObservationBuilder:
         """
         raise NotImplementedError()
 
+    def set_perf_stats(self, perf_stats):
+        """
+        Called by the environment with the `PerfStats` the builder may lap its own phases into, e.g. 'prediction',
+        while the observations are built in a step, or with None if they are not measured.
+        """
+        pass
+
     def get_many(self, handles: Optional[List[int]] = None):
         """
         Called whenever an observation has to be computed for the `env` environment, for each agent with handle
@@ -55,6 +69,19 @@ class ObservationBuilder:
             observations[h] = self.get(h)
         return observations
 
+    def prepare(self, handles: Optional[List[int]] = None):
+        """
+        Called before the observations of single agents are computed by `get()` outside of `get_many()`, with the
+        handles of all agents `get_many()` would be called with. Builders which compute data shared by all agents in
+        `get_many()` compute it here.
+
+        Parameters
+        ----------
+        handles : list of handles, optional
+            List with the handles of all agents.
+        """
+        pass
+
     def get(self, handle: int = 0):
         """
         Called whenever an observation has to be computed for the `env` environment, possibly
@@ -79,6 +106,45 @@ class ObservationBuilder:
         return direction
 
 
+class LazyObservations(Mapping):
+    """
+    Read-only mapping from the handles of the agents to their observations, which are computed by the observation
+    builder when they are accessed for the first time.
+
+    The observations can only be computed until the environment is stepped, reset, restored or undone, the
+    observations accessed before remain available.
+    """
+
+    def __init__(self, obs_builder: ObservationBuilder, handles: List[int]):
+        self.obs_builder = obs_builder
+        self.handles = dict.fromkeys(handles)
+        self.expired = False
+        self._observations = {}
+
+    def __getitem__(self, handle: int):
+        if handle not in self._observations:
+            if handle not in self.handles:
+                raise KeyError(handle)
+            if self.expired:
+                raise RuntimeError("the observation of agent {} was not accessed before the environment was "
+                                   "stepped, reset or rolled back".format(handle))
+            self._observations[handle] = self.obs_builder.get(handle)
+        return self._observations[handle]
+
+    def __iter__(self):
+        return iter(self.handles)
+
+    def __len__(self):
+        return len(self.handles)
+
+    def expire(self):
+        """
+        Called when the environment is stepped, reset, restored or undone, the observations not computed yet cannot be
+        computed any more.
+        """
+        self.expired = True
+
+
 class DummyObservationBuilder(ObservationBuilder):
     """
     DummyObservationBuilder class which returns dummy observations
@@ -1,6 +1,8 @@
 """
 TransitionMap and derived classes.
 """
+import hashlib
+from typing import Optional, Sequence, Tuple
 
 import numpy as np
 from importlib_resources import path
@@ -12,6 +14,7 @@ from flatland.core.grid.grid_utils import IntVector2DArray, IntVector2D
 from flatland.core.grid.grid_utils import Vec2dOperations as Vec2d
 from flatland.core.grid.rail_env_grid import RailEnvTransitions
 from flatland.core.transitions import Transitions
+from flatland.core.waypoint_graph import WaypointGraph
 from flatland.utils.ordered_set import OrderedSet
 
 
@@ -142,6 +145,110 @@ class GridTransitionMap(TransitionMap):
         else:
             self.random_generator.seed(random_seed)
         self.grid = np.zeros((height, width), dtype=self.transitions.get_type())
+        # lookup tables built from the grid by `flatland.envs.compiled_rail.CompiledRail.for_rail`
+        self.compiled_rail = None
+        # (grid, fingerprint) of a read-only grid, which is not hashed again
+        self.fingerprint_of_grid = None
+        # built from the grid by `waypoint_graph`
+        self.cached_waypoint_graph = None
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """
+        (height, width) of the grid.
+        """
+        return self.grid.shape
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the grid, equal for grids of the same shape with the same transitions. It is computed from the
+        current grid, so it also reflects cells written into the grid array directly. The fingerprint of a read-only
+        grid, e.g. of a `SharedLevel`, is only computed once.
+
+        Returns
+        -------
+        str
+            The hex digest of the grid
+        """
+        fingerprint_of_grid = getattr(self, 'fingerprint_of_grid', None)
+        if fingerprint_of_grid is not None and fingerprint_of_grid[0] is self.grid:
+            return fingerprint_of_grid[1]
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str((self.grid.shape, self.grid.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(self.grid).tobytes())
+        fingerprint = digest.hexdigest()
+        if not self.grid.flags.writeable:
+            self.fingerprint_of_grid = (self.grid, fingerprint)
+        return fingerprint
+
+    def waypoint_graph(self, rebuild: bool = False, fingerprint: Optional[str] = None) -> WaypointGraph:
+        """
+        Returns the compressed sparse row adjacency of the (row, column, direction) nodes of the rail and its
+        reverse, see `WaypointGraph`. It is built once, and again when the grid has been replaced or its transitions
+        have been set since.
+
+        Parameters
+        ----------
+        rebuild : bool
+            Whether to build the graph again, e.g. after cells of the grid array have been overwritten directly.
+        fingerprint : str, optional
+            The current `fingerprint()`, the graph is built again if it was built for another one.
+
+        Returns
+        -------
+        WaypointGraph
+        """
+        assert isinstance(self.transitions, Grid4Transitions), "the waypoint graph requires Grid4Transitions"
+        graph = getattr(self, 'cached_waypoint_graph', None)
+        if rebuild or graph is None or graph.grid is not self.grid or (
+                fingerprint is not None and graph.fingerprint != fingerprint):
+            graph = WaypointGraph(self.grid)
+            graph.fingerprint = fingerprint
+            self.cached_waypoint_graph = graph
+        return graph
+
+    def to_bitplanes(self, dtype=np.uint8) -> np.ndarray:
+        """
+        The bits of all cells of the grid, most significant bit first, i.e. the digits of `bin(get_full_transitions(
+        row, column))` padded to the width of the cells.
+
+        Parameters
+        ----------
+        dtype : np.dtype
+            Type of the returned array.
+
+        Returns
+        -------
+        np.ndarray
+            `(height, width, 16)` array for `Grid4Transitions` cells
+        """
+        itemsize = self.grid.dtype.itemsize
+        # big-endian bytes, such that the bits are unpacked from the most significant one
+        cell_bytes = self.grid.astype('>u{}'.format(itemsize)).view(np.uint8).reshape(self.grid.shape + (itemsize,))
+        return np.unpackbits(cell_bytes, axis=2).astype(dtype, copy=False)
+
+    def entry_directions(self) -> np.ndarray:
+        """
+        `Grid4Transitions.get_entry_directions` of all cells of the grid.
+
+        Returns
+        -------
+        np.ndarray
+            `(height, width, 4)` bool array, whether an agent facing N, E, S or W can be in each cell
+        """
+        assert isinstance(self.transitions, Grid4Transitions), "the entry directions require Grid4Transitions"
+        return self.to_bitplanes().reshape(self.grid.shape + (4, 4)).any(axis=3)
+
+    def transition_counts(self) -> np.ndarray:
+        """
+        Number of transitions of all cells of the grid, i.e. the number of set bits of each cell.
+
+        Returns
+        -------
+        np.ndarray
+            `(height, width)` int array
+        """
+        return self.to_bitplanes().sum(axis=2, dtype=int)
 
     def get_full_transitions(self, row, column):
         """
@@ -203,6 +310,8 @@ class GridTransitionMap(TransitionMap):
         """
         assert len(cell_id) in (2, 3), \
             'GridTransitionMap.set_transitions() ERROR: cell_id tuple must have length 2 or 3.'
+        self.compiled_rail = None
+        self.cached_waypoint_graph = None
         if len(cell_id) == 3:
             self.grid[cell_id[0]][cell_id[1]] = self.transitions.set_transitions(self.grid[cell_id[0]][cell_id[1]],
                                                                                  cell_id[2],
@@ -260,6 +369,8 @@ class GridTransitionMap(TransitionMap):
         """
         assert len(cell_id) == 3, \
             'GridTransitionMap.set_transition() ERROR: cell_id tuple must have length 3.'
+        self.compiled_rail = None
+        self.cached_waypoint_graph = None
         self.grid[cell_id[0]][cell_id[1]] = self.transitions.set_transition(
             self.grid[cell_id[0]][cell_id[1]],
             cell_id[2],
@@ -512,18 +623,98 @@ class GridTransitionMap(TransitionMap):
         """
         Fixes broken transitions
         """
+        self._fix_cell(rcPos, self._incoming_connections(rcPos), direction)
+        return True
+
+    def invalid_cells(self, check_cells: bool = False, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        `cell_neighbours_valid` of all cells of the grid at once: a cell is invalid if a neighbour cannot be entered
+        by one of its outbound transitions, or if it is empty and a neighbour has a transition into it.
+
+        Parameters
+        ----------
+        check_cells : bool
+            Whether cells which are not valid transitions themselves (see `Transitions.is_valid`) are invalid too, as
+            with `check_this_cell`.
+        mask : np.ndarray, optional
+            `(height, width)` bool array of the region to check, the cells outside of it are not invalid.
+
+        Returns
+        -------
+        np.ndarray
+            `(height, width)` bool array of the invalid cells
+        """
+        assert isinstance(self.transitions, Grid4Transitions), "the validity check requires Grid4Transitions"
+        # bits[row, column, orientation, direction] as in `get_transition`
+        bits = self.to_bitplanes(dtype=bool).reshape(self.grid.shape + (4, 4))
+        inbound = bits.any(axis=3)
+        outbound = bits.any(axis=2)
+        empty = self.grid == 0
+        invalid = np.zeros(self.grid.shape, dtype=bool)
+        for direction in range(4):
+            # the neighbour in `direction` must be entered moving in `direction`, also outside of the grid
+            invalid |= outbound[:, :, direction] & ~self._neighbour_values(inbound[:, :, direction], direction)
+            # an empty cell must not be entered from the neighbour in `direction`
+            invalid |= empty & self._neighbour_values(outbound[:, :, mirror(direction)], direction)
+        if check_cells:
+            cells, cell_indices = np.unique(self.grid, return_inverse=True)
+            cells_valid = np.array([self.transitions.is_valid(cell) for cell in cells], dtype=bool)
+            invalid |= ~cells_valid[cell_indices].reshape(self.grid.shape)
+        if mask is not None:
+            invalid &= mask
+        return invalid
+
+    def fix_cells(self, cells: Sequence[IntVector2D], directions: Optional[Sequence[int]] = None):
+        """
+        `fix_transitions` of each of the `cells` in turn, e.g. of the `invalid_cells`, with the same result.
+
+        The incoming connections of all cells are computed at once from the grid, only the cells next to a cell
+        already fixed by this call are looked at again.
+
+        Parameters
+        ----------
+        cells : Sequence[IntVector2D]
+            The (row, column) cells to fix, in this order.
+        directions : Sequence[int], optional
+            The preferred direction of each cell for `fix_transitions`, none by default.
+        """
+        if len(cells) == 0:
+            return
+        bits = self.to_bitplanes(dtype=bool).reshape(self.grid.shape + (4, 4))
+        outbound = bits.any(axis=2)
+        # incoming[row, column, direction]: whether the neighbour in `direction` has a transition into the cell
+        incoming = np.stack([self._neighbour_values(outbound[:, :, mirror(direction)], direction)
+                             for direction in range(4)], axis=2)
+        fixed = np.zeros(self.grid.shape, dtype=bool)
+        neighbour_offsets = self.transitions.gDir2dRC
+        for i, cell in enumerate(cells):
+            row, column = int(cell[0]), int(cell[1])
+            incoming_connections = incoming[row, column].astype(float)
+            for row_offset, column_offset in neighbour_offsets:
+                neighbour = (row + row_offset, column + column_offset)
+                if 0 <= neighbour[0] < self.height and 0 <= neighbour[1] < self.width and fixed[neighbour]:
+                    incoming_connections = self._incoming_connections(cell)
+                    break
+            if np.sum(incoming_connections) > 0:
+                self._fix_cell(cell, incoming_connections, -1 if directions is None else directions[i])
+                fixed[row, column] = True
+
+    def _neighbour_values(self, values: np.ndarray, direction: int) -> np.ndarray:
+        """
+        The values of the neighbouring cell in `direction` of each cell, zero outside of the grid.
+        """
+        row_offset, column_offset = self.transitions.gDir2dRC[direction]
+        height, width = values.shape
+        padded = np.pad(values, 1, mode='constant')
+        return padded[1 + row_offset:1 + row_offset + height, 1 + column_offset:1 + column_offset + width]
+
+    def _incoming_connections(self, rcPos: IntVector2DArray) -> np.ndarray:
+        """
+        Whether the neighbour of rcPos in each direction has a transition into rcPos.
+        """
         gDir2dRC = self.transitions.gDir2dRC  # [[-1,0] = N, [0,1]=E, etc]
         grcPos = array(rcPos)
         grcMax = self.grid.shape
-        # Transition elements
-        transitions = RailEnvTransitions()
-        cells = transitions.transition_list
-        simple_switch_east_south = transitions.rotate_transition(cells[10], 90)
-        simple_switch_west_south = transitions.rotate_transition(cells[2], 270)
-        symmetrical = cells[6]
-        double_slip = cells[5]
-        three_way_transitions = [simple_switch_east_south, simple_switch_west_south]
-        # loop over available outbound directions (indices) for rcPos
 
         incoming_connections = np.zeros(4)
         for iDirOut in np.arange(4):
@@ -544,6 +735,19 @@ class GridTransitionMap(TransitionMap):
                 connected += self.get_transition((gPos2[0], gPos2[1], orientation), mirror(iDirOut))
             if connected > 0:
                 incoming_connections[iDirOut] = 1
+        return incoming_connections
+
+    def _fix_cell(self, rcPos: IntVector2DArray, incoming_connections: np.ndarray, direction: IntVector2D = -1):
+        """
+        Sets the transitions of rcPos connecting its `incoming_connections`.
+        """
+        # Transition elements
+        transitions = RailEnvTransitions()
+        cells = transitions.transition_list
+        simple_switch_east_south = transitions.rotate_transition(cells[10], 90)
+        simple_switch_west_south = transitions.rotate_transition(cells[2], 270)
+        double_slip = cells[5]
+        three_way_transitions = [simple_switch_east_south, simple_switch_west_south]
 
         number_of_incoming = np.sum(incoming_connections)
         # Only one incoming direction --> Straight line set deadend
@@ -586,7 +790,6 @@ class GridTransitionMap(TransitionMap):
             rotation = self.random_generator.randint(2)
             transition = transitions.rotate_transition(double_slip, int(rotation * 90))
             self.set_transitions((rcPos[0], rcPos[1]), transition)
-        return True
 
     def validate_new_transition(self, prev_pos: IntVector2D, current_pos: IntVector2D,
                                 new_pos: IntVector2D, end_pos: IntVector2D):
@@ -638,6 +841,168 @@ class GridTransitionMap(TransitionMap):
         return self.transitions.is_valid(new_trans)
 
 
+class SparseGridTransitionMap(GridTransitionMap):
+    """
+    GridTransitionMap storing its rail cells only, for large grids with few rail cells.
+
+    The rail cells are numbered by ids in the order they were added, `cell_positions` and `cell_transitions` give the
+    (row, column) and the transitions of each id, `cell_id` the id of a cell. Cells emptied by setting their
+    transitions to 0 keep their id. The waypoint graph of the map has the nodes of the rail cells only, its cell
+    indices are the cell ids, such that e.g. the distance map can be computed in the rail-cell index space with
+    `DistanceMap.get_compact`.
+
+    `grid` is a dense read-only copy of the cells, built when it is accessed after a change, for the code which needs
+    the whole grid. The cells are changed with `set_transitions` and `set_transition`, or by assigning a new grid.
+    """
+
+    def __init__(self, width, height, transitions: Transitions = Grid4Transitions([]), random_seed=None):
+        self._cell_ids = {}
+        self._cell_positions = np.zeros((0, 2), dtype=np.int64)
+        self._cell_transitions = np.zeros(0, dtype=transitions.get_type())
+        self.number_of_cells = 0
+        self._dense_grid = None
+        self._fingerprint = None
+        super().__init__(width, height, transitions, random_seed)
+
+    @property
+    def grid(self) -> np.ndarray:
+        if self._dense_grid is None:
+            grid = np.zeros((self.height, self.width), dtype=self._cell_transitions.dtype)
+            positions = self.cell_positions
+            grid[positions[:, 0], positions[:, 1]] = self.cell_transitions
+            grid.flags.writeable = False
+            self._dense_grid = grid
+        return self._dense_grid
+
+    @grid.setter
+    def grid(self, grid: np.ndarray):
+        grid = np.asarray(grid)
+        self.height, self.width = grid.shape
+        rows, columns = np.nonzero(grid)
+        self._cell_positions = np.stack([rows, columns], axis=1).astype(np.int64)
+        self._cell_transitions = grid[rows, columns].astype(self.transitions.get_type())
+        self.number_of_cells = len(rows)
+        self._cell_ids = {cell: cell_id for cell_id, cell in enumerate(zip(rows.tolist(), columns.tolist()))}
+        self._grid_changed()
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    @property
+    def cell_positions(self) -> np.ndarray:
+        """
+        `(number_of_cells, 2)` array of the (row, column) of each cell id.
+        """
+        return self._cell_positions[:self.number_of_cells]
+
+    @property
+    def cell_transitions(self) -> np.ndarray:
+        """
+        `(number_of_cells,)` array of the transitions of each cell id.
+        """
+        return self._cell_transitions[:self.number_of_cells]
+
+    def cell_id(self, row, column) -> int:
+        """
+        The id of the cell at (row, column), -1 if it is not a rail cell.
+        """
+        return self._cell_ids.get((row, column), -1)
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the rail cells, equal for sparse maps of the same shape with the same transitions, whatever order the
+        cells were added in. It differs from the fingerprint of a `GridTransitionMap` with the same grid.
+        """
+        if self._fingerprint is None:
+            non_empty = self.cell_transitions != 0
+            keys = self.cell_positions[non_empty, 0] * self.width + self.cell_positions[non_empty, 1]
+            order = np.argsort(keys)
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(str(('sparse', (self.height, self.width), self._cell_transitions.dtype.str)).encode())
+            digest.update(keys[order].tobytes())
+            digest.update(self.cell_transitions[non_empty][order].tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def waypoint_graph(self, rebuild: bool = False, fingerprint: Optional[str] = None) -> WaypointGraph:
+        """
+        Returns the waypoint graph of the rail cells, its cell indices are the cell ids, see `WaypointGraph`.
+        """
+        assert isinstance(self.transitions, Grid4Transitions), "the waypoint graph requires Grid4Transitions"
+        graph = self.cached_waypoint_graph
+        if rebuild or graph is None or (fingerprint is not None and graph.fingerprint != fingerprint):
+            positions = self.cell_positions
+            graph = WaypointGraph.from_cells(positions[:, 0], positions[:, 1], self.cell_transitions, self.height,
+                                             self.width)
+            graph.fingerprint = fingerprint
+            self.cached_waypoint_graph = graph
+        return graph
+
+    def get_full_transitions(self, row, column):
+        cell_id = self._cell_ids.get((row, column))
+        if cell_id is None:
+            return self._cell_transitions.dtype.type(0)
+        return self._cell_transitions[cell_id]
+
+    def get_transitions(self, row, column, orientation):
+        return self.transitions.get_transitions(self.get_full_transitions(row, column), orientation)
+
+    def get_transition(self, cell_id, transition_index):
+        assert len(cell_id) == 3, \
+            'GridTransitionMap.get_transition() ERROR: cell_id tuple must have length 2 or 3.'
+        return self.transitions.get_transition(self.get_full_transitions(cell_id[0], cell_id[1]), cell_id[2],
+                                               transition_index)
+
+    def set_transitions(self, cell_id, new_transitions):
+        assert len(cell_id) in (2, 3), \
+            'GridTransitionMap.set_transitions() ERROR: cell_id tuple must have length 2 or 3.'
+        if len(cell_id) == 3:
+            new_transitions = self.transitions.set_transitions(self.get_full_transitions(cell_id[0], cell_id[1]),
+                                                               cell_id[2], new_transitions)
+        self._set_cell(cell_id[0], cell_id[1], new_transitions)
+
+    def set_transition(self, cell_id, transition_index, new_transition, remove_deadends=False):
+        assert len(cell_id) == 3, \
+            'GridTransitionMap.set_transition() ERROR: cell_id tuple must have length 3.'
+        self._set_cell(cell_id[0], cell_id[1], self.transitions.set_transition(
+            self.get_full_transitions(cell_id[0], cell_id[1]),
+            cell_id[2],
+            transition_index,
+            new_transition,
+            remove_deadends))
+
+    def _set_cell(self, row, column, transitions):
+        cell = (int(row), int(column))
+        cell_id = self._cell_ids.get(cell)
+        if cell_id is None:
+            if transitions == 0:
+                return
+            cell_id = self._add_cell(cell)
+        self._cell_transitions[cell_id] = transitions
+        self._grid_changed()
+
+    def _add_cell(self, cell: IntVector2D) -> int:
+        cell_id = self.number_of_cells
+        if cell_id == len(self._cell_transitions):
+            # the arrays grow by doubling, such that adding the cells one by one takes linear time
+            capacity = max(2 * cell_id, 16)
+            self._cell_positions = np.concatenate(
+                [self._cell_positions, np.zeros((capacity - cell_id, 2), dtype=np.int64)])
+            self._cell_transitions = np.concatenate(
+                [self._cell_transitions, np.zeros(capacity - cell_id, dtype=self._cell_transitions.dtype)])
+        self._cell_positions[cell_id] = cell
+        self._cell_ids[cell] = cell_id
+        self.number_of_cells += 1
+        return cell_id
+
+    def _grid_changed(self):
+        self._dense_grid = None
+        self._fingerprint = None
+        self.compiled_rail = None
+        self.cached_waypoint_graph = None
+
+
 def mirror(dir):
     return (dir + 2) % 4
 # TODO: improvement override __getitem__ and __setitem__ (cell contents, not transitions?)
@@ -0,0 +1,205 @@
+"""
+Waypoint graph of a rail: the transitions between (row, column, direction) nodes in compressed sparse row form.
+
+A waypoint node is an agent in the cell (row, column) moving in direction N, E, S or W, i.e. the orientation it
+entered the cell with. The node (row, column, direction) has an edge to the node (row', column', direction') of the
+neighbouring cell in direction' if the transition from direction to direction' is set in the cell, and the
+neighbouring cell lies within the grid. The graph holds all transitions of the rail as flat integer arrays, forward
+and reverse, such that graph algorithms, e.g. the distance map, need not call `get_transitions` per cell.
+
+The node of (row, column, direction) is `cell_index * 4 + direction`, with the cell index `row * width + column` of
+the cells of the whole grid, or the id of a rail cell of a `SparseGridTransitionMap`. The successors of `node` are
+`indices[indptr[node]:indptr[node + 1]]`, its predecessors `reverse_indices[reverse_indptr[node]:reverse_indptr[
+node + 1]]`.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+# (row, column) offset of the neighbouring cell in direction N, E, S, W
+_DIRECTION_OFFSETS = np.array([(-1, 0), (0, 1), (1, 0), (0, -1)], dtype=int)
+
+
+class WaypointGraph:
+    """
+    Compressed sparse row adjacency of the waypoint nodes of a grid of `Grid4Transitions` cells, and its reverse.
+
+    The nodes are either those of all cells of the grid, or, for a `SparseGridTransitionMap`, those of its rail cells
+    only, see `from_cells`: the cell index of a node is then the id of its rail cell.
+    """
+
+    def __init__(self, grid: np.ndarray):
+        """
+        Parameters
+        ----------
+        grid : np.ndarray
+            The `(height, width)` cells of the rail, which are decoded once. The graph does not follow later changes
+            of the cells.
+        """
+        self.grid = grid
+        self.height, self.width = grid.shape
+        # `GridTransitionMap.fingerprint` of the grid, if the graph was requested with it
+        self.fingerprint: Optional[str] = None
+        # row * width + column of the cell of each cell index, None if the cells are those of the whole grid
+        self.cell_keys: Optional[np.ndarray] = None
+        self._sorted_cell_keys: Optional[np.ndarray] = None
+        self._sorted_cell_indices: Optional[np.ndarray] = None
+        self.number_of_cells = self.height * self.width
+        rows, columns = np.meshgrid(np.arange(self.height), np.arange(self.width), indexing='ij')
+        self._build(rows.ravel(), columns.ravel(), grid.ravel())
+
+    @staticmethod
+    def from_cells(rows: np.ndarray, columns: np.ndarray, cells: np.ndarray, height: int,
+                   width: int) -> 'WaypointGraph':
+        """
+        Graph of the waypoint nodes of the given cells only, the cell index of a node is the index of its cell in
+        these arrays.
+
+        Parameters
+        ----------
+        rows, columns : np.ndarray
+            Row and column of each cell, without duplicates.
+        cells : np.ndarray
+            The `Grid4Transitions` transitions of each cell.
+        height, width : int
+            The size of the grid.
+        """
+        graph = WaypointGraph.__new__(WaypointGraph)
+        graph.grid = None
+        graph.height, graph.width = height, width
+        graph.fingerprint = None
+        graph.cell_keys = np.asarray(rows, dtype=np.int64) * width + np.asarray(columns, dtype=np.int64)
+        graph._sorted_cell_indices = np.argsort(graph.cell_keys, kind='stable')
+        graph._sorted_cell_keys = graph.cell_keys[graph._sorted_cell_indices]
+        graph.number_of_cells = len(graph.cell_keys)
+        graph._build(np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64), np.asarray(cells))
+        return graph
+
+    def _build(self, rows: np.ndarray, columns: np.ndarray, cells: np.ndarray):
+        self.number_of_nodes = self.number_of_cells * 4
+        cells = cells.astype(np.int64)
+        directions = np.arange(4)
+        shifts = (3 - directions)[:, None] * 4 + (3 - directions)[None, :]
+        # transitions[cell index, direction, new direction] as in `GridTransitionMap.get_transition`
+        transitions = ((cells[:, None, None] >> shifts) & 1).astype(bool)
+
+        # the edges are enumerated in the order of their source nodes
+        edge_cells, edge_directions, edge_new_directions = np.nonzero(transitions)
+        new_rows = rows[edge_cells] + _DIRECTION_OFFSETS[edge_new_directions, 0]
+        new_columns = columns[edge_cells] + _DIRECTION_OFFSETS[edge_new_directions, 1]
+        new_cells = self.cell_index(new_rows, new_columns)
+        in_graph = new_cells >= 0
+        sources = edge_cells[in_graph] * 4 + edge_directions[in_graph]
+        targets = new_cells[in_graph] * 4 + edge_new_directions[in_graph]
+        self.indptr = self._indptr(sources)
+        self.indices = targets
+        order = np.argsort(targets, kind='stable')
+        self.reverse_indptr = self._indptr(targets[order])
+        self.reverse_indices = sources[order]
+
+    @property
+    def number_of_edges(self) -> int:
+        return len(self.indices)
+
+    def _indptr(self, sorted_sources: np.ndarray) -> np.ndarray:
+        indptr = np.zeros(self.number_of_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sorted_sources, minlength=self.number_of_nodes), out=indptr[1:])
+        return indptr
+
+    def cell_index(self, row, column):
+        """
+        The cell index of (row, column), elementwise for arrays, -1 for cells outside of the grid or the graph.
+        """
+        row, column = np.asarray(row, dtype=np.int64), np.asarray(column, dtype=np.int64)
+        in_grid = (row >= 0) & (row < self.height) & (column >= 0) & (column < self.width)
+        keys = row * self.width + column
+        if self.cell_keys is None:
+            cell = np.where(in_grid, keys, -1)
+        elif self.number_of_cells == 0:
+            cell = np.full(keys.shape, -1, dtype=np.int64)
+        else:
+            positions = np.minimum(np.searchsorted(self._sorted_cell_keys, keys), self.number_of_cells - 1)
+            found = in_grid & (self._sorted_cell_keys[positions] == keys)
+            cell = np.where(found, self._sorted_cell_indices[positions], -1)
+        return _scalar_or_array(cell)
+
+    def node(self, row, column, direction):
+        """
+        The node of (row, column, direction), elementwise for arrays, -1 for cells outside of the graph.
+        """
+        cell = np.asarray(self.cell_index(row, column))
+        return _scalar_or_array(np.where(cell >= 0, cell * 4 + np.asarray(direction), -1))
+
+    def cell_and_direction(self, node) -> Tuple:
+        """
+        The (row, column, direction) of a node, elementwise for arrays.
+        """
+        cell, direction = np.divmod(node, 4)
+        if self.cell_keys is not None:
+            cell = self.cell_keys[cell]
+        row, column = np.divmod(cell, self.width)
+        return row, column, direction
+
+    def successors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def predecessors(self, node: int) -> np.ndarray:
+        return self.reverse_indices[self.reverse_indptr[node]:self.reverse_indptr[node + 1]]
+
+    def distances(self, sources: np.ndarray, reverse: bool = False) -> np.ndarray:
+        """
+        Breadth first search from the `sources` nodes.
+
+        Parameters
+        ----------
+        sources : np.ndarray
+            The nodes at distance 0, negative nodes are ignored.
+        reverse : bool
+            Whether to walk the edges backwards, giving the distances from each node to the nearest source.
+
+        Returns
+        -------
+        np.ndarray
+            The distance of each node, `np.inf` for the nodes which are not reachable.
+        """
+        indptr, indices = (self.reverse_indptr, self.reverse_indices) if reverse else (self.indptr, self.indices)
+        distances = np.full(self.number_of_nodes, np.inf)
+        sources = np.asarray(sources, dtype=np.int64)
+        frontier = np.unique(sources[sources >= 0])
+        distance = 0
+        while len(frontier) > 0:
+            distances[frontier] = distance
+            distance += 1
+            neighbours = _gather(indptr, indices, frontier)
+            frontier = np.unique(neighbours[np.isinf(distances[neighbours])])
+        return distances
+
+    def to_grid(self, node_values: np.ndarray, fill=np.inf) -> np.ndarray:
+        """
+        The `(height, width, 4)` array of values given per node, `fill` for the cells outside of the graph.
+        """
+        node_values = np.asarray(node_values).reshape(self.number_of_cells, 4)
+        if self.cell_keys is None:
+            return node_values.reshape(self.height, self.width, 4)
+        values = np.full((self.height, self.width, 4), fill, dtype=np.result_type(node_values, fill))
+        rows, columns = np.divmod(self.cell_keys, self.width)
+        values[rows, columns] = node_values
+        return values
+
+
+def _scalar_or_array(values: np.ndarray):
+    return int(values) if np.ndim(values) == 0 else values
+
+
+def _gather(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """
+    The concatenated adjacent nodes of `nodes`.
+    """
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    # position of each gathered edge within the row of its node, added to the start of the row
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[np.repeat(starts, counts) + offsets]
@@ -0,0 +1,109 @@
+"""
+Masks of the valid actions of the agents of a RailEnv.
+
+Controllers mask the invalid actions of each agent at every step. The `ActionMasks` look the valid actions of all
+agents up in the tables of the `CompiledRail` in bulk, and keep the masks of the agents whose cell, direction and
+status did not change since the last update. Only the agents reported by `agents_modified()` are compared: the
+environment reports the agents changed by its steps, `undo()` and `restore()`, agents modified outside of the
+environment have to be reported by the code modifying them.
+"""
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+from flatland.envs.compiled_rail import CompiledRail, NUMBER_OF_ACTIONS
+
+# same values as RailEnvActions, which cannot be imported here as the RailEnv depends on this module
+_DO_NOTHING = 0
+_MOVE_ACTIONS = [1, 2, 3]
+_STOP_MOVING = 4
+
+
+class ActionMasks:
+    """
+    `(n_agents, 5)` boolean masks of the actions, indexed by the agent handle and the values of `RailEnvActions`:
+
+    - an agent ready to depart may take any action,
+    - an active agent may do nothing or stop, and move left, forward or right if the transition and the new cell are
+      valid (`CompiledRail.action_valid`),
+    - an agent which is done may only do nothing.
+
+    The actions of an active agent are only taken into account at the beginning of a cell (see
+    `RailEnv.action_required`), the mask is the one of its cell and direction in between.
+    """
+
+    def __init__(self):
+        self.masks = np.zeros((0, NUMBER_OF_ACTIONS), dtype=bool)
+        # (status, row, column, direction) of each agent at the last update
+        self._keys = np.zeros((0, 4), dtype=int)
+        self._action_valid: Optional[np.ndarray] = None
+        # handles of the agents modified since the last update, None for all agents
+        self._modified: Optional[set] = None
+
+    def reset(self, agents: List[EnvAgent]):
+        """
+        Recomputes the masks of all `agents`.
+        """
+        self.masks = np.zeros((len(agents), NUMBER_OF_ACTIONS), dtype=bool)
+        self._keys = np.full((len(agents), 4), -1, dtype=int)
+        self._action_valid = None
+        self._modified = None
+
+    def agents_modified(self, handles: Optional[Iterable[int]] = None):
+        """
+        Called after the cell, direction or status of the agents with `handles` (all agents by default) may have
+        changed, their masks are checked by the next update.
+        """
+        if handles is None:
+            self._modified = None
+        elif self._modified is not None:
+            self._modified.update(handles)
+
+    def update(self, agents: List[EnvAgent], rail) -> np.ndarray:
+        """
+        Updates the masks of the modified agents whose cell, direction or status changed, or all masks if the rail
+        was recompiled.
+
+        Returns
+        -------
+        np.ndarray
+            The masks, overwritten by the next update, copy them if they need to be kept.
+        """
+        if len(agents) != len(self.masks):
+            self.reset(agents)
+        compiled_rail = CompiledRail.for_rail(rail)
+        action_valid = compiled_rail.action_valid
+        if action_valid is not self._action_valid:
+            self._modified = None
+        if self._modified is None:
+            modified = np.arange(len(agents))
+        else:
+            modified = np.array(sorted(self._modified), dtype=int)
+        self._modified = set()
+        keys = np.array([(agents[i].status, -1, -1, -1) if agents[i].position is None else
+                         (agents[i].status, agents[i].position[0], agents[i].position[1], agents[i].direction)
+                         for i in modified.tolist()], dtype=int).reshape((-1, 4))
+        if action_valid is self._action_valid:
+            differs = np.any(keys != self._keys[modified], axis=1)
+            changed, keys = modified[differs], keys[differs]
+        else:
+            changed = modified
+        self._keys[changed] = keys
+        self._action_valid = action_valid
+        if len(changed) == 0:
+            return self.masks
+
+        keys = self._keys
+        status = keys[changed, 0]
+        masks = np.zeros((len(changed), NUMBER_OF_ACTIONS), dtype=bool)
+        masks[:, _DO_NOTHING] = True
+        masks[status == RailAgentStatus.READY_TO_DEPART] = True
+        active = np.flatnonzero(status == RailAgentStatus.ACTIVE)
+        cells = compiled_rail.cell_index(keys[changed[active], 1], keys[changed[active], 2])
+        directions = keys[changed[active], 3]
+        masks[active, _STOP_MOVING] = True
+        for action in _MOVE_ACTIONS:
+            masks[active, action] = action_valid[cells, directions, action]
+        self.masks[changed] = masks
+        return self.masks
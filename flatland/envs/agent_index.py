@@ -0,0 +1,112 @@
+"""
+Index of the agents of a RailEnv by their status.
+
+The index keeps the handles of the agents which are ready to depart, active and done in separate sets, and the agents
+ready to depart in a queue per start cell. Steps can then work only on the agents still on the map.
+
+The environment updates the index where it changes the status of an agent: at reset, departure, arrival, removal from
+the grid, `undo()` and `restore()`. Code changing the status or the start cell of agents outside of the environment
+has to call `update()` for these agents, or `sync()`.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+from flatland.utils.ordered_set import OrderedSet
+
+
+class AgentIndex:
+    """
+    Handles of the agents by status, and per start cell the queue of the agents waiting to depart from it, in the
+    order of their handles.
+    """
+
+    def __init__(self):
+        self.status: List[Optional[RailAgentStatus]] = []
+        self.initial_positions: List[Optional[Tuple[int, int]]] = []
+        self.ready_to_depart: OrderedSet = OrderedSet()
+        self.active: OrderedSet = OrderedSet()
+        self.done: OrderedSet = OrderedSet()
+        self.departure_queues: Dict[Tuple[int, int], List[int]] = {}
+
+    def reset(self, agents: List[EnvAgent]):
+        """
+        Rebuilds the index from the `agents`.
+        """
+        self.status = [None] * len(agents)
+        self.initial_positions = [None] * len(agents)
+        self.ready_to_depart = OrderedSet()
+        self.active = OrderedSet()
+        self.done = OrderedSet()
+        self.departure_queues = {}
+        for handle, agent in enumerate(agents):
+            self.update(handle, agent)
+
+    def update(self, handle: int, agent: EnvAgent):
+        """
+        Moves the `agent` with `handle` to the set and departure queue of its current status and start cell.
+        Agents unknown to the index are ignored, they are added by the next `reset` or `sync`.
+        """
+        if handle is None or handle >= len(self.status):
+            return
+        self._remove(handle)
+        status = agent.status
+        self.status[handle] = status
+        self.initial_positions[handle] = agent.initial_position
+        if status == RailAgentStatus.READY_TO_DEPART:
+            self.ready_to_depart.add(handle)
+            queue = self.departure_queues.setdefault(tuple(agent.initial_position), [])
+            queue.append(handle)
+            if len(queue) > 1 and queue[-2] > handle:
+                queue.sort()
+        elif status == RailAgentStatus.ACTIVE:
+            self.active.add(handle)
+        else:
+            self.done.add(handle)
+
+    def sync(self, agents: List[EnvAgent], handles: Optional[Iterable[int]] = None) -> List[int]:
+        """
+        Updates the index for the agents whose status or start cell was modified outside of the environment. This
+        compares the agents with `handles` (all agents by default) with the index, the steps do not call it.
+
+        Returns
+        -------
+        List[int]
+            The handles of the updated agents
+        """
+        if len(agents) != len(self.status):
+            self.reset(agents)
+            return list(range(len(agents)))
+        updated = []
+        for handle in range(len(agents)) if handles is None else handles:
+            agent = agents[handle]
+            if agent.status != self.status[handle] or agent.initial_position != self.initial_positions[handle]:
+                self.update(handle, agent)
+                updated.append(handle)
+        return updated
+
+    def live_handles(self) -> np.ndarray:
+        """
+        Handles of the agents which are ready to depart or active, in ascending order.
+        """
+        return np.array(sorted(list(self.ready_to_depart) + list(self.active)), dtype=int)
+
+    def waiting_at(self, position: Tuple[int, int]) -> List[int]:
+        """
+        Handles of the agents waiting to depart from `position`, in ascending order.
+        """
+        return self.departure_queues.get(tuple(position), [])
+
+    def _remove(self, handle: int):
+        status = self.status[handle]
+        if status == RailAgentStatus.READY_TO_DEPART:
+            self.ready_to_depart.discard(handle)
+            position = tuple(self.initial_positions[handle])
+            self.departure_queues[position].remove(handle)
+            if len(self.departure_queues[position]) == 0:
+                del self.departure_queues[position]
+        elif status == RailAgentStatus.ACTIVE:
+            self.active.discard(handle)
+        elif status is not None:
+            self.done.discard(handle)
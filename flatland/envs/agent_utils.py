@@ -1,8 +1,10 @@
+import math
+from collections.abc import Mapping, MutableMapping
 from enum import IntEnum
 from itertools import starmap
+from operator import attrgetter
 from typing import Tuple, Optional, NamedTuple
 
-from attr import attrs, attrib, Factory
 
 from flatland.core.grid.grid4 import Grid4TransitionsEnum
 from flatland.envs.schedule_utils import Schedule
@@ -15,6 +17,267 @@ class RailAgentStatus(IntEnum):
     DONE_REMOVED = 3  # removed from grid (position is None) -> prediction is None
 
 
+# tolerance of the cell exit, an agent leaves its cell when its position fraction is close to 1.0
+POSITION_FRACTION_TOLERANCE = 1e-3
+
+
+def ticks_per_cell(speed: float) -> int:
+    """
+    Number of moving steps an agent with `speed` needs to cross a cell, 0 if it does not move at all.
+    """
+    if speed <= 0:
+        return 0
+    return max(int(math.ceil((1.0 - POSITION_FRACTION_TOLERANCE) / speed)), 1)
+
+
+class _SpeedFields:
+    """
+    The speed fields of an agent, stored in slots.
+
+    The progress of the agent within its cell is counted in integer `ticks`, an agent with speed 1/n crosses a cell
+    in `ticks_per_cell` = n moving steps. `position_fraction` is derived from the ticks as the distance covered
+    (`ticks * speed`, as it was accumulated before), setting it or `speed` recomputes the ticks.
+    """
+    __slots__ = ('_speed', '_position_fraction', '_ticks', '_ticks_per_cell', 'transition_action_on_cellexit',
+                 'speed_extras')
+
+    def _set_speed_data(self, speed_data):
+        """
+        Sets the fields from a mapping with the keys 'speed', 'position_fraction' and 'transition_action_on_cellexit',
+        other keys are kept in `speed_extras`.
+        """
+        speed_data = dict(speed_data)
+        self._speed = speed_data.pop('speed', 1.0)
+        self._position_fraction = speed_data.pop('position_fraction', 0.0)
+        self.transition_action_on_cellexit = speed_data.pop('transition_action_on_cellexit', 0)
+        self.speed_extras = speed_data if len(speed_data) > 0 else None
+        self._sync_ticks()
+
+    @property
+    def speed(self) -> float:
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed: float):
+        self._speed = speed
+        self._sync_ticks()
+
+    @property
+    def position_fraction(self) -> float:
+        return self._position_fraction
+
+    @position_fraction.setter
+    def position_fraction(self, position_fraction: float):
+        self._position_fraction = position_fraction
+        self._sync_ticks()
+
+    @property
+    def ticks(self) -> int:
+        """
+        Number of steps the agent has been moving in its current cell.
+        """
+        return self._ticks
+
+    @ticks.setter
+    def ticks(self, ticks: int):
+        self._ticks = ticks
+        self._position_fraction = ticks * self._speed
+
+    @property
+    def ticks_per_cell(self) -> int:
+        """
+        Number of moving steps the agent needs to cross a cell at its speed.
+        """
+        return self._ticks_per_cell
+
+    @property
+    def at_cell_start(self) -> bool:
+        return self._ticks == 0
+
+    @property
+    def cell_exit_due(self) -> bool:
+        return 0 < self._ticks_per_cell <= self._ticks
+
+    def advance(self):
+        """
+        Moves the agent by one step within its cell.
+        """
+        if self._ticks_per_cell > 0:
+            self.ticks = self._ticks + 1
+
+    def _sync_ticks(self):
+        self._ticks_per_cell = ticks_per_cell(self._speed)
+        self._ticks = int(round(self._position_fraction / self._speed)) if self._speed > 0 else 0
+
+
+# the keys of the speed data stored in fields of the same name
+_SPEED_KEYS = ('position_fraction', 'speed', 'transition_action_on_cellexit')
+
+
+class SpeedData(MutableMapping):
+    """
+    The speed data of an agent: 'speed', 'position_fraction' and 'transition_action_on_cellexit'.
+
+    `agent.speed_data` is a view of the speed fields of the agent, writing to it writes to the agent. A `SpeedData`
+    created from a dict stores the fields itself. The `ticks`, `ticks_per_cell`, `at_cell_start`, `cell_exit_due` and
+    `advance` of the fields are available on the view.
+    """
+    __slots__ = ('_fields',)
+
+    def __init__(self, *args, **kwargs):
+        fields = _SpeedFields()
+        fields._set_speed_data(dict(*args, **kwargs))
+        self._fields = fields
+
+    @staticmethod
+    def view(fields: _SpeedFields) -> 'SpeedData':
+        speed_data = SpeedData.__new__(SpeedData)
+        speed_data._fields = fields
+        return speed_data
+
+    def __getitem__(self, key):
+        if key in _SPEED_KEYS:
+            return getattr(self._fields, key)
+        extras = self._fields.speed_extras
+        if extras is None:
+            raise KeyError(key)
+        return extras[key]
+
+    def __setitem__(self, key, value):
+        if key in _SPEED_KEYS:
+            setattr(self._fields, key, value)
+        elif self._fields.speed_extras is None:
+            self._fields.speed_extras = {key: value}
+        else:
+            self._fields.speed_extras[key] = value
+
+    def __delitem__(self, key):
+        if key in _SPEED_KEYS:
+            raise KeyError("'{}' cannot be removed from the speed data".format(key))
+        extras = self._fields.speed_extras
+        if extras is None:
+            raise KeyError(key)
+        del extras[key]
+
+    def __iter__(self):
+        yield from _SPEED_KEYS
+        if self._fields.speed_extras is not None:
+            yield from self._fields.speed_extras
+
+    def __len__(self):
+        extras = self._fields.speed_extras
+        return len(_SPEED_KEYS) + (0 if extras is None else len(extras))
+
+    def __repr__(self):
+        return 'SpeedData({!r})'.format(dict(self))
+
+    def __reduce__(self):
+        return SpeedData, (dict(self),)
+
+    @property
+    def ticks(self) -> int:
+        """
+        Number of steps the agent has been moving in its current cell.
+        """
+        return self._fields.ticks
+
+    @ticks.setter
+    def ticks(self, ticks: int):
+        self._fields.ticks = ticks
+
+    @property
+    def ticks_per_cell(self) -> int:
+        """
+        Number of moving steps the agent needs to cross a cell at its speed.
+        """
+        return self._fields.ticks_per_cell
+
+    @property
+    def at_cell_start(self) -> bool:
+        return self._fields.at_cell_start
+
+    @property
+    def cell_exit_due(self) -> bool:
+        return self._fields.cell_exit_due
+
+    def advance(self):
+        """
+        Moves the agent by one step within its cell.
+        """
+        self._fields.advance()
+
+    def copy(self) -> 'SpeedData':
+        """
+        Copy storing its own fields, detached from the agent.
+        """
+        return SpeedData(self)
+
+
+# the keys of the malfunction data stored in fields of the same name, 'moving_before_malfunction' is missing while
+# its field is None
+_MALFUNCTION_KEYS = ('malfunction', 'malfunction_rate', 'next_malfunction', 'nr_malfunctions')
+
+
+class MalfunctionData(MutableMapping):
+    """
+    View of the malfunction fields of an agent: 'malfunction', 'malfunction_rate', 'next_malfunction',
+    'nr_malfunctions' and 'moving_before_malfunction', writing to it writes to the agent.
+    """
+    __slots__ = ('_agent',)
+
+    def __init__(self, agent: 'EnvAgent'):
+        self._agent = agent
+
+    def __getitem__(self, key):
+        agent = self._agent
+        if key in _MALFUNCTION_KEYS:
+            return getattr(agent, key)
+        if key == 'moving_before_malfunction' and agent.moving_before_malfunction is not None:
+            return agent.moving_before_malfunction
+        if agent.malfunction_extras is None:
+            raise KeyError(key)
+        return agent.malfunction_extras[key]
+
+    def __setitem__(self, key, value):
+        agent = self._agent
+        if key in _MALFUNCTION_KEYS or key == 'moving_before_malfunction':
+            setattr(agent, key, value)
+        elif agent.malfunction_extras is None:
+            agent.malfunction_extras = {key: value}
+        else:
+            agent.malfunction_extras[key] = value
+
+    def __delitem__(self, key):
+        agent = self._agent
+        if key in _MALFUNCTION_KEYS:
+            raise KeyError("'{}' cannot be removed from the malfunction data".format(key))
+        if key == 'moving_before_malfunction' and agent.moving_before_malfunction is not None:
+            agent.moving_before_malfunction = None
+        elif agent.malfunction_extras is None:
+            raise KeyError(key)
+        else:
+            del agent.malfunction_extras[key]
+
+    def __iter__(self):
+        agent = self._agent
+        yield from _MALFUNCTION_KEYS
+        if agent.moving_before_malfunction is not None:
+            yield 'moving_before_malfunction'
+        if agent.malfunction_extras is not None:
+            yield from agent.malfunction_extras
+
+    def __len__(self):
+        agent = self._agent
+        return len(_MALFUNCTION_KEYS) + (agent.moving_before_malfunction is not None) + (
+            0 if agent.malfunction_extras is None else len(agent.malfunction_extras))
+
+    def __repr__(self):
+        return 'MalfunctionData({!r})'.format(dict(self))
+
+    def copy(self) -> dict:
+        return dict(self)
+
+
 Agent = NamedTuple('Agent', [('initial_position', Tuple[int, int]),
                              ('initial_direction', Grid4TransitionsEnum),
                              ('direction', Grid4TransitionsEnum),
@@ -28,37 +291,88 @@ Agent = NamedTuple('Agent', [('initial_position', Tuple[int, int]),
                              ('old_direction', Grid4TransitionsEnum),
                              ('old_position', Tuple[int, int])])
 
+_DEFAULT_SPEED_DATA = {'position_fraction': 0.0, 'speed': 1.0, 'transition_action_on_cellexit': 0}
+_DEFAULT_MALFUNCTION_DATA = {'malfunction': 0, 'malfunction_rate': 0, 'next_malfunction': 0, 'nr_malfunctions': 0,
+                             'moving_before_malfunction': False}
+
+# the fields of `EnvAgent.get_dynamic_state`, followed by copies of the extra speed and malfunction data
+_DYNAMIC_ATTRIBUTES = ('position', 'direction', 'old_position', 'old_direction', 'status', 'moving', '_speed',
+                       '_position_fraction', '_ticks', '_ticks_per_cell', 'transition_action_on_cellexit',
+                       'malfunction', 'malfunction_rate', 'next_malfunction', 'nr_malfunctions',
+                       'moving_before_malfunction')
+_get_dynamic_attributes = attrgetter(*_DYNAMIC_ATTRIBUTES)
+
+
+def _copy_extras(extras: Optional[dict]) -> Optional[dict]:
+    return None if extras is None else dict(extras)
+
+
+class EnvAgent(_SpeedFields):
+    """
+    An agent of the environment, with its speed and malfunction data in plain fields.
+
+    speed_data: speed is added to position_fraction on each moving step, until position_fraction>=1.0, after which
+    'transition_action_on_cellexit' is executed (equivalent to executing that action in the previous cell if speed=1,
+    as default).
+
+    malfunction_data: if malfunction>0, the agent's actions are ignored for 'malfunction' steps, nr_malfunctions
+    counts the times the agent had to stop.
+
+    `speed_data` and `malfunction_data` are read/write dict-compatible views of these fields, dicts can be assigned
+    to them.
+    """
+    __slots__ = ('initial_position', 'initial_direction', 'direction', 'target', 'moving', 'handle', 'status',
+                 'position', 'old_direction', 'old_position', 'malfunction', 'malfunction_rate', 'next_malfunction',
+                 'nr_malfunctions', 'moving_before_malfunction', 'malfunction_extras')
 
-@attrs
-class EnvAgent:
-    initial_position = attrib(type=Tuple[int, int])
-    initial_direction = attrib(type=Grid4TransitionsEnum)
-    direction = attrib(type=Grid4TransitionsEnum)
-    target = attrib(type=Tuple[int, int])
-    moving = attrib(default=False, type=bool)
+    def __init__(self, initial_position: Tuple[int, int], initial_direction: Grid4TransitionsEnum,
+                 direction: Grid4TransitionsEnum, target: Tuple[int, int], moving: bool = False,
+                 speed_data: Optional[Mapping] = None, malfunction_data: Optional[Mapping] = None, handle=None,
+                 status: RailAgentStatus = RailAgentStatus.READY_TO_DEPART,
+                 position: Optional[Tuple[int, int]] = None, old_direction=None, old_position=None):
+        self.initial_position = initial_position
+        self.initial_direction = initial_direction
+        self.direction = direction
+        self.target = target
+        self.moving = moving
+        self.speed_data = speed_data if speed_data is not None else _DEFAULT_SPEED_DATA
+        self.malfunction_data = malfunction_data if malfunction_data is not None else _DEFAULT_MALFUNCTION_DATA
+        self.handle = handle
+        self.status = status
+        self.position = position
+        # used in rendering
+        self.old_direction = old_direction
+        self.old_position = old_position
 
-    # speed_data: speed is added to position_fraction on each moving step, until position_fraction>=1.0,
-    # after which 'transition_action_on_cellexit' is executed (equivalent to executing that action in the previous
-    # cell if speed=1, as default)
-    # N.B. we need to use factory since default arguments are not recreated on each call!
-    speed_data = attrib(
-        default=Factory(lambda: dict({'position_fraction': 0.0, 'speed': 1.0, 'transition_action_on_cellexit': 0})))
+    @property
+    def speed_data(self) -> SpeedData:
+        return SpeedData.view(self)
 
-    # if broken>0, the agent's actions are ignored for 'broken' steps
-    # number of time the agent had to stop, since the last time it broke down
-    malfunction_data = attrib(
-        default=Factory(
-            lambda: dict({'malfunction': 0, 'malfunction_rate': 0, 'next_malfunction': 0, 'nr_malfunctions': 0,
-                          'moving_before_malfunction': False})))
+    @speed_data.setter
+    def speed_data(self, speed_data: Mapping):
+        self._set_speed_data(speed_data)
 
-    handle = attrib(default=None)
+    @property
+    def malfunction_data(self) -> MalfunctionData:
+        return MalfunctionData(self)
 
-    status = attrib(default=RailAgentStatus.READY_TO_DEPART, type=RailAgentStatus)
-    position = attrib(default=None, type=Optional[Tuple[int, int]])
+    @malfunction_data.setter
+    def malfunction_data(self, malfunction_data: Mapping):
+        malfunction_data = dict(malfunction_data)
+        self.malfunction = malfunction_data.pop('malfunction', 0)
+        self.malfunction_rate = malfunction_data.pop('malfunction_rate', 0)
+        self.next_malfunction = malfunction_data.pop('next_malfunction', 0)
+        self.nr_malfunctions = malfunction_data.pop('nr_malfunctions', 0)
+        self.moving_before_malfunction = malfunction_data.pop('moving_before_malfunction', None)
+        self.malfunction_extras = malfunction_data if len(malfunction_data) > 0 else None
 
-    # used in rendering
-    old_direction = attrib(default=None)
-    old_position = attrib(default=None)
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.to_agent() == other.to_agent()
+
+    def __repr__(self):
+        return 'EnvAgent({})'.format(', '.join(starmap('{}={!r}'.format, zip(Agent._fields, self.to_agent()))))
 
     def reset(self):
         """
@@ -73,19 +387,45 @@ class EnvAgent:
         self.moving = False
 
         # Reset agent values for speed
-        self.speed_data['position_fraction'] = 0.
-        self.speed_data['transition_action_on_cellexit'] = 0.
+        self.position_fraction = 0.
+        self.transition_action_on_cellexit = 0.
 
         # Reset agent malfunction values
-        self.malfunction_data['malfunction'] = 0
-        self.malfunction_data['nr_malfunctions'] = 0
-        self.malfunction_data['moving_before_malfunction'] = False
+        self.malfunction = 0
+        self.nr_malfunctions = 0
+        self.moving_before_malfunction = False
+
+    def get_dynamic_state(self) -> Tuple:
+        """
+        Copy of the attributes changed by the environment steps, to be restored by `set_dynamic_state`.
+        """
+        return _get_dynamic_attributes(self) + (_copy_extras(self.speed_extras),
+                                                _copy_extras(self.malfunction_extras))
+
+    def set_dynamic_state(self, state: Tuple):
+        """
+        Restores the attributes from a state of `get_dynamic_state`. The state can be restored several times.
+        """
+        # the fields are written directly in the order of `_DYNAMIC_ATTRIBUTES`, none of them has to be converted
+        (self.position, self.direction, self.old_position, self.old_direction, self.status, self.moving, self._speed,
+         self._position_fraction, self._ticks, self._ticks_per_cell, self.transition_action_on_cellexit,
+         self.malfunction, self.malfunction_rate, self.next_malfunction, self.nr_malfunctions,
+         self.moving_before_malfunction, speed_extras, malfunction_extras) = state
+        self.speed_extras = _copy_extras(speed_extras)
+        self.malfunction_extras = _copy_extras(malfunction_extras)
+
+    def has_dynamic_state(self, state: Tuple) -> bool:
+        """
+        Whether the attributes changed by the environment steps are equal to the state of `get_dynamic_state`.
+        """
+        return _get_dynamic_attributes(self) + (self.speed_extras, self.malfunction_extras) == state
 
     def to_agent(self) -> Agent:
         return Agent(initial_position=self.initial_position, initial_direction=self.initial_direction,
-                     direction=self.direction, target=self.target, moving=self.moving, speed_data=self.speed_data,
-                     malfunction_data=self.malfunction_data, handle=self.handle, status=self.status,
-                     position=self.position, old_direction=self.old_direction, old_position=self.old_position)
+                     direction=self.direction, target=self.target, moving=self.moving,
+                     speed_data=dict(self.speed_data), malfunction_data=dict(self.malfunction_data),
+                     handle=self.handle, status=self.status, position=self.position,
+                     old_direction=self.old_direction, old_position=self.old_position)
 
     @classmethod
     def from_schedule(cls, schedule: Schedule):
@@ -0,0 +1,247 @@
+"""
+Compiled rail: lookup tables of the transitions of a `GridTransitionMap` for action resolution.
+
+`RailEnv.check_action`, the step engines and the path helpers in `rail_env_shortest_paths` resolve the actions of
+agents on the 16-bit cell codes of the rail. The `CompiledRail` decodes the cell codes of the rail cells once into
+tables indexed by (cell, direction, action), which give the next direction and whether the move is valid. The cells
+are the rail cells only, such that the tables of a large grid with few rail cells stay small: `cell_index` gives the
+cell of a (row, column) position. The cells of a `SparseGridTransitionMap` are its cell ids, its dense grid is not
+built.
+
+The actions index the last axis with the values of `RailEnvActions` (DO_NOTHING=0, MOVE_LEFT=1, MOVE_FORWARD=2,
+MOVE_RIGHT=3, STOP_MOVING=4).
+"""
+import copy
+from typing import Optional, Tuple
+
+import numpy as np
+
+from flatland.core.grid.grid4 import Grid4Transitions
+from flatland.core.transition_map import GridTransitionMap, SparseGridTransitionMap
+from flatland.envs.level_cache import LevelCache
+
+# same values as RailEnvActions, which cannot be imported here as the RailEnv depends on this module
+_DO_NOTHING = 0
+_MOVE_LEFT = 1
+_MOVE_FORWARD = 2
+_MOVE_RIGHT = 3
+_STOP_MOVING = 4
+NUMBER_OF_ACTIONS = 5
+
+# (row, column) offset of the neighbouring cell in direction N, E, S, W
+DIRECTION_OFFSETS = np.array([(-1, 0), (0, 1), (1, 0), (0, -1)], dtype=int)
+
+
+class CompiledRail:
+    """
+    Lookup tables of a `GridTransitionMap` with `Grid4Transitions`, indexed by (cell, direction, action).
+
+    The cells are the rail cells, `cell_positions` gives the (row, column) of each cell, `cell_index` and `cell` the
+    cell of positions. Positions without rail have the cell -1, the last row of the tables, which holds the
+    transitions of an empty cell: none of its moves are valid.
+
+    `action_direction`, `action_transition_valid` and `action_cell_valid` resolve an action the way
+    `RailEnv.check_action` and `RailEnv._check_action_on_agent` do (without checking whether the new cell is free),
+    `action_valid` is true if both the transition and the new cell are valid.
+    `move_direction` and `move_valid` give the move actions (left, forward, right) of `get_valid_move_actions_`.
+    """
+
+    def __init__(self, rail: GridTransitionMap):
+        assert isinstance(rail.transitions, Grid4Transitions), "the rail must have Grid4Transitions"
+        self.grid = _grid_of(rail)
+        self.height, self.width = rail.shape
+        # `GridTransitionMap.fingerprint` of the grid, if the compiled rail was looked up by it
+        self.fingerprint: Optional[str] = None
+        # further lookups derived from the tables, e.g. by the path helpers
+        self.cache = {}
+
+        # the cell of each position of a dense grid, or the cell of each (row, column) of the rail cells of a sparse
+        # map, which are looked up by their sorted keys row * width + column
+        self._cell_of: Optional[np.ndarray] = None
+        self._cell_ids: Optional[dict] = None
+        if isinstance(rail, SparseGridTransitionMap):
+            self.cell_positions: np.ndarray = rail.cell_positions.copy()
+            self._cell_ids = {cell: cell_id for cell_id, cell in enumerate(map(tuple, self.cell_positions.tolist()))}
+            keys = self.cell_positions[:, 0] * self.width + self.cell_positions[:, 1]
+            self._sorted_cells = np.argsort(keys)
+            self._sorted_keys = keys[self._sorted_cells]
+            self._compile(rail.cell_transitions)
+        else:
+            rows, columns = np.nonzero(self.grid)
+            self.cell_positions: np.ndarray = np.stack([rows, columns], axis=1)
+            self._cell_of = np.full((self.height, self.width), -1, dtype=np.int32)
+            self._cell_of[rows, columns] = np.arange(len(rows))
+            self._compile(self.grid[rows, columns])
+
+    @property
+    def number_of_cells(self) -> int:
+        return len(self.cell_positions)
+
+    def cell_index(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """
+        The cells of the positions (rows, columns), elementwise, -1 for positions without rail or outside of the
+        grid.
+        """
+        rows, columns = np.asarray(rows), np.asarray(columns)
+        in_grid = (rows >= 0) & (rows < self.height) & (columns >= 0) & (columns < self.width)
+        if self._cell_of is not None:
+            return np.where(in_grid, self._cell_of[np.where(in_grid, rows, 0), np.where(in_grid, columns, 0)], -1)
+        if len(self._sorted_keys) == 0:
+            return np.full(np.shape(in_grid), -1)
+        keys = rows * self.width + columns
+        found = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+        return np.where(in_grid & (self._sorted_keys[found] == keys), self._sorted_cells[found], -1)
+
+    def cell(self, row: int, column: int) -> int:
+        """
+        The cell of the position (row, column), -1 if it has no rail or is outside of the grid.
+        """
+        if self._cell_ids is not None:
+            return self._cell_ids.get((row, column), -1)
+        if 0 <= row < self.height and 0 <= column < self.width:
+            return int(self._cell_of[row, column])
+        return -1
+
+    def _compile(self, cells: np.ndarray):
+        """
+        Builds the tables from the transitions of the rail cells, in the order of `cell_positions`.
+        """
+        # the last row is the one of the positions without rail
+        cells = np.append(cells, 0).astype(np.int64)
+        number_of_rows = len(cells)
+        directions = np.arange(4)
+        shifts = (3 - directions)[:, None] * 4 + (3 - directions)[None, :]
+        # transitions[cell, orientation, direction] as in `GridTransitionMap.get_transition`
+        self.transitions: np.ndarray = ((cells[:, None, None] >> shifts) & 1).astype(bool)
+        num_transitions = np.count_nonzero(self.transitions, axis=2)
+        is_dead_end = np.count_nonzero((cells[:, None] >> np.arange(16)) & 1, axis=1) == 1
+
+        shape = (number_of_rows, 4, NUMBER_OF_ACTIONS)
+        cell_rows = np.broadcast_to(np.arange(number_of_rows)[:, None], (number_of_rows, 4))
+        orientations = np.broadcast_to(directions, (number_of_rows, 4))
+
+        # RailEnv.check_action
+        self.action_direction = np.empty(shape, dtype=np.int8)
+        self.action_transition_valid = np.empty(shape, dtype=bool)
+        single_transition = np.argmax(self.transitions, axis=2)
+        for action in range(NUMBER_OF_ACTIONS):
+            new_direction = orientations
+            if action == _MOVE_LEFT:
+                new_direction = (orientations - 1) % 4
+            elif action == _MOVE_RIGHT:
+                new_direction = (orientations + 1) % 4
+            transition_valid = self.transitions[cell_rows, orientations, new_direction]
+            if action in (_MOVE_LEFT, _MOVE_RIGHT):
+                transition_valid &= num_transitions > 1
+            elif action == _MOVE_FORWARD:
+                only = num_transitions == 1
+                new_direction = np.where(only, single_transition, new_direction)
+                transition_valid = np.where(only, True, transition_valid)
+            self.action_direction[..., action] = new_direction
+            self.action_transition_valid[..., action] = transition_valid
+        # the new cell is valid if it has rail, the positions without rail have no neighbours
+        positions = self.cell_positions[:, :, None, None]
+        offsets = DIRECTION_OFFSETS[self.action_direction[:-1]]
+        neighbours = self.cell_index(positions[:, 0] + offsets[..., 0], positions[:, 1] + offsets[..., 1])
+        self.action_cell_valid = np.zeros(shape, dtype=bool)
+        self.action_cell_valid[:-1] = cells[neighbours] > 0
+        self.action_valid = self.action_cell_valid & self.action_transition_valid
+
+        # get_valid_move_actions_
+        self.move_direction = np.zeros(shape, dtype=np.int8)
+        self.move_valid = np.zeros(shape, dtype=bool)
+        for action, turn in [(_MOVE_LEFT, -1), (_MOVE_FORWARD, 0), (_MOVE_RIGHT, 1)]:
+            new_direction = (orientations + turn) % 4
+            self.move_direction[..., action] = new_direction
+            self.move_valid[..., action] = self.transitions[cell_rows, orientations, new_direction] & (
+                num_transitions > 1)
+        # a single transition is taken by moving forward, towards the left, front or right
+        for turn in [1, 0, -1]:
+            new_direction = (orientations + turn) % 4
+            single = (num_transitions == 1) & self.transitions[cell_rows, orientations, new_direction]
+            self.move_direction[..., _MOVE_FORWARD][single] = new_direction[single]
+            self.move_valid[..., _MOVE_FORWARD] |= single
+        # in a dead-end, the agent turns around
+        dead_end = np.broadcast_to(is_dead_end[:, None], orientations.shape)
+        self.move_valid[dead_end] = False
+        turn_around = (orientations + 2) % 4
+        turn_around_valid = dead_end & self.transitions[cell_rows, orientations, turn_around]
+        self.move_valid[..., _MOVE_FORWARD] |= turn_around_valid
+        self.move_direction[..., _MOVE_FORWARD][turn_around_valid] = turn_around[turn_around_valid]
+
+    @staticmethod
+    def for_rail(rail: GridTransitionMap, recompile: bool = False, fingerprint: Optional[str] = None,
+                 cache: Optional[LevelCache] = None) -> 'CompiledRail':
+        """
+        Returns the compiled rail of `rail`, compiling it if it has not been compiled before, its grid has been
+        replaced or its transitions have been set since. A `SparseGridTransitionMap` drops its compiled rail on every
+        change of its cells.
+
+        The compiled rail does not notice if cells of the grid array are overwritten directly, use `recompile`
+        in this case, or pass the current `rail.fingerprint()`, which is compared to the one the rail was compiled
+        for. With a `cache`, the tables of a grid with the same fingerprint are reused from it, also if they were
+        compiled for another rail object, e.g. a level loaded again.
+        """
+        compiled_rail = getattr(rail, 'compiled_rail', None)
+        if fingerprint is not None:
+            if compiled_rail is None or compiled_rail.fingerprint != fingerprint or \
+                    compiled_rail.grid is not _grid_of(rail):
+                compiled_rail = CompiledRail._for_fingerprint(rail, fingerprint, cache)
+                rail.compiled_rail = compiled_rail
+            return compiled_rail
+        if recompile or compiled_rail is None or compiled_rail.grid is not _grid_of(rail):
+            compiled_rail = CompiledRail(rail)
+            rail.compiled_rail = compiled_rail
+        return compiled_rail
+
+    @staticmethod
+    def _for_fingerprint(rail: GridTransitionMap, fingerprint: str, cache: Optional[LevelCache]) -> 'CompiledRail':
+        cached = cache.get_compiled_rail(fingerprint) if cache is not None else None
+        if cached is None:
+            cached = CompiledRail(rail)
+            cached.fingerprint = fingerprint
+            if cache is not None:
+                cache.put_compiled_rail(fingerprint, cached)
+        grid = _grid_of(rail)
+        if cached.grid is grid:
+            return cached
+        # the tables are shared, the grid is the one of the rail, such that a replaced grid is noticed
+        compiled_rail = copy.copy(cached)
+        compiled_rail.grid = grid
+        return compiled_rail
+
+    def resolve(self, position: Tuple[int, int], direction: int, action: int) -> Tuple[bool, Tuple[int, int], int]:
+        """
+        Resolves `action` for an agent at `position` facing `direction` like `RailEnv._check_action_on_agent`,
+        without checking whether the new cell is free.
+
+        Returns
+        -------
+        Tuple[bool, Tuple[int,int], int]
+            whether the new cell and the transition are valid, the new position and the new direction
+        """
+        cell = (self.cell(position[0], position[1]), direction, min(action, _STOP_MOVING))
+        new_direction = int(self.action_direction[cell])
+        offset = DIRECTION_OFFSETS[new_direction]
+        return bool(self.action_valid[cell]), (position[0] + int(offset[0]), position[1] + int(offset[1])), \
+            new_direction
+
+    def move(self, position: Tuple[int, int], direction: int, action: int) -> Optional[Tuple[Tuple[int, int], int]]:
+        """
+        Next position and direction of the move `action` (left, forward or right) for an agent at `position`
+        facing `direction` as in `get_valid_move_actions_`, or None if the move is not possible.
+        """
+        cell = (self.cell(position[0], position[1]), direction, action)
+        if not self.move_valid[cell]:
+            return None
+        new_direction = int(self.move_direction[cell])
+        offset = DIRECTION_OFFSETS[new_direction]
+        return (position[0] + int(offset[0]), position[1] + int(offset[1])), new_direction
+
+
+def _grid_of(rail: GridTransitionMap) -> Optional[np.ndarray]:
+    """
+    The grid a compiled rail is checked against to notice a replaced grid, None for a `SparseGridTransitionMap`,
+    whose dense grid is only a copy built on demand.
+    """
+    return None if isinstance(rail, SparseGridTransitionMap) else rail.grid
@@ -1,28 +1,33 @@
-from collections import deque
 from typing import List, Optional
 
 import numpy as np
 
-from flatland.core.grid.grid4_utils import get_new_position
 from flatland.core.transition_map import GridTransitionMap
 from flatland.envs.agent_utils import EnvAgent
+from flatland.envs.level_cache import LevelCache
 
 
 class DistanceMap:
-    def __init__(self, agents: List[EnvAgent], env_height: int, env_width: int):
+    def __init__(self, agents: List[EnvAgent], env_height: int, env_width: int, cache: Optional[LevelCache] = None):
         self.env_height = env_height
         self.env_width = env_width
+        # the computed distance maps are shared through the cache, if given
+        self.cache = cache
+        # (rail fingerprint, targets) the distance map was computed for
+        self.distance_map_key = None
         self.distance_map = None
         self.agents_previous_computation = None
         self.reset_was_called = False
         self.agents: List[EnvAgent] = agents
         self.rail: Optional[GridTransitionMap] = None
+        self.compact_distance_map = None
 
     def set(self, distance_map: np.ndarray):
         """
         Set the distance map
         """
         self.distance_map = distance_map
+        self.distance_map_key = None
 
     def get(self) -> np.ndarray:
         """
@@ -44,6 +49,30 @@ class DistanceMap:
 
         return self.distance_map
 
+    def get_compact(self) -> np.ndarray:
+        """
+        The distance map in the rail-cell index space of the waypoint graph of the rail, without the dense
+        `(n_agents, height, width, 4)` array: the cells of a `SparseGridTransitionMap` are indexed by their cell ids,
+        the cells of a `GridTransitionMap` by `row * width + column`.
+
+        Returns
+        -------
+        np.ndarray
+            `(n_agents, number_of_cells, 4)` array of the distances to the target of each agent
+        """
+        if self.compact_distance_map is None:
+            graph = self.rail.waypoint_graph(fingerprint=self.rail.fingerprint())
+            compact_distance_map = np.empty((len(self.agents), graph.number_of_cells, 4))
+            distances_to_target = {}
+            for i, agent in enumerate(self.agents):
+                target = tuple(agent.target)
+                if target not in distances_to_target:
+                    distances_to_target[target] = graph.distances(graph.node(target[0], target[1], np.arange(4)),
+                                                                  reverse=True).reshape(-1, 4)
+                compact_distance_map[i] = distances_to_target[target]
+            self.compact_distance_map = compact_distance_map
+        return self.compact_distance_map
+
     def reset(self, agents: List[EnvAgent], rail: GridTransitionMap):
         """
         Reset the distance map
@@ -51,23 +80,37 @@ class DistanceMap:
         self.reset_was_called = True
         self.agents: List[EnvAgent] = agents
         self.rail = rail
-        self.env_height = rail.height
-        self.env_width = rail.width
+        self.compact_distance_map = None
+        self.env_height, self.env_width = rail.shape
 
     def _compute(self, agents: List[EnvAgent], rail: GridTransitionMap):
         """
         This function computes the distance maps for each unique target. Thus if several targets are the same
         we only compute the distance for them once and copy to all targets with same position.
+        The distance map of the previous computation, or of the cache, is reused for a rail with the same
+        fingerprint and the same targets. The distance maps put into the cache are read-only, as they are shared
+        with other environments, the others can be written.
         :param agents: All the agents in the environment, independent of their current status
         :param rail: The rail transition map
 
         """
         self.agents_previous_computation = self.agents
+        key = (rail.fingerprint(), tuple(tuple(agent.target) for agent in agents))
+        if key == self.distance_map_key:
+            return
+        cached = self.cache.get_distance_map(key) if self.cache is not None else None
+        if cached is not None:
+            self.distance_map = cached
+            self.distance_map_key = key
+            return
+
         self.distance_map = np.inf * np.ones(shape=(len(agents),
                                                     self.env_height,
                                                     self.env_width,
                                                     4))
 
+        # the graph is built for the current grid, the walker then reuses it
+        rail.waypoint_graph(fingerprint=key[0])
         computed_targets = []
         for i, agent in enumerate(agents):
             if agent.target not in computed_targets:
@@ -78,83 +121,22 @@ class DistanceMap:
                     self.distance_map[computed_targets.index(agent.target), :, :, :])
             computed_targets.append(agent.target)
 
+        self.distance_map_key = key
+        if self.cache is not None:
+            self.distance_map.flags.writeable = False
+            self.cache.put_distance_map(key, self.distance_map)
+
     def _distance_map_walker(self, rail: GridTransitionMap, position, target_nr: int):
         """
         Utility function to compute distance maps from each cell in the rail network (and each possible
-        orientation within it) to each agent's target cell.
+        orientation within it) to each agent's target cell, by a breadth first search from the target over the
+        reverse waypoint graph of the rail.
         """
         # Returns max distance to target, from the farthest away node, while filling in distance_map
+        graph = rail.waypoint_graph()
+        target_nodes = graph.node(position[0], position[1], np.arange(4))
+        distances = graph.distances(target_nodes, reverse=True)
+        self.distance_map[target_nr] = graph.to_grid(distances)
         self.distance_map[target_nr, position[0], position[1], :] = 0
-
-        # Fill in the (up to) 4 neighboring nodes
-        # direction is the direction of movement, meaning that at least a possible orientation of an agent
-        # in cell (row,col) allows a movement in direction `direction'
-        nodes_queue = deque(self._get_and_update_neighbors(rail, position, target_nr, 0, enforce_target_direction=-1))
-
-        # BFS from target `position' to all the reachable nodes in the grid
-        # Stop the search if the target position is re-visited, in any direction
-        visited = {(position[0], position[1], 0), (position[0], position[1], 1), (position[0], position[1], 2),
-                   (position[0], position[1], 3)}
-
-        max_distance = 0
-
-        while nodes_queue:
-            node = nodes_queue.popleft()
-
-            node_id = (node[0], node[1], node[2])
-
-            if node_id not in visited:
-                visited.add(node_id)
-
-                # From the list of possible neighbors that have at least a path to the current node, only keep those
-                # whose new orientation in the current cell would allow a transition to direction node[2]
-                valid_neighbors = self._get_and_update_neighbors(rail, (node[0], node[1]), target_nr, node[3], node[2])
-
-                for n in valid_neighbors:
-                    nodes_queue.append(n)
-
-                if len(valid_neighbors) > 0:
-                    max_distance = max(max_distance, node[3] + 1)
-
-        return max_distance
-
-    def _get_and_update_neighbors(self, rail: GridTransitionMap, position, target_nr, current_distance,
-                                  enforce_target_direction=-1):
-        """
-        Utility function used by _distance_map_walker to perform a BFS walk over the rail, filling in the
-        minimum distances from each target cell.
-        """
-        neighbors = []
-
-        possible_directions = [0, 1, 2, 3]
-        if enforce_target_direction >= 0:
-            # The agent must land into the current cell with orientation `enforce_target_direction'.
-            # This is only possible if the agent has arrived from the cell in the opposite direction!
-            possible_directions = [(enforce_target_direction + 2) % 4]
-
-        for neigh_direction in possible_directions:
-            new_cell = get_new_position(position, neigh_direction)
-
-            if new_cell[0] >= 0 and new_cell[0] < self.env_height and new_cell[1] >= 0 and new_cell[1] < self.env_width:
-
-                desired_movement_from_new_cell = (neigh_direction + 2) % 4
-
-                # Check all possible transitions in new_cell
-                for agent_orientation in range(4):
-                    # Is a transition along movement `desired_movement_from_new_cell' to the current cell possible?
-                    is_valid = rail.get_transition((new_cell[0], new_cell[1], agent_orientation),
-                                                   desired_movement_from_new_cell)
-
-                    if is_valid:
-                        """
-                        # TODO: check that it works with deadends! -- still bugged!
-                        movement = desired_movement_from_new_cell
-                        if isNextCellDeadEnd:
-                            movement = (desired_movement_from_new_cell+2) % 4
-                        """
-                        new_distance = min(self.distance_map[target_nr, new_cell[0], new_cell[1], agent_orientation],
-                                           current_distance + 1)
-                        neighbors.append((new_cell[0], new_cell[1], agent_orientation, new_distance))
-                        self.distance_map[target_nr, new_cell[0], new_cell[1], agent_orientation] = new_distance
-
-        return neighbors
+        reachable = distances[np.isfinite(distances)]
+        return int(reachable.max()) if len(reachable) > 0 else 0
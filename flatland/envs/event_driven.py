@@ -0,0 +1,329 @@
+"""
+Discrete-event simulation backend for the RailEnv.
+
+Agents with fractional speeds and malfunctioning agents spend many consecutive steps in which no agent can take an
+action. The `EventDrivenBackend` keeps a priority queue of the next event of every agent (a cell exit or the end of a
+malfunction) and advances the environment over the steps in between without computing actions, info or
+observations. Only the steps in which an event happens are performed as regular steps, and the observations are
+only built once an agent can act.
+
+If `RailEnv.skips_finished_agents()`, the steps up to the next event are skipped in one go: the agents move by the
+number of skipped steps within their cells, and with `agent_random_streams` the malfunctions of each agent are drawn
+from its streams for the skipped steps. Otherwise the malfunctions are drawn from the shared random stream of the
+environment, one agent after the other, and the steps are skipped one at a time, such that the random stream and
+therefore the episode are the same as when stepping the environment with empty action dicts. The steps are also
+skipped one at a time while the steps are recorded or journaled.
+"""
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+
+
+class EventDrivenBackend:
+    """
+    Advances a `RailEnv` from decision to decision.
+
+    A decision is required as soon as an agent can take an action, i.e. it is ready to depart, or it is active at the
+    beginning of a cell and not malfunctioning.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        # priority queue of (elapsed step of the event, handle), stale entries are skipped
+        self._events: List[Tuple[int, int]] = []
+        self._event_step: Dict[int, int] = {}
+
+    def decision_required(self, agent: EnvAgent) -> bool:
+        """
+        Whether the `agent` can take an action in the next step.
+        """
+        return self.env.action_required(agent) and agent.malfunction < 1
+
+    def steps_to_event(self, agent: EnvAgent) -> Optional[int]:
+        """
+        Number of steps until the next event of the `agent` if no new malfunction occurs: the step in which it exits
+        its cell, or the step at the end of which its malfunction is repaired at the beginning of a cell.
+
+        Returns
+        -------
+        Optional[int]
+            `None` if the agent has no upcoming event (done or not moving)
+        """
+        if agent.status != RailAgentStatus.ACTIVE:
+            return None
+        steps_broken = max(agent.malfunction, 0)
+        if agent.at_cell_start:
+            return steps_broken if steps_broken > 0 else None
+        moving = agent.moving
+        if steps_broken > 0 and agent.moving_before_malfunction is not None:
+            moving = agent.moving_before_malfunction
+        if not moving or agent.ticks_per_cell == 0:
+            return None
+        return steps_broken + max(agent.ticks_per_cell - agent.ticks, 1)
+
+    def _schedule(self, agent: EnvAgent):
+        steps = self.steps_to_event(agent)
+        if steps is None:
+            self._event_step.pop(agent.handle, None)
+            return
+        event_step = self.env._elapsed_steps + steps
+        self._event_step[agent.handle] = event_step
+        heapq.heappush(self._events, (event_step, agent.handle))
+
+    def _next_event_step(self) -> Optional[int]:
+        while len(self._events) > 0:
+            event_step, handle = self._events[0]
+            if self._event_step.get(handle) == event_step:
+                return event_step
+            heapq.heappop(self._events)
+        return None
+
+    def _skip_step(self) -> (List[int], Dict):
+        """
+        Performs a step in which no agent exits a cell and no agent can act. Rewards are added to `env.rewards_dict`.
+
+        Returns
+        -------
+        broken_down: List[int]
+            Handles of the agents which broke down in this step.
+        info_dict: Dict
+            The info of `RailEnv.step()` for this step
+        """
+        env = self.env
+        if env.observation_pipeline is not None:
+            env.observation_pipeline.sync()
+        if env.journal is not None:
+            env.journal.begin()
+        env._track_agents_changed()
+        env._elapsed_steps += 1
+        env.rewards_dict = {}
+        info_dict = _empty_info()
+        broken_down = []
+        modified = []
+        skip_finished = env.skips_finished_agents()
+        for i_agent, agent in enumerate(env.agents):
+            env.rewards_dict[i_agent] = 0
+            if skip_finished and agent.status in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED]:
+                _record_info(info_dict, env, agent)
+                continue
+            changed = env._break_agent(agent)
+            if changed:
+                broken_down.append(i_agent)
+
+            if agent.status == RailAgentStatus.ACTIVE:
+                if env.journal is not None:
+                    env.journal.record_agent(agent)
+                agent.old_direction = agent.direction
+                agent.old_position = agent.position
+                if agent.malfunction < 1 and agent.moving:
+                    agent.advance()
+                    changed = True
+                env.rewards_dict[i_agent] += env.step_penalty * agent.speed
+            elif agent.status == RailAgentStatus.READY_TO_DEPART:
+                env.rewards_dict[i_agent] += env.step_penalty * agent.speed
+
+            # the info is recorded before the malfunction is fixed, like in `RailEnv.step()`
+            _record_info(info_dict, env, agent)
+            changed |= env._fix_agent_after_malfunction(agent)
+            if changed and env.incremental_hash is not None:
+                env.incremental_hash.update(i_agent, agent)
+            if changed or agent.status == RailAgentStatus.ACTIVE:
+                modified.append(i_agent)
+        if env.step_engine is not None:
+            env.step_engine.agents_modified(modified)
+        if env.action_masks is not None:
+            env.action_masks.agents_modified(modified)
+        if env.record_steps:
+            env.record_timestep()
+        return broken_down, info_dict
+
+    def _skip_steps(self, number_of_steps: int) -> (List[int], Dict, np.ndarray):
+        """
+        Performs `number_of_steps` steps in which no agent exits a cell and no agent can act at once, if
+        `RailEnv.skips_finished_agents()`.
+
+        Returns
+        -------
+        broken_down: List[int]
+            Handles of the agents which broke down in these steps.
+        info_dict: Dict
+            The info of `RailEnv.step()` for the last of these steps
+        rewards: np.ndarray
+            The rewards of each agent accumulated over these steps
+        """
+        env = self.env
+        if env.observation_pipeline is not None:
+            env.observation_pipeline.sync()
+        env._track_agents_changed()
+        first_step = env._elapsed_steps + 1
+        env._elapsed_steps += number_of_steps
+        env.rewards_dict = {}
+        rewards = np.zeros(env.get_num_agents())
+        info_dict = _empty_info()
+        broken_down = []
+        modified = []
+        random_streams = env.random_streams
+        for i_agent, agent in enumerate(env.agents):
+            env.rewards_dict[i_agent] = 0
+            if agent.status in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED]:
+                _record_info(info_dict, env, agent)
+                continue
+            nr_malfunctions = agent.nr_malfunctions
+            changed = agent.malfunction >= 1
+            # the malfunction of the last step before it is fixed, for the info
+            malfunction = agent.malfunction
+            moving_steps = 0
+            step = first_step
+            while step < first_step + number_of_steps:
+                if random_streams is None:
+                    steps = first_step + number_of_steps - step
+                else:
+                    # the malfunctions are drawn step by step, a malfunction changes the following draws
+                    steps = 1
+                    num_broken_steps = env.malfunction_generator(agent, random_streams.for_agent(i_agent, step)) \
+                        .num_broken_steps
+                    if num_broken_steps > 0:
+                        agent.malfunction = num_broken_steps
+                        agent.moving_before_malfunction = agent.moving
+                        agent.nr_malfunctions += 1
+                broken_steps = min(max(agent.malfunction, 0), steps)
+                if broken_steps > 0:
+                    malfunction = agent.malfunction - broken_steps + 1
+                    agent.malfunction -= broken_steps
+                    if agent.malfunction < 1 and agent.moving_before_malfunction is not None:
+                        agent.moving = agent.moving_before_malfunction
+                if broken_steps < steps:
+                    malfunction = agent.malfunction
+                    if agent.status == RailAgentStatus.ACTIVE and agent.moving:
+                        moving_steps += steps - broken_steps
+                step += steps
+
+            if agent.nr_malfunctions != nr_malfunctions:
+                broken_down.append(i_agent)
+                changed = True
+            if agent.status == RailAgentStatus.ACTIVE:
+                agent.old_direction = agent.direction
+                agent.old_position = agent.position
+                if moving_steps > 0 and agent.ticks_per_cell > 0:
+                    agent.ticks = agent.ticks + moving_steps
+                    changed = True
+            env.rewards_dict[i_agent] = env.step_penalty * agent.speed
+            rewards[i_agent] = number_of_steps * env.step_penalty * agent.speed
+
+            info_dict["action_required"][i_agent] = env.action_required(agent)
+            info_dict["malfunction"][i_agent] = malfunction
+            info_dict["speed"][i_agent] = agent.speed
+            info_dict["status"][i_agent] = agent.status
+            if changed and env.incremental_hash is not None:
+                env.incremental_hash.update(i_agent, agent)
+            if changed or agent.status == RailAgentStatus.ACTIVE:
+                modified.append(i_agent)
+        if env.step_engine is not None:
+            env.step_engine.agents_modified(modified)
+        if env.action_masks is not None:
+            env.action_masks.agents_modified(modified)
+        return broken_down, info_dict, rewards
+
+    def advance_until_decision(self, max_steps: Optional[int] = None) -> (Dict, Dict, Dict, Dict, int):
+        """
+        Steps the environment with empty action dicts until an agent can take an action or the episode is done.
+
+        Parameters
+        ----------
+        max_steps : int, optional
+            Maximum number of steps to advance.
+
+        Returns
+        -------
+        observation_dict: Dict
+            Dictionary with an observation for each agent
+        rewards_dict: Dict
+            The rewards of each agent accumulated over the elapsed steps
+        dones: Dict
+            The dones of the agents and the episode
+        info_dict: Dict
+            'action_required', 'malfunction', 'speed' and 'status' of each agent as `RailEnv.step()` returns them for
+            the last step
+        elapsed_steps: int
+            Number of steps the environment was advanced
+        """
+        env = self.env
+        rewards = np.zeros(env.get_num_agents())
+        elapsed_steps = 0
+        info_dict = None
+        perf = env.perf_stats
+        skip_at_once = env.skips_finished_agents() and env.journal is None and not env.record_steps
+
+        self._events = []
+        self._event_step = {}
+        for agent in env.agents:
+            self._schedule(agent)
+
+        while not env.dones["__all__"] and (max_steps is None or elapsed_steps < max_steps):
+            if any(self.decision_required(agent) for agent in env.agents):
+                break
+            # the steps before the next event can be skipped, the last step of the episode is a regular step
+            next_step = self._next_event_step()
+            if env._max_episode_steps is not None:
+                next_step = env._max_episode_steps if next_step is None else min(next_step, env._max_episode_steps)
+            if max_steps is not None:
+                last_step = env._elapsed_steps + max_steps - elapsed_steps
+                next_step = last_step + 1 if next_step is None else min(next_step, last_step + 1)
+            if next_step is None:
+                # no agent can ever act again without intervention
+                break
+
+            if env._elapsed_steps + 1 < next_step:
+                if skip_at_once:
+                    number_of_steps = next_step - 1 - env._elapsed_steps
+                    broken_down, info_dict, skipped_rewards = self._skip_steps(number_of_steps)
+                    rewards += skipped_rewards
+                    elapsed_steps += number_of_steps
+                else:
+                    broken_down, info_dict = self._skip_step()
+                    rewards += list(env.rewards_dict.values())
+                    elapsed_steps += 1
+                for i_agent in broken_down:
+                    self._schedule(env.agents[i_agent])
+                continue
+
+            nr_malfunctions = [agent.nr_malfunctions for agent in env.agents]
+            # the observations are only built once a decision is reached
+            info_dict, _ = env._step_without_observations({})
+            if perf is not None:
+                perf.stop()
+                if env.dones["__all__"]:
+                    perf.episode_end()
+            rewards += list(env.rewards_dict.values())
+            elapsed_steps += 1
+            for agent, n in zip(env.agents, nr_malfunctions):
+                event_due = self._event_step.get(agent.handle) == env._elapsed_steps
+                if event_due or agent.nr_malfunctions != n:
+                    self._schedule(agent)
+
+        if info_dict is None:
+            info_dict = _empty_info()
+            for agent in env.agents:
+                _record_info(info_dict, env, agent)
+        if "action_mask" not in info_dict:
+            env._update_action_masks(info_dict)
+        return env._get_observations(), dict(enumerate(rewards.tolist())), env.dones, info_dict, elapsed_steps
+
+
+def _empty_info() -> Dict:
+    return {
+        "action_required": {},
+        "malfunction": {},
+        "speed": {},
+        "status": {},
+    }
+
+
+def _record_info(info_dict: Dict, env, agent: EnvAgent):
+    info_dict["action_required"][agent.handle] = env.action_required(agent)
+    info_dict["malfunction"][agent.handle] = agent.malfunction
+    info_dict["speed"][agent.handle] = agent.speed
+    info_dict["status"][agent.handle] = agent.status
@@ -0,0 +1,70 @@
+"""
+Cache of the compiled rails and distance maps of levels, shared by the environments it is given to.
+
+Environments which are reset on the same level, e.g. the environments of a `VecRailEnv` or the episodes of an
+evaluation, can reuse the `CompiledRail` and the distance map of the level instead of computing them again. The entries
+are keyed by the fingerprint of the rail (see `GridTransitionMap.fingerprint`). Caching is opt-in: a `LevelCache` is
+owned by the code which creates it and passes it to the environments, its entries are released with it or by
+`clear()`. Without a cache, an environment only reuses the compiled rail and distance map of its own previous reset.
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# default number of compiled rails and of distance maps kept by a `LevelCache`
+COMPILED_RAIL_CACHE_SIZE = 16
+DISTANCE_MAP_CACHE_SIZE = 8
+
+
+class LevelCache:
+    """
+    Compiled rails by the fingerprint of their rail and distance maps by (fingerprint, targets of the agents), each
+    bounded by a number of entries, the least recently used entries are dropped first.
+
+    A distance map takes `n_agents * height * width * 4 * 8` bytes, choose `max_distance_maps` accordingly for large
+    levels.
+    """
+
+    def __init__(self, max_compiled_rails: int = COMPILED_RAIL_CACHE_SIZE,
+                 max_distance_maps: int = DISTANCE_MAP_CACHE_SIZE):
+        """
+        Parameters
+        ----------
+        max_compiled_rails : int
+            Number of compiled rails kept.
+        max_distance_maps : int
+            Number of distance maps kept.
+        """
+        self.max_compiled_rails = max_compiled_rails
+        self.max_distance_maps = max_distance_maps
+        self.compiled_rails: OrderedDict = OrderedDict()
+        self.distance_maps: OrderedDict = OrderedDict()
+
+    def get_compiled_rail(self, fingerprint: str) -> Optional[Any]:
+        return _get(self.compiled_rails, fingerprint)
+
+    def put_compiled_rail(self, fingerprint: str, compiled_rail: Any):
+        _put(self.compiled_rails, fingerprint, compiled_rail, self.max_compiled_rails)
+
+    def get_distance_map(self, key: Hashable) -> Optional[Any]:
+        return _get(self.distance_maps, key)
+
+    def put_distance_map(self, key: Hashable, distance_map: Any):
+        _put(self.distance_maps, key, distance_map, self.max_distance_maps)
+
+    def clear(self):
+        self.compiled_rails.clear()
+        self.distance_maps.clear()
+
+
+def _get(entries: OrderedDict, key: Hashable) -> Optional[Any]:
+    value = entries.get(key)
+    if value is not None:
+        entries.move_to_end(key)
+    return value
+
+
+def _put(entries: OrderedDict, key: Hashable, value: Any, max_size: int):
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > max_size:
+        entries.popitem(last=False)
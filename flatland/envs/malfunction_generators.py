@@ -76,7 +76,7 @@ def malfunction_from_file(filename: str) -> Tuple[MalfunctionGenerator, Malfunct
         if reset:
             return Malfunction(0)
 
-        if agent.malfunction_data['malfunction'] < 1:
+        if agent.malfunction < 1:
             if np_random.rand() < _malfunction_prob(mean_malfunction_rate):
                 num_broken_steps = np_random.randint(min_number_of_steps_broken,
                                                      max_number_of_steps_broken + 1) + 1
@@ -124,7 +124,7 @@ def malfunction_from_params(parameters: MalfunctionParameters) -> Tuple[Malfunct
         if reset:
             return Malfunction(0)
 
-        if agent.malfunction_data['malfunction'] < 1:
+        if agent.malfunction < 1:
             if np_random.rand() < _malfunction_prob(mean_malfunction_rate):
                 num_broken_steps = np_random.randint(min_number_of_steps_broken,
                                                      max_number_of_steps_broken + 1) + 1
@@ -154,11 +154,20 @@ def no_malfunction_generator() -> Tuple[MalfunctionGenerator, MalfunctionProcess
     min_number_of_steps_broken = 0
     max_number_of_steps_broken = 0
 
-    def generator(agent: EnvAgent = None, np_random: RandomState = None, reset=False) -> Optional[Malfunction]:
-        return Malfunction(0)
+    return _no_malfunction, MalfunctionProcessData(mean_malfunction_rate, min_number_of_steps_broken,
+                                                   max_number_of_steps_broken)
 
-    return generator, MalfunctionProcessData(mean_malfunction_rate, min_number_of_steps_broken,
-                                             max_number_of_steps_broken)
+
+def _no_malfunction(agent: EnvAgent = None, np_random: RandomState = None, reset=False) -> Optional[Malfunction]:
+    return Malfunction(0)
+
+
+def is_no_malfunction_generator(generator: MalfunctionGenerator) -> bool:
+    """
+    Whether `generator` is the generator of `no_malfunction_generator`, which breaks no agent and draws no random
+    numbers.
+    """
+    return generator is _no_malfunction
 
 
 def single_malfunction_generator(earlierst_malfunction: int, malfunction_duration: int) -> Tuple[
@@ -0,0 +1,208 @@
+"""
+Observation pipelines for the RailEnv.
+
+An observation pipeline builds the observations of a step in the background: `RailEnv.step()` returns as soon as the
+new state is committed, with `PendingObservations` in place of the observation dict. The caller can meanwhile work on
+the observations of the previous step, e.g. run the policy forward pass, and only blocks when it reads the new
+observations.
+
+The `ThreadObservationPipeline` builds the observations in a worker thread, which suits observation builders spending
+their time in NumPy. The environment waits for the observations before it changes its state in the next step, reset,
+`restore()` or `undo()`, as the thread reads the live environment. The `ProcessObservationPipeline` builds them in a
+forked worker process, which suits pure-Python builders. The worker holds a copy of the environment forked at reset
+and receives the dynamic state of every step as a `RailEnv.snapshot()`, so changes to the rail or the static agent data
+between resets are not seen by the worker.
+"""
+import multiprocessing
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+class PendingObservations(Mapping):
+    """
+    Read-only mapping from the handles of the agents to their observations, which blocks until the observations
+    have been built when it is read.
+    """
+
+    def __init__(self, future):
+        # a concurrent.futures.Future or an object with the same result(), exception() and done() methods
+        self.future = future
+
+    def result(self) -> Dict:
+        """
+        Waits for the observations and returns them as a dict.
+        """
+        return self.future.result()
+
+    def done(self) -> bool:
+        """
+        Whether the observations have been built.
+        """
+        return self.future.done()
+
+    def __getitem__(self, handle: int):
+        return self.result()[handle]
+
+    def __iter__(self):
+        return iter(self.result())
+
+    def __len__(self):
+        return len(self.result())
+
+
+class ObservationPipeline:
+    """
+    ObservationPipeline base class.
+    """
+
+    def __init__(self):
+        self.env = None
+        self.pending: Optional[PendingObservations] = None
+
+    def set_env(self, env):
+        self.env = env
+
+    def reset(self):
+        """
+        Called at the end of each environment reset, before the observations are submitted.
+        """
+        self.wait()
+
+    def submit(self, handles: List[int], observed: List[int]) -> PendingObservations:
+        """
+        Starts building the observations of the agents `observed` in the current state of the environment.
+
+        Parameters
+        ----------
+        handles : List[int]
+            The handles of all agents, for the data shared by the observations.
+        observed : List[int]
+            The handles of the agents to build the observations for.
+        """
+        raise NotImplementedError()
+
+    def sync(self):
+        """
+        Called before the environment is modified by a step or reset.
+        """
+        pass
+
+    def wait(self):
+        """
+        Waits until the observations submitted last have been built.
+        """
+        if self.pending is not None:
+            self.pending.future.exception()
+
+    def close(self):
+        self.wait()
+
+
+class ThreadObservationPipeline(ObservationPipeline):
+    """
+    Builds the observations in a worker thread. The environment must not be modified before the observations are
+    built, the environment waits for them at the beginning of each step and reset.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='observations')
+
+    def sync(self):
+        # the worker thread reads the live environment
+        self.wait()
+
+    def submit(self, handles: List[int], observed: List[int]) -> PendingObservations:
+        self.wait()
+        self.pending = PendingObservations(self._executor.submit(self.env._build_observations, handles, observed))
+        return self.pending
+
+    def close(self):
+        super().close()
+        self._executor.shutdown()
+
+
+def _observation_worker(env, connection):
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        snapshot, handles, observed = request
+        env.restore(snapshot)
+        try:
+            connection.send((env._build_observations(handles, observed), None))
+        except Exception as e:
+            connection.send((None, e))
+    connection.close()
+
+
+class ProcessObservationPipeline(ObservationPipeline):
+    """
+    Builds the observations in a worker process forked at each reset of the environment. The observations are sent
+    back pickled, so they must be picklable. Requires the 'fork' start method of multiprocessing.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._context = multiprocessing.get_context('fork')
+        self._process = None
+        self._connection = None
+
+    def reset(self):
+        super().reset()
+        self._stop_worker()
+        self._connection, worker_connection = self._context.Pipe()
+        self._process = self._context.Process(target=_observation_worker, args=(self.env, worker_connection),
+                                              daemon=True)
+        self._process.start()
+        worker_connection.close()
+
+    def submit(self, handles: List[int], observed: List[int]) -> PendingObservations:
+        # the worker answers in order, the observations submitted before are received first
+        self.wait()
+        self._connection.send((self.env.snapshot(), handles, observed))
+        self.pending = PendingObservations(_WorkerResult(self._connection))
+        return self.pending
+
+    def _stop_worker(self):
+        if self._process is not None:
+            self._connection.send(None)
+            self._process.join()
+            self._connection.close()
+            self._process = None
+            self._connection = None
+
+    def close(self):
+        super().close()
+        self._stop_worker()
+
+
+class _WorkerResult:
+    """
+    Future of the observations built by the worker process, received when they are first requested.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._received = False
+        self._result = None
+        self._exception = None
+
+    def _receive(self):
+        if not self._received:
+            self._result, self._exception = self._connection.recv()
+            self._received = True
+
+    def result(self) -> Dict:
+        self._receive()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self) -> Optional[Exception]:
+        self._receive()
+        return self._exception
+
+    def done(self) -> bool:
+        return self._received or self._connection.poll()
@@ -15,6 +15,23 @@ from flatland.envs.agent_utils import RailAgentStatus, EnvAgent
 from flatland.utils.ordered_set import OrderedSet
 
 
+# a node of the tree observation, at module level such that the trees can be pickled, e.g. to send them from a
+# worker process
+Node = collections.namedtuple('Node', 'dist_own_target_encountered '
+                                      'dist_other_target_encountered '
+                                      'dist_other_agent_encountered '
+                                      'dist_potential_conflict '
+                                      'dist_unusable_switch '
+                                      'dist_to_next_branch '
+                                      'dist_min_to_target '
+                                      'num_agents_same_direction '
+                                      'num_agents_opposite_direction '
+                                      'num_agents_malfunctioning '
+                                      'speed_min_fractional '
+                                      'num_agents_ready_to_depart '
+                                      'childs')
+
+
 class TreeObsForRailEnv(ObservationBuilder):
     """
     TreeObsForRailEnv object.
@@ -25,19 +42,8 @@ class TreeObsForRailEnv(ObservationBuilder):
 
     For details about the features in the tree observation see the get() function.
     """
-    Node = collections.namedtuple('Node', 'dist_own_target_encountered '
-                                          'dist_other_target_encountered '
-                                          'dist_other_agent_encountered '
-                                          'dist_potential_conflict '
-                                          'dist_unusable_switch '
-                                          'dist_to_next_branch '
-                                          'dist_min_to_target '
-                                          'num_agents_same_direction '
-                                          'num_agents_opposite_direction '
-                                          'num_agents_malfunctioning '
-                                          'speed_min_fractional '
-                                          'num_agents_ready_to_depart '
-                                          'childs')
+    # the nodes of the tree, see `Node`
+    Node = Node
 
     tree_explored_actions_char = ['L', 'F', 'R', 'B']
 
@@ -49,23 +55,42 @@ class TreeObsForRailEnv(ObservationBuilder):
         self.location_has_agent_direction = {}
         self.predictor = predictor
         self.location_has_target = None
+        self.transition_counts = None
+        # the stats the prediction is timed in, see set_perf_stats()
+        self.perf_stats = None
+
+    def set_perf_stats(self, perf_stats):
+        self.perf_stats = perf_stats
 
     def reset(self):
         self.location_has_target = {tuple(agent.target): 1 for agent in self.env.agents}
+        self.transition_counts = self.env.rail.transition_counts()
 
     def get_many(self, handles: Optional[List[int]] = None) -> Dict[int, Node]:
         """
         Called whenever an observation has to be computed for the `env` environment, for each agent with handle
         in the `handles` list.
         """
+        self.prepare(handles)
+        return super().get_many(handles)
 
+    def prepare(self, handles: Optional[List[int]] = None):
+        """
+        Computes the predictions and the lookup tables of the agent positions shared by the observations of all
+        agents.
+        """
         if handles is None:
             handles = []
         if self.predictor:
             self.max_prediction_depth = 0
             self.predicted_pos = {}
             self.predicted_dir = {}
+            perf = self.perf_stats
+            if perf is not None:
+                perf.lap('observations')
             self.predictions = self.predictor.get()
+            if perf is not None:
+                perf.lap('prediction')
             if self.predictions:
                 for t in range(self.predictor.max_depth + 1):
                     pos_list = []
@@ -94,19 +119,14 @@ class TreeObsForRailEnv(ObservationBuilder):
                 _agent.position:
                 self.location_has_agent[tuple(_agent.position)] = 1
                 self.location_has_agent_direction[tuple(_agent.position)] = _agent.direction
-                self.location_has_agent_speed[tuple(_agent.position)] = _agent.speed_data['speed']
-                self.location_has_agent_malfunction[tuple(_agent.position)] = _agent.malfunction_data[
-                    'malfunction']
+                self.location_has_agent_speed[tuple(_agent.position)] = _agent.speed
+                self.location_has_agent_malfunction[tuple(_agent.position)] = _agent.malfunction
 
             if _agent.status in [RailAgentStatus.READY_TO_DEPART] and \
                 _agent.initial_position:
                 self.location_has_agent_ready_to_depart[tuple(_agent.initial_position)] = \
                     self.location_has_agent_ready_to_depart.get(tuple(_agent.initial_position), 0) + 1
 
-        observations = super().get_many(handles)
-
-        return observations
-
     def get(self, handle: int = 0) -> Node:
         """
         Computes the current observation for agent `handle` in env
@@ -212,8 +232,8 @@ class TreeObsForRailEnv(ObservationBuilder):
                                                            (handle, *agent_virtual_position,
                                                             agent.direction)],
                                                        num_agents_same_direction=0, num_agents_opposite_direction=0,
-                                                       num_agents_malfunctioning=agent.malfunction_data['malfunction'],
-                                                       speed_min_fractional=agent.speed_data['speed'],
+                                                       num_agents_malfunctioning=agent.malfunction,
+                                                       speed_min_fractional=agent.speed,
                                                        num_agents_ready_to_depart=0,
                                                        childs={})
 
@@ -266,7 +286,7 @@ class TreeObsForRailEnv(ObservationBuilder):
 
         visited = OrderedSet()
         agent = self.env.agents[handle]
-        time_per_cell = np.reciprocal(agent.speed_data["speed"])
+        time_per_cell = np.reciprocal(agent.speed)
         own_target_encountered = np.inf
         other_agent_encountered = np.inf
         other_target_encountered = np.inf
@@ -314,10 +334,9 @@ class TreeObsForRailEnv(ObservationBuilder):
 
                 # Check number of possible transitions for agent and total number of transitions in cell (type)
             cell_transitions = self.env.rail.get_transitions(*position, direction)
-            transition_bit = bin(self.env.rail.get_full_transitions(*position))
-            total_transitions = transition_bit.count("1")
+            total_transitions = self.transition_counts[position]
             crossing_found = False
-            if int(transition_bit, 2) == int('1000010000100001', 2):
+            if self.env.rail.get_full_transitions(*position) == int('1000010000100001', 2):
                 crossing_found = True
 
             # Register possible future conflict
@@ -553,12 +572,7 @@ class GlobalObsForRailEnv(ObservationBuilder):
         super().set_env(env)
 
     def reset(self):
-        self.rail_obs = np.zeros((self.env.height, self.env.width, 16))
-        for i in range(self.rail_obs.shape[0]):
-            for j in range(self.rail_obs.shape[1]):
-                bitlist = [int(digit) for digit in bin(self.env.rail.get_full_transitions(i, j))[2:]]
-                bitlist = [0] * (16 - len(bitlist)) + bitlist
-                self.rail_obs[i, j] = np.array(bitlist)
+        self.rail_obs = self.env.rail.to_bitplanes(dtype=float)
 
     def get(self, handle: int = 0) -> (np.ndarray, np.ndarray, np.ndarray):
 
@@ -598,8 +612,8 @@ class GlobalObsForRailEnv(ObservationBuilder):
                 # second channel only for other agents
                 if i != handle:
                     obs_agents_state[other_agent.position][1] = other_agent.direction
-                obs_agents_state[other_agent.position][2] = other_agent.malfunction_data['malfunction']
-                obs_agents_state[other_agent.position][3] = other_agent.speed_data['speed']
+                obs_agents_state[other_agent.position][2] = other_agent.malfunction
+                obs_agents_state[other_agent.position][3] = other_agent.speed
             # fifth channel: all ready to depart on this position
             if other_agent.status == RailAgentStatus.READY_TO_DEPART:
                 obs_agents_state[other_agent.initial_position][4] += 1
@@ -643,13 +657,7 @@ class LocalObsForRailEnv(ObservationBuilder):
         # We build the transition map with a view_radius empty cells expansion on each side.
         # This helps to collect the local transition map view when the agent is close to a border.
         self.max_padding = max(self.view_width, self.view_height)
-        self.rail_obs = np.zeros((self.env.height,
-                                  self.env.width, 16))
-        for i in range(self.env.height):
-            for j in range(self.env.width):
-                bitlist = [int(digit) for digit in bin(self.env.rail.get_full_transitions(i, j))[2:]]
-                bitlist = [0] * (16 - len(bitlist)) + bitlist
-                self.rail_obs[i, j] = np.array(bitlist)
+        self.rail_obs = self.env.rail.to_bitplanes(dtype=float)
 
     def get(self, handle: int = 0) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
         agents = self.env.agents
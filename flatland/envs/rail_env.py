@@ -4,7 +4,7 @@ Definition of the RailEnv environment.
 import random
 # TODO:  _ this is a global method --> utils or remove later
 from enum import IntEnum
-from typing import List, NamedTuple, Optional, Dict
+from typing import Callable, List, NamedTuple, Optional, Dict, Set, Tuple
 
 import msgpack
 import msgpack_numpy as m
@@ -13,17 +13,28 @@ from gym.utils import seeding
 from msgpack import Packer
 
 from flatland.core.env import Environment
-from flatland.core.env_observation_builder import ObservationBuilder
+from flatland.core.env_observation_builder import LazyObservations, ObservationBuilder
 from flatland.core.grid.grid4 import Grid4TransitionsEnum, Grid4Transitions
 from flatland.core.grid.grid4_utils import get_new_position
 from flatland.core.grid.grid_utils import IntVector2D
 from flatland.core.transition_map import GridTransitionMap
+from flatland.envs.action_masks import ActionMasks
+from flatland.envs.agent_index import AgentIndex
 from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+from flatland.envs.compiled_rail import CompiledRail
 from flatland.envs.distance_map import DistanceMap
-from flatland.envs.malfunction_generators import no_malfunction_generator, Malfunction, MalfunctionProcessData
+from flatland.envs.event_driven import EventDrivenBackend
+from flatland.envs.level_cache import LevelCache
+from flatland.envs.malfunction_generators import no_malfunction_generator, Malfunction, MalfunctionProcessData, \
+    is_no_malfunction_generator
 from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.random_streams import AgentRandomStreams
 from flatland.envs.rail_generators import random_rail_generator, RailGenerator
 from flatland.envs.schedule_generators import random_schedule_generator, ScheduleGenerator
+from flatland.envs.state_hash import StateHash
+from flatland.envs.step_journal import StepJournal
+from flatland.utils.ordered_set import OrderedSet
+from flatland.utils.perf_stats import PerfStats
 
 m.patch()
 
@@ -49,6 +60,19 @@ class RailEnvActions(IntEnum):
 RailEnvGridPos = NamedTuple('RailEnvGridPos', [('r', int), ('c', int)])
 RailEnvNextAction = NamedTuple('RailEnvNextAction', [('action', RailEnvActions), ('next_position', RailEnvGridPos),
                                                      ('next_direction', Grid4TransitionsEnum)])
+RailEnvSnapshot = NamedTuple('RailEnvSnapshot', [('agents', List[Tuple]),
+                                                 ('agent_positions', np.ndarray),
+                                                 ('np_random_state', Tuple),
+                                                 ('elapsed_steps', int),
+                                                 ('dones', Dict),
+                                                 ('active_agents', List[int]),
+                                                 ('rewards_dict', Dict),
+                                                 ('episode_length', int)])
+
+EpisodeArrays = NamedTuple('EpisodeArrays', [('positions', np.ndarray),
+                                             ('directions', np.ndarray),
+                                             ('statuses', np.ndarray),
+                                             ('rewards', np.ndarray)])
 
 
 class RailEnv(Environment):
@@ -123,7 +147,15 @@ class RailEnv(Environment):
                  malfunction_generator_and_process_data=no_malfunction_generator(),
                  remove_agents_at_target=True,
                  random_seed=1,
-                 record_steps=False
+                 record_steps=False,
+                 step_engine=None,
+                 lazy_observations=False,
+                 decision_observations=False,
+                 observation_pipeline=None,
+                 action_masks=False,
+                 agent_random_streams=False,
+                 incremental_state_hash=False,
+                 level_cache=None
                  ):
         """
         Environment init.
@@ -159,6 +191,33 @@ class RailEnv(Environment):
         random_seed : int or None
             if None, then its ignored, else the random generators are seeded with this number to ensure
             that stochastic operations are replicable across multiple operations
+        step_engine : StepEngine object, optional
+            StepEngine-derived object that advances the agents in `step()`, e.g. the `VectorizedStepEngine` from
+            flatland/envs/step_engine.py. If None, the agents are stepped one by one by `_step_agent()`.
+        lazy_observations : bool
+            If True, `reset()` and `step()` return `LazyObservations`, which compute the observation of an agent only
+            when it is accessed, before the next step.
+        decision_observations : bool
+            If True, observations are only returned for the agents which require an action (see `action_required()`).
+        observation_pipeline : ObservationPipeline object, optional
+            ObservationPipeline-derived object that builds the observations in the background, e.g. the
+            `ThreadObservationPipeline` from flatland/envs/observation_pipeline.py. `reset()` and `step()` then return
+            `PendingObservations`, which block when they are read until the observations are built.
+        action_masks : bool
+            If True, the info of `reset()`, `step()` and `step_arrays()` contains the `(n_agents, 5)` boolean array
+            'action_mask' of the valid actions of each agent, see `ActionMasks` in flatland/envs/action_masks.py.
+        agent_random_streams : bool
+            If True, the malfunctions of each agent at each step are drawn from an independent counter-based stream
+            derived from the seed, the episode since the seeding, the agent handle and the step (see
+            `AgentRandomStreams` in flatland/envs/random_streams.py) instead of from the shared `np_random`, such that
+            they do not depend on the number of agents or the order they are stepped in.
+        incremental_state_hash : bool
+            If True, the `state_hash` of the dynamic state of the agents is updated by the steps for each changed
+            agent, see `StateHash` in flatland/envs/state_hash.py. Otherwise it is computed from all agents when read.
+        level_cache : LevelCache object, optional
+            Cache of the compiled rails and distance maps by the fingerprint of the rail, shared with the other
+            environments given the same cache, see `LevelCache` in flatland/envs/level_cache.py. Without it, only the
+            compiled rail and distance map of the previous reset are reused for an unchanged level.
         """
         super().__init__()
 
@@ -176,6 +235,37 @@ class RailEnv(Environment):
         self.obs_builder = obs_builder_object
         self.obs_builder.set_env(self)
 
+        self.lazy_observations = lazy_observations
+        self.decision_observations = decision_observations
+
+        self.step_engine = step_engine
+        if self.step_engine is not None:
+            self.step_engine.set_env(self)
+
+        self.observation_pipeline = observation_pipeline
+        if self.observation_pipeline is not None:
+            self.observation_pipeline.set_env(self)
+
+        self.event_backend = EventDrivenBackend(self)
+        self.agent_index = AgentIndex()
+        # masks of the valid actions returned in the info, if enabled
+        self.action_masks: Optional[ActionMasks] = ActionMasks() if action_masks else None
+        # random streams of the malfunctions per agent and step, if enabled
+        self.random_streams: Optional[AgentRandomStreams] = AgentRandomStreams() if agent_random_streams else None
+        # hash of the dynamic state of the agents updated by the steps, if enabled
+        self.incremental_hash: Optional[StateHash] = StateHash() if incremental_state_hash else None
+        # journal of the steps for undo(), see start_journal()
+        self.journal: Optional[StepJournal] = None
+        # timing of the phases of the steps, see enable_perf_stats()
+        self.perf_stats: Optional[PerfStats] = None
+        # info of the previous step, whose entries of the done agents are reused by the steps skipping them
+        self._finished_info: Optional[Dict] = None
+        # the last snapshot taken or restored, the handles of the agents the steps may have changed since then (None
+        # for all agents) and whether the steps drew from np_random, see restore()
+        self._tracked_snapshot: Optional[RailEnvSnapshot] = None
+        self._agents_changed: Optional[Set[int]] = None
+        self._np_random_drawn = False
+
         self._max_episode_steps: Optional[int] = None
         self._elapsed_steps = 0
 
@@ -183,13 +273,19 @@ class RailEnv(Environment):
 
         self.obs_dict = {}
         self.rewards_dict = {}
+
+        # buffers of step_arrays(), allocated at reset
+        self.rewards_array: Optional[np.ndarray] = None
+        self.dones_array: Optional[np.ndarray] = None
+        self.info_arrays: Dict[str, np.ndarray] = {}
         self.dev_obs_dict = {}
         self.dev_pred_dict = {}
 
         self.agents: List[EnvAgent] = []
         self.number_of_agents = number_of_agents
         self.num_resets = 0
-        self.distance_map = DistanceMap(self.agents, self.height, self.width)
+        self.level_cache: Optional[LevelCache] = level_cache
+        self.distance_map = DistanceMap(self.agents, self.height, self.width, cache=level_cache)
 
         self.action_space = [5]
 
@@ -210,6 +306,9 @@ class RailEnv(Environment):
 
     def _seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
+        self.np_random_seed = seed
+        # the episodes of the agent random streams are counted from the seeding, such that a reseed reproduces them
+        self.num_resets_since_seeding = 0
         random.seed(seed)
         return [seed]
 
@@ -231,13 +330,16 @@ class RailEnv(Environment):
         if agent.status == RailAgentStatus.READY_TO_DEPART and self.cell_free(agent.initial_position):
             agent.status = RailAgentStatus.ACTIVE
             self._set_agent_to_initial_position(agent, agent.initial_position)
+            self.agent_index.update(agent.handle, agent)
 
     def reset_agents(self):
         """ Reset the agents to their starting positions
         """
         for agent in self.agents:
             agent.reset()
-        self.active_agents = [i for i in range(len(self.agents))]
+        self.active_agents = OrderedSet()
+        self.active_agents.update(range(len(self.agents)))
+        self.agent_index.reset(self.agents)
 
     @staticmethod
     def compute_max_episode_steps(width: int, height: int, ratio_nr_agents_to_nr_cities: float = 20.0) -> int:
@@ -280,8 +382,7 @@ class RailEnv(Environment):
         False: Agent cannot provide an action
         """
         return (agent.status == RailAgentStatus.READY_TO_DEPART or (
-            agent.status == RailAgentStatus.ACTIVE and np.isclose(agent.speed_data['position_fraction'], 0.0,
-                                                                  rtol=1e-03)))
+            agent.status == RailAgentStatus.ACTIVE and agent.at_cell_start))
 
     def reset(self, regenerate_rail: bool = True, regenerate_schedule: bool = True, activate_agents: bool = False,
               random_seed: bool = None) -> (Dict, Dict):
@@ -308,9 +409,13 @@ class RailEnv(Environment):
         info_dict: Dict with agent specific information
 
         """
+        if self.observation_pipeline is not None:
+            self.observation_pipeline.sync()
 
         if random_seed:
             self._seed(random_seed)
+        if self.random_streams is not None:
+            self.random_streams.reset(self.np_random_seed, self.num_resets_since_seeding)
 
         optionals = {}
         if regenerate_rail or self.rail is None:
@@ -318,13 +423,16 @@ class RailEnv(Environment):
                                                   self.np_random)
 
             self.rail = rail
-            self.height, self.width = self.rail.grid.shape
+            self.height, self.width = self.rail.shape
 
             # Do a new set_env call on the obs_builder to ensure
             # that obs_builder specific instantiations are made according to the
             # specifications of the current environment : like width, height, etc
             self.obs_builder.set_env(self)
 
+        # lookup tables for the action resolution on the (possibly modified) rail, reused for an unchanged rail
+        CompiledRail.for_rail(self.rail, fingerprint=self.rail.fingerprint(), cache=self.level_cache)
+
         if optionals and 'distance_map' in optionals:
             self.distance_map.set(optionals['distance_map'])
 
@@ -351,6 +459,7 @@ class RailEnv(Environment):
 
         # Reset agents to initial
         self.reset_agents()
+        self._elapsed_steps = 0
 
         for agent in self.agents:
             # Induce malfunctions
@@ -359,14 +468,14 @@ class RailEnv(Environment):
 
             self._break_agent(agent)
 
-            if agent.malfunction_data["malfunction"] > 0:
-                agent.speed_data['transition_action_on_cellexit'] = RailEnvActions.DO_NOTHING
+            if agent.malfunction > 0:
+                agent.transition_action_on_cellexit = RailEnvActions.DO_NOTHING
 
             # Fix agents that finished their malfunction
             self._fix_agent_after_malfunction(agent)
 
         self.num_resets += 1
-        self._elapsed_steps = 0
+        self.num_resets_since_seeding += 1
 
         # TODO perhaps dones should be part of each agent.
         self.dones = dict.fromkeys(list(range(self.get_num_agents())) + ["__all__"], False)
@@ -378,43 +487,118 @@ class RailEnv(Environment):
         # Reset the malfunction generator
         self.malfunction_generator(reset=True)
 
+        if self.journal is not None:
+            self.journal.clear()
+        self._finished_info = None
+        self._tracked_snapshot = None
+
+        if self.step_engine is not None:
+            self.step_engine.reset()
+
+        if self.observation_pipeline is not None:
+            self.observation_pipeline.reset()
+
+        if self.incremental_hash is not None:
+            self.incremental_hash.reset(self.agents, self.width)
+
+        self._allocate_step_arrays()
+
         info_dict: Dict = {
             'action_required': {i: self.action_required(agent) for i, agent in enumerate(self.agents)},
             'malfunction': {
-                i: agent.malfunction_data['malfunction'] for i, agent in enumerate(self.agents)
+                i: agent.malfunction for i, agent in enumerate(self.agents)
             },
-            'speed': {i: agent.speed_data['speed'] for i, agent in enumerate(self.agents)},
+            'speed': {i: agent.speed for i, agent in enumerate(self.agents)},
             'status': {i: agent.status for i, agent in enumerate(self.agents)}
         }
+        for key, values in info_dict.items():
+            self.info_arrays[key][:] = list(values.values())
+        if self.action_masks is not None:
+            self.action_masks.reset(self.agents)
+            self._update_action_masks(info_dict)
+            self.info_arrays['action_mask'] = self.action_masks.masks
+
         # Return the new observation vectors for each agent
         observation_dict: Dict = self._get_observations()
         return observation_dict, info_dict
 
-    def _fix_agent_after_malfunction(self, agent: EnvAgent):
+    def reset_arrays(self, regenerate_rail: bool = True, regenerate_schedule: bool = True,
+                     activate_agents: bool = False, random_seed: bool = None) -> (Dict, Dict[str, np.ndarray]):
+        """
+        reset_arrays(regenerate_rail, regenerate_schedule, activate_agents, random_seed)
+
+        Resets the rail environment like `reset()` but returns the agent specific information as numpy arrays,
+        which are the buffers `step_arrays()` writes into.
+
+        Returns
+        -------
+        observation_dict: Dict
+            Dictionary with an observation for each agent
+        info_arrays: Dict[str, np.ndarray]
+            'action_required', 'malfunction', 'speed' and 'status' of all agents, indexed by the agent handle, and
+            'action_mask' if enabled
+        """
+        observation_dict, _ = self.reset(regenerate_rail=regenerate_rail, regenerate_schedule=regenerate_schedule,
+                                         activate_agents=activate_agents, random_seed=random_seed)
+        return observation_dict, self.info_arrays
+
+    def _allocate_step_arrays(self):
+        """
+        Allocates the buffers `step_arrays()` writes the rewards, dones and info of the agents into.
+        """
+        number_of_agents = self.get_num_agents()
+        self.rewards_array = np.zeros(number_of_agents)
+        self.dones_array = np.zeros(number_of_agents, dtype=bool)
+        self.info_arrays = {
+            'action_required': np.zeros(number_of_agents, dtype=bool),
+            'malfunction': np.zeros(number_of_agents, dtype=int),
+            'speed': np.zeros(number_of_agents),
+            'status': np.zeros(number_of_agents, dtype=int)
+        }
+
+    def _update_action_masks(self, info: Dict, copy: bool = True):
+        """
+        Adds the masks of the valid actions of the agents to the `info` as 'action_mask', if enabled. Without `copy`,
+        the buffer of the masks is added, which is overwritten by the next step.
+        """
+        if self.action_masks is None:
+            return
+        masks = self.action_masks.update(self.agents, self.rail)
+        info['action_mask'] = masks.copy() if copy else masks
+
+    def _fix_agent_after_malfunction(self, agent: EnvAgent) -> bool:
         """
         Updates agent malfunction variables and fixes broken agents
 
         Parameters
         ----------
         agent
+
+        Returns
+        -------
+        bool
+            Whether the agent was broken and its malfunction variables changed
         """
 
         # Ignore agents that are OK
         if self._is_agent_ok(agent):
-            return
+            return False
+
+        if self.journal is not None:
+            self.journal.record_agent(agent)
 
         # Reduce number of malfunction steps left
-        if agent.malfunction_data['malfunction'] > 1:
-            agent.malfunction_data['malfunction'] -= 1
-            return
+        if agent.malfunction > 1:
+            agent.malfunction -= 1
+            return True
 
         # Restart agents at the end of their malfunction
-        agent.malfunction_data['malfunction'] -= 1
-        if 'moving_before_malfunction' in agent.malfunction_data:
-            agent.moving = agent.malfunction_data['moving_before_malfunction']
-            return
+        agent.malfunction -= 1
+        if agent.moving_before_malfunction is not None:
+            agent.moving = agent.moving_before_malfunction
+        return True
 
-    def _break_agent(self, agent: EnvAgent):
+    def _break_agent(self, agent: EnvAgent) -> bool:
         """
         Malfunction generator that breaks agents at a given rate.
 
@@ -422,15 +606,26 @@ class RailEnv(Environment):
         ----------
         agent
 
+        Returns
+        -------
+        bool
+            Whether the agent broke down
         """
 
-        malfunction: Malfunction = self.malfunction_generator(agent, self.np_random)
+        np_random = self.np_random
+        if self.random_streams is not None:
+            np_random = self.random_streams.for_agent(agent.handle, self._elapsed_steps)
+        elif self.journal is not None:
+            self.journal.record_random_state()
+        malfunction: Malfunction = self.malfunction_generator(agent, np_random)
         if malfunction.num_broken_steps > 0:
-            agent.malfunction_data['malfunction'] = malfunction.num_broken_steps
-            agent.malfunction_data['moving_before_malfunction'] = agent.moving
-            agent.malfunction_data['nr_malfunctions'] += 1
-
-        return
+            if self.journal is not None:
+                self.journal.record_agent(agent)
+            agent.malfunction = malfunction.num_broken_steps
+            agent.moving_before_malfunction = agent.moving
+            agent.nr_malfunctions += 1
+            return True
+        return False
 
     def step(self, action_dict_: Dict[int, RailEnvActions]):
         """
@@ -441,6 +636,38 @@ class RailEnv(Environment):
         action_dict_ : Dict[int,RailEnvActions]
 
         """
+        info_dict, stepped = self._step_without_observations(action_dict_)
+        if not stepped:
+            return self._get_observations(), self.rewards_dict, self.dones, info_dict
+
+        perf = self.perf_stats
+        observations = self._get_observations()
+        if perf is not None:
+            perf.lap('observations')
+            perf.stop()
+            if self.dones["__all__"]:
+                perf.episode_end()
+        return observations, self.rewards_dict, self.dones, info_dict
+
+    def _step_without_observations(self, action_dict_: Dict[int, RailEnvActions]) -> (Dict, bool):
+        """
+        Performs the step of `step()` up to the observations, the rewards and dones are written into
+        `self.rewards_dict` and `self.dones`.
+
+        Returns
+        -------
+        info_dict: Dict
+            The info of `step()`
+        bool
+            False if the episode was already done and the agents were not stepped
+        """
+        if self.observation_pipeline is not None:
+            self.observation_pipeline.sync()
+        if self.journal is not None:
+            self.journal.begin()
+        perf = self.perf_stats
+        if perf is not None:
+            perf.start()
         self._elapsed_steps += 1
 
         # If we're done, set reward and info_dict and step() is done.
@@ -458,53 +685,386 @@ class RailEnv(Environment):
                 info_dict["malfunction"][i_agent] = 0
                 info_dict["speed"][i_agent] = 0
                 info_dict["status"][i_agent] = agent.status
+            self._update_action_masks(info_dict)
+            if perf is not None:
+                perf.stop()
+            return info_dict, False
+
+        self._track_agents_changed()
+        if self.step_engine is not None:
+            info_dict, have_all_agents_ended = self._step_with_engine(action_dict_)
+        else:
+            info_dict, have_all_agents_ended = self._step_agents(action_dict_)
 
-            return self._get_observations(), self.rewards_dict, self.dones, info_dict
+        # Check for end of episode + set global reward to all rewards!
+        if have_all_agents_ended:
+            if self.journal is not None:
+                self.journal.record_dones()
+            self.dones["__all__"] = True
+            self.rewards_dict = {i: self.global_reward for i in range(self.get_num_agents())}
+        if (self._max_episode_steps is not None) and (self._elapsed_steps >= self._max_episode_steps):
+            if self.journal is not None:
+                self.journal.record_dones()
+            self.dones["__all__"] = True
+            for i_agent in range(self.get_num_agents()):
+                self.dones[i_agent] = True
+        self._update_action_masks(info_dict)
+        if perf is not None:
+            perf.lap('info')
+        if self.record_steps:
+            self.record_timestep()
+            if perf is not None:
+                perf.lap('recording')
+        return info_dict, True
+
+    def step_arrays(self, actions: np.ndarray) -> (Dict, np.ndarray, np.ndarray, Dict[str, np.ndarray]):
+        """
+        Updates rewards for the agents at a step, like `step()`, but with actions, rewards, dones and info as numpy
+        arrays indexed by the agent handle.
+
+        The returned arrays are buffers allocated at `reset()` and overwritten by the next call, copy them
+        if they need to be kept.
+
+        Parameters
+        ----------
+        actions : np.ndarray
+            One action per agent (`RailEnvActions.DO_NOTHING` for agents without action)
+
+        Returns
+        -------
+        observation_dict: Dict
+            Dictionary with an observation for each agent
+        rewards: np.ndarray
+            The reward of each agent
+        dones: np.ndarray
+            Whether each agent is done, the episode is done when all agents are done
+        info_arrays: Dict[str, np.ndarray]
+            'action_required', 'malfunction', 'speed' and 'status' of all agents, and 'action_mask' if enabled
+        """
+        if not self._step_arrays_without_observations(actions):
+            return self._get_observations(), self.rewards_array, self.dones_array, self.info_arrays
+
+        perf = self.perf_stats
+        observations = self._get_observations()
+        if perf is not None:
+            perf.lap('observations')
+            perf.stop()
+            if self.dones["__all__"]:
+                perf.episode_end()
+        return observations, self.rewards_array, self.dones_array, self.info_arrays
+
+    def _step_arrays_without_observations(self, actions: np.ndarray) -> bool:
+        """
+        Performs the step of `step_arrays()` up to the observations, the rewards, dones and info are written into the
+        buffers of `step_arrays()`.
+
+        Returns
+        -------
+        bool
+            False if the episode was already done and the agents were not stepped
+        """
+        if self.observation_pipeline is not None:
+            self.observation_pipeline.sync()
+        if self.journal is not None:
+            self.journal.begin()
+        perf = self.perf_stats
+        if perf is not None:
+            perf.start()
+        self._elapsed_steps += 1
+        if self.rewards_array is None or len(self.rewards_array) != self.get_num_agents():
+            self._allocate_step_arrays()
+        rewards = self.rewards_array
+        dones = self.dones_array
+        info = self.info_arrays
+
+        # If we're done, set reward and info and step_arrays() is done.
+        if self.dones["__all__"]:
+            rewards[:] = self.global_reward
+            info['action_required'][:] = False
+            info['malfunction'][:] = 0
+            info['speed'][:] = 0
+            info['status'][:] = [agent.status for agent in self.agents]
+            self._update_action_masks(info, copy=False)
+            if perf is not None:
+                perf.stop()
+            return False
+
+        self._track_agents_changed()
+        if self.step_engine is not None:
+            self.step_engine.step(np.asarray(actions, dtype=int), rewards, info)
+        else:
+            info_dict, _ = self._step_agents(dict(enumerate(np.asarray(actions).tolist())))
+            rewards[:] = list(self.rewards_dict.values())
+            for key, values in info_dict.items():
+                info[key][:] = list(values.values())
+
+        np.greater_equal(info['status'], RailAgentStatus.DONE, out=dones)
+
+        # Check for end of episode + set global reward to all rewards!
+        if dones.all():
+            if self.journal is not None:
+                self.journal.record_dones()
+            self.dones["__all__"] = True
+            rewards[:] = self.global_reward
+        if (self._max_episode_steps is not None) and (self._elapsed_steps >= self._max_episode_steps):
+            if self.journal is not None:
+                self.journal.record_dones()
+            self.dones["__all__"] = True
+            for i_agent in range(self.get_num_agents()):
+                self.dones[i_agent] = True
+            dones[:] = True
+        self._update_action_masks(info, copy=False)
+        if perf is not None:
+            perf.lap('info')
+        if self.record_steps:
+            self.record_timestep()
+            if perf is not None:
+                perf.lap('recording')
+        return True
+
+    def simulate_episode(self, actions: np.ndarray) -> EpisodeArrays:
+        """
+        Steps the environment with the actions of a whole episode, like `step_arrays()` but without building
+        observations, until the actions are used up or the episode is done. The episode starts from the current
+        state, e.g. after `reset()` or `restore()`. Without a `step_engine`, the episode is stepped by a temporary
+        `VectorizedStepEngine` rather than agent by agent.
+
+        Parameters
+        ----------
+        actions : np.ndarray
+            `(T, n_agents)` actions of the agents at each step (`RailEnvActions.DO_NOTHING` for agents without action)
+
+        Returns
+        -------
+        EpisodeArrays
+            The positions, directions, statuses and rewards of the agents after each step performed, the positions of
+            agents which are not in the grid are (-1, -1)
+        """
+        actions = np.asarray(actions, dtype=int)
+        number_of_agents = self.get_num_agents()
+        assert actions.ndim == 2 and actions.shape[1] == number_of_agents, \
+            "actions must have the shape (T, {})".format(number_of_agents)
+        number_of_steps = len(actions)
+        positions = np.full((number_of_steps, number_of_agents, 2), -1, dtype=int)
+        directions = np.zeros((number_of_steps, number_of_agents), dtype=int)
+        statuses = np.zeros((number_of_steps, number_of_agents), dtype=int)
+        rewards = np.zeros((number_of_steps, number_of_agents))
+
+        step_engine = self.step_engine
+        if step_engine is None:
+            # imported here, the step engines depend on this module
+            from flatland.envs.step_engine import VectorizedStepEngine
+            self.step_engine = VectorizedStepEngine()
+            self.step_engine.set_env(self)
+            self.step_engine.reset()
+
+        perf = self.perf_stats
+        steps = 0
+        try:
+            while steps < number_of_steps and not self.dones["__all__"]:
+                self._step_arrays_without_observations(actions[steps])
+                if perf is not None:
+                    perf.stop()
+                    if self.dones["__all__"]:
+                        perf.episode_end()
+                # the vectorized step engines hold the positions and directions as arrays
+                agent_arrays = getattr(self.step_engine, 'agent_arrays', None)
+                if agent_arrays is not None:
+                    positions[steps] = agent_arrays.position
+                    directions[steps] = agent_arrays.direction
+                else:
+                    for i_agent, agent in enumerate(self.agents):
+                        if agent.position is not None:
+                            positions[steps, i_agent] = agent.position
+                        directions[steps, i_agent] = agent.direction
+                statuses[steps] = self.info_arrays['status']
+                rewards[steps] = self.rewards_array
+                steps += 1
+        finally:
+            if step_engine is None:
+                self.step_engine = None
+                # the info of the agents done in the episode was not kept by the engine
+                self._finished_info = None
+        return EpisodeArrays(positions=positions[:steps], directions=directions[:steps], statuses=statuses[:steps],
+                             rewards=rewards[:steps])
+
+    def advance_until_decision(self, max_steps: Optional[int] = None) -> (Dict, Dict, Dict, Dict, int):
+        """
+        Advances the environment without actions until an agent can take an action, i.e. it is ready to depart or
+        at the beginning of a cell and not malfunctioning, or until the episode is done.
+        The steps in which no agent exits a cell are skipped without computing observations.
+
+        Parameters
+        ----------
+        max_steps : int, optional
+            Maximum number of steps to advance.
+
+        Returns
+        -------
+        observation_dict: Dict
+            Dictionary with an observation for each agent
+        rewards_dict: Dict
+            The rewards of each agent accumulated over the elapsed steps
+        dones: Dict
+            The dones of the agents and the episode
+        info_dict: Dict
+            'action_required', 'malfunction', 'speed' and 'status' of each agent
+        elapsed_steps: int
+            Number of steps the environment was advanced
+        """
+        return self.event_backend.advance_until_decision(max_steps)
 
+    def skips_finished_agents(self) -> bool:
+        """
+        Whether the steps skip the agents which are done. This is the case if the malfunction generator draws no
+        malfunctions, or draws them from the `agent_random_streams`: the draws of the other agents then do not depend
+        on whether the done agents are sampled.
+
+        The info of skipped agents is carried over from the previous step, agents modified while done have to be
+        reported with `agent_index.update()`.
+        """
+        return self.random_streams is not None or is_no_malfunction_generator(self.malfunction_generator)
+
+    def _step_agents(self, action_dict_: Dict[int, RailEnvActions]) -> (Dict, bool):
+        """
+        Performs the step of all agents one by one, in the order of their handles. If `skips_finished_agents()`,
+        only the agents ready to depart or active are stepped.
+
+        Parameters
+        ----------
+        action_dict_ : Dict[int,RailEnvActions]
+
+        Returns
+        -------
+        info_dict: Dict with agent specific information
+        have_all_agents_ended: bool
+        """
+        number_of_agents = self.get_num_agents()
+        if len(self.agent_index.status) != number_of_agents:
+            self.agent_index.reset(self.agents)
+            self._finished_info = None
         # Reset the step rewards
-        self.rewards_dict = dict()
-        info_dict = {
-            "action_required": {},
-            "malfunction": {},
-            "speed": {},
-            "status": {},
-        }
+        self.rewards_dict = dict.fromkeys(range(number_of_agents), 0)
+        skip_finished = self.skips_finished_agents()
+        if skip_finished:
+            handles = self.agent_index.live_handles().tolist()
+            if self._finished_info is None:
+                self._finished_info = self._agents_info()
+            info_dict = {key: values.copy() for key, values in self._finished_info.items()}
+        else:
+            handles = range(number_of_agents)
+            info_dict = {
+                "action_required": {},
+                "malfunction": {},
+                "speed": {},
+                "status": {},
+            }
         have_all_agents_ended = True  # boolean flag to check if all agents are done
+        perf = self.perf_stats
+        modified = []
 
-        for i_agent, agent in enumerate(self.agents):
-            # Reset the step rewards
-            self.rewards_dict[i_agent] = 0
+        for i_agent in handles:
+            agent = self.agents[i_agent]
 
             # Induce malfunction before we do a step, thus a broken agent can't move in this step
-            self._break_agent(agent)
+            changed = self._break_agent(agent)
+            if perf is not None:
+                perf.lap('malfunction')
 
             # Perform step on the agent
-            self._step_agent(i_agent, action_dict_.get(i_agent))
+            changed |= self._step_agent(i_agent, action_dict_.get(i_agent))
+            if perf is not None:
+                perf.lap('movement')
 
             # manage the boolean flag to check if all agents are indeed done (or done_removed)
             have_all_agents_ended &= (agent.status in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED])
 
             # Build info dict
             info_dict["action_required"][i_agent] = self.action_required(agent)
-            info_dict["malfunction"][i_agent] = agent.malfunction_data['malfunction']
-            info_dict["speed"][i_agent] = agent.speed_data['speed']
+            info_dict["malfunction"][i_agent] = agent.malfunction
+            info_dict["speed"][i_agent] = agent.speed
             info_dict["status"][i_agent] = agent.status
+            if perf is not None:
+                perf.lap('info')
 
             # Fix agents that finished their malfunction such that they can perform an action in the next step
-            self._fix_agent_after_malfunction(agent)
+            changed |= self._fix_agent_after_malfunction(agent)
+            if changed:
+                modified.append(i_agent)
+                if self.incremental_hash is not None:
+                    self.incremental_hash.update(i_agent, agent)
+            if perf is not None:
+                perf.lap('malfunction')
+
+        if self.action_masks is not None:
+            self.action_masks.agents_modified(modified)
+        if skip_finished:
+            # the info of the agents done from now on is not updated any more
+            for i_agent in handles:
+                if self.agents[i_agent].status in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED]:
+                    for key, values in self._finished_info.items():
+                        values[i_agent] = info_dict[key][i_agent]
+        return info_dict, have_all_agents_ended
+
+    def _track_agents_changed(self):
+        """
+        Adds the agents the step in progress may change to the agents changed since the tracked snapshot: the agents
+        ready to depart or active, and the done agents drawing their malfunctions from np_random unless
+        `skips_finished_agents()`.
+        """
+        if self._tracked_snapshot is None or self._agents_changed is None:
+            return
+        if len(self.agent_index.status) != self.get_num_agents():
+            self._agents_changed = None
+            return
+        self._agents_changed.update(self.agent_index.ready_to_depart)
+        self._agents_changed.update(self.agent_index.active)
+        if not self.skips_finished_agents():
+            self._np_random_drawn = True
 
-        # Check for end of episode + set global reward to all rewards!
-        if have_all_agents_ended:
-            self.dones["__all__"] = True
-            self.rewards_dict = {i: self.global_reward for i in range(self.get_num_agents())}
-        if (self._max_episode_steps is not None) and (self._elapsed_steps >= self._max_episode_steps):
-            self.dones["__all__"] = True
-            for i_agent in range(self.get_num_agents()):
-                self.dones[i_agent] = True
-        if self.record_steps:
-            self.record_timestep()
+    def _agents_info(self) -> Dict:
+        """
+        The 'action_required', 'malfunction', 'speed' and 'status' of all agents in their current state.
+        """
+        return {
+            "action_required": {i: self.action_required(agent) for i, agent in enumerate(self.agents)},
+            "malfunction": {i: agent.malfunction for i, agent in enumerate(self.agents)},
+            "speed": {i: agent.speed for i, agent in enumerate(self.agents)},
+            "status": {i: agent.status for i, agent in enumerate(self.agents)},
+        }
+
+    def _step_with_engine(self, action_dict_: Dict[int, RailEnvActions]) -> (Dict, bool):
+        """
+        Performs the step of all agents with the step engine.
+
+        Parameters
+        ----------
+        action_dict_ : Dict[int,RailEnvActions]
 
-        return self._get_observations(), self.rewards_dict, self.dones, info_dict
+        Returns
+        -------
+        info_dict: Dict with agent specific information
+        have_all_agents_ended: bool
+        """
+        actions = np.zeros(self.get_num_agents(), dtype=int)
+        for i_agent, action in action_dict_.items():
+            if action is not None and 0 <= i_agent < len(actions):
+                actions[i_agent] = action
+
+        if self.rewards_array is None or len(self.rewards_array) != self.get_num_agents():
+            self._allocate_step_arrays()
+        self.step_engine.step(actions, self.rewards_array, self.info_arrays)
+
+        self.rewards_dict = dict(enumerate(self.rewards_array.tolist()))
+        info_dict = {
+            "action_required": dict(enumerate(self.info_arrays['action_required'].tolist())),
+            "malfunction": dict(enumerate(self.info_arrays['malfunction'].tolist())),
+            "speed": dict(enumerate(self.info_arrays['speed'].tolist())),
+            "status": {i_agent: RailAgentStatus(status) for i_agent, status in
+                       enumerate(self.info_arrays['status'].tolist())},
+        }
+        have_all_agents_ended = bool(np.all(self.info_arrays['status'] >= RailAgentStatus.DONE))
+        return info_dict, have_all_agents_ended
 
     def _step_agent(self, i_agent, action: Optional[RailEnvActions] = None):
         """
@@ -518,37 +1078,54 @@ class RailEnv(Environment):
         i_agent : int
         action_dict_ : Dict[int,RailEnvActions]
 
+        Returns
+        -------
+        bool
+            Whether the position, direction, status, ticks, moving flag or stored transition action of the agent may
+            have changed
         """
         agent = self.agents[i_agent]
         if agent.status in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED]:  # this agent has already completed...
-            return
+            return False
+        journal = self.journal
 
         # agent gets active by a MOVE_* action and if c
         if agent.status == RailAgentStatus.READY_TO_DEPART:
             if action in [RailEnvActions.MOVE_LEFT, RailEnvActions.MOVE_RIGHT,
                           RailEnvActions.MOVE_FORWARD] and self.cell_free(agent.initial_position):
+                if journal is not None:
+                    journal.record_agent(agent)
                 agent.status = RailAgentStatus.ACTIVE
                 self._set_agent_to_initial_position(agent, agent.initial_position)
-                self.rewards_dict[i_agent] += self.step_penalty * agent.speed_data['speed']
-                return
+                self.agent_index.update(i_agent, agent)
+                departed = True
             else:
                 # TODO: Here we need to check for the departure time in future releases with full schedules
-                self.rewards_dict[i_agent] += self.step_penalty * agent.speed_data['speed']
-                return
-
+                departed = False
+            self.rewards_dict[i_agent] += self.step_penalty * agent.speed
+            if self.perf_stats is not None:
+                self.perf_stats.lap('actions')
+            return departed
+
+        if journal is not None and (agent.old_direction != agent.direction or agent.old_position != agent.position):
+            journal.record_agent(agent)
         agent.old_direction = agent.direction
         agent.old_position = agent.position
 
         # if agent is broken, actions are ignored and agent does not move.
         # full step penalty in this case
-        if agent.malfunction_data['malfunction'] > 0:
-            self.rewards_dict[i_agent] += self.step_penalty * agent.speed_data['speed']
-            return
+        if agent.malfunction > 0:
+            self.rewards_dict[i_agent] += self.step_penalty * agent.speed
+            if self.perf_stats is not None:
+                self.perf_stats.lap('actions')
+            return False
+
+        changed = False
 
         # Is the agent at the beginning of the cell? Then, it can take an action.
         # As long as the agent is malfunctioning or stopped at the beginning of the cell,
         # different actions may be taken!
-        if np.isclose(agent.speed_data['position_fraction'], 0.0, rtol=1e-03):
+        if agent.at_cell_start:
             # No action has been supplied for this agent -> set DO_NOTHING as default
             if action is None:
                 action = RailEnvActions.DO_NOTHING
@@ -565,25 +1142,34 @@ class RailEnv(Environment):
 
             if action == RailEnvActions.STOP_MOVING and agent.moving:
                 # Only allow halting an agent on entering new cells.
+                if journal is not None:
+                    journal.record_agent(agent)
                 agent.moving = False
+                changed = True
                 self.rewards_dict[i_agent] += self.stop_penalty
 
             if not agent.moving and not (
                 action == RailEnvActions.DO_NOTHING or
                 action == RailEnvActions.STOP_MOVING):
                 # Allow agent to start with any forward or direction action
+                if journal is not None:
+                    journal.record_agent(agent)
                 agent.moving = True
+                changed = True
                 self.rewards_dict[i_agent] += self.start_penalty
 
             # Store the action if action is moving
             # If not moving, the action will be stored when the agent starts moving again.
             if agent.moving:
+                if journal is not None:
+                    journal.record_agent(agent)
+                changed = True
                 _action_stored = False
                 _, new_cell_valid, new_direction, new_position, transition_valid = \
                     self._check_action_on_agent(action, agent)
 
                 if all([new_cell_valid, transition_valid]):
-                    agent.speed_data['transition_action_on_cellexit'] = action
+                    agent.transition_action_on_cellexit = action
                     _action_stored = True
                 else:
                     # But, if the chosen invalid action was LEFT/RIGHT, and the agent is moving,
@@ -593,7 +1179,7 @@ class RailEnv(Environment):
                             self._check_action_on_agent(RailEnvActions.MOVE_FORWARD, agent)
 
                         if all([new_cell_valid, transition_valid]):
-                            agent.speed_data['transition_action_on_cellexit'] = RailEnvActions.MOVE_FORWARD
+                            agent.transition_action_on_cellexit = RailEnvActions.MOVE_FORWARD
                             _action_stored = True
 
                 if not _action_stored:
@@ -602,21 +1188,26 @@ class RailEnv(Environment):
                     self.rewards_dict[i_agent] += self.stop_penalty
                     agent.moving = False
 
+        if self.perf_stats is not None:
+            self.perf_stats.lap('actions')
+
         # Now perform a movement.
-        # If agent.moving, increment the position_fraction by the speed of the agent
-        # If the new position fraction is >= 1, reset to 0, and perform the stored
+        # If agent.moving, advance the agent by one tick in its cell
+        # If the agent has spent its ticks per cell, reset the ticks to 0, and perform the stored
         #   transition_action_on_cellexit if the cell is free.
         if agent.moving:
-            agent.speed_data['position_fraction'] += agent.speed_data['speed']
-            if agent.speed_data['position_fraction'] > 1.0 or np.isclose(agent.speed_data['position_fraction'], 1.0,
-                                                                         rtol=1e-03):
+            if journal is not None:
+                journal.record_agent(agent)
+            changed = True
+            agent.advance()
+            if agent.cell_exit_due:
                 # Perform stored action to transition to the next cell as soon as cell is free
                 # Notice that we've already checked new_cell_valid and transition valid when we stored the action,
                 # so we only have to check cell_free now!
 
                 # cell and transition validity was checked when we stored transition_action_on_cellexit!
                 cell_free, new_cell_valid, new_direction, new_position, transition_valid = self._check_action_on_agent(
-                    agent.speed_data['transition_action_on_cellexit'], agent)
+                    agent.transition_action_on_cellexit, agent)
 
                 # N.B. validity of new_cell and transition should have been verified before the action was stored!
                 assert new_cell_valid
@@ -624,20 +1215,24 @@ class RailEnv(Environment):
                 if cell_free:
                     self._move_agent_to_new_position(agent, new_position)
                     agent.direction = new_direction
-                    agent.speed_data['position_fraction'] = 0.0
+                    agent.ticks = 0
 
             # has the agent reached its target?
             if np.equal(agent.position, agent.target).all():
+                if journal is not None:
+                    journal.record_dones()
                 agent.status = RailAgentStatus.DONE
                 self.dones[i_agent] = True
                 self.active_agents.remove(i_agent)
                 agent.moving = False
                 self._remove_agent_from_scene(agent)
+                self.agent_index.update(i_agent, agent)
             else:
-                self.rewards_dict[i_agent] += self.step_penalty * agent.speed_data['speed']
+                self.rewards_dict[i_agent] += self.step_penalty * agent.speed
         else:
             # step penalty if not moving (stopped now or before)
-            self.rewards_dict[i_agent] += self.step_penalty * agent.speed_data['speed']
+            self.rewards_dict[i_agent] += self.step_penalty * agent.speed
+        return changed
 
     def _set_agent_to_initial_position(self, agent: EnvAgent, new_position: IntVector2D):
         """
@@ -649,6 +1244,8 @@ class RailEnv(Environment):
         agent: EnvAgent object
         new_position: IntVector2D
         """
+        if self.journal is not None:
+            self.journal.record_cell(new_position)
         agent.position = new_position
         self.agent_positions[agent.position] = agent.handle
 
@@ -662,6 +1259,9 @@ class RailEnv(Environment):
         agent: EnvAgent object
         new_position: IntVector2D
         """
+        if self.journal is not None:
+            self.journal.record_cell(agent.old_position)
+            self.journal.record_cell(new_position)
         agent.position = new_position
         self.agent_positions[agent.old_position] = -1
         self.agent_positions[agent.position] = agent.handle
@@ -675,6 +1275,8 @@ class RailEnv(Environment):
         -------
         agent: EnvAgent object
         """
+        if self.journal is not None:
+            self.journal.record_cell(agent.position)
         self.agent_positions[agent.position] = -1
         if self.remove_agents_at_target:
             agent.position = None
@@ -698,23 +1300,13 @@ class RailEnv(Environment):
 
 
         """
-        # compute number of possible transitions in the current
-        # cell used to check for invalid actions
-        new_direction, transition_valid = self.check_action(agent, action)
+        # the validity of the new cell and of the transition are looked up in the compiled rail
+        compiled_rail = CompiledRail.for_rail(self.rail)
+        cell = (compiled_rail.cell(*agent.position), agent.direction, min(action, RailEnvActions.STOP_MOVING))
+        new_direction = int(compiled_rail.action_direction[cell])
         new_position = get_new_position(agent.position, new_direction)
-
-        new_cell_valid = (
-            np.array_equal(  # Check the new position is still in the grid
-                new_position,
-                np.clip(new_position, [0, 0], [self.height - 1, self.width - 1]))
-            and  # check the new position has some transitions (ie is not an empty cell)
-            self.rail.get_full_transitions(*new_position) > 0)
-
-        # If transition validity hasn't been checked yet.
-        if transition_valid is None:
-            transition_valid = self.rail.get_transition(
-                (*agent.position, agent.direction),
-                new_direction)
+        new_cell_valid = bool(compiled_rail.action_cell_valid[cell])
+        transition_valid = bool(compiled_rail.action_transition_valid[cell])
 
         # only call cell_free() if new cell is inside the scene
         if new_cell_valid:
@@ -768,35 +1360,12 @@ class RailEnv(Environment):
 
         Returns
         -------
-        Tuple[Grid4TransitionsEnum,Tuple[int,int]]
-
-
-
+        Tuple[Grid4TransitionsEnum,bool]
+            the new direction and whether the transition to it is valid
         """
-        transition_valid = None
-        possible_transitions = self.rail.get_transitions(*agent.position, agent.direction)
-        num_transitions = np.count_nonzero(possible_transitions)
-
-        new_direction = agent.direction
-        if action == RailEnvActions.MOVE_LEFT:
-            new_direction = agent.direction - 1
-            if num_transitions <= 1:
-                transition_valid = False
-
-        elif action == RailEnvActions.MOVE_RIGHT:
-            new_direction = agent.direction + 1
-            if num_transitions <= 1:
-                transition_valid = False
-
-        new_direction %= 4
-
-        if action == RailEnvActions.MOVE_FORWARD and num_transitions == 1:
-            # - dead-end, straight line or curved line;
-            # new_direction will be the only valid transition
-            # - take only available transition
-            new_direction = np.argmax(possible_transitions)
-            transition_valid = True
-        return new_direction, transition_valid
+        compiled_rail = CompiledRail.for_rail(self.rail)
+        cell = (compiled_rail.cell(*agent.position), agent.direction, min(action, RailEnvActions.STOP_MOVING))
+        return int(compiled_rail.action_direction[cell]), bool(compiled_rail.action_transition_valid[cell])
 
     def _get_observations(self):
         """
@@ -804,11 +1373,41 @@ class RailEnv(Environment):
 
         Returns
         ------
-        Dict object
+        Dict object, or LazyObservations if `lazy_observations` is set, or PendingObservations with an
+        `observation_pipeline`
         """
-        self.obs_dict = self.obs_builder.get_many(list(range(self.get_num_agents())))
+        self._expire_observations()
+        handles = list(range(self.get_num_agents()))
+        observed = handles
+        if self.decision_observations:
+            observed = [i for i in handles if self.action_required(self.agents[i])]
+        if self.observation_pipeline is not None:
+            self.obs_dict = self.observation_pipeline.submit(handles, observed)
+        elif self.lazy_observations:
+            # the shared data is computed for all agents, such that the observations are the same as from get_many()
+            self.obs_builder.prepare(handles)
+            self.obs_dict = LazyObservations(self.obs_builder, observed)
+        else:
+            self.obs_dict = self._build_observations(handles, observed)
         return self.obs_dict
 
+    def _expire_observations(self):
+        """
+        Prevents the lazy observations of the current state from being computed after the state changed.
+        """
+        if isinstance(self.obs_dict, LazyObservations):
+            self.obs_dict.expire()
+
+    def _build_observations(self, handles: List[int], observed: List[int]) -> Dict:
+        """
+        Builds the observations of the agents `observed`, with the data shared by the observations computed for all
+        agents `handles`.
+        """
+        if observed is handles:
+            return self.obs_builder.get_many(handles)
+        self.obs_builder.prepare(handles)
+        return {i: self.obs_builder.get(i) for i in observed}
+
     def get_valid_directions_on_grid(self, row: int, col: int) -> List[int]:
         """
         Returns directions in which the agent can move
@@ -824,6 +1423,144 @@ class RailEnv(Environment):
         """
         return Grid4Transitions.get_entry_directions(self.rail.get_full_transitions(row, col))
 
+    def start_journal(self, max_steps: Optional[int] = None):
+        """
+        Starts recording the changes of the following steps, such that they can be rolled back by `undo()`.
+
+        Parameters
+        ----------
+        max_steps : int, optional
+            Maximum number of steps which can be undone, only the changes of the last steps are kept.
+        """
+        self.journal = StepJournal(self, max_steps)
+
+    def stop_journal(self):
+        """
+        Stops recording the changes of the steps, the recorded steps cannot be undone any more.
+        """
+        self.journal = None
+
+    def enable_perf_stats(self, on_episode_end: Optional[Callable[[PerfStats], None]] = None) -> PerfStats:
+        """
+        Starts measuring the wall time of the phases of the steps: malfunction sampling, action handling,
+        movement, info construction, recording, prediction and observation building. The prediction is only timed
+        separately if the observations are not built by an `observation_pipeline`, whose laps would interleave with
+        the ones of the step.
+
+        Parameters
+        ----------
+        on_episode_end : Callable[[PerfStats], None], optional
+            Called with the stats at the end of each episode, e.g. `PerfStats.dump` to print them as a table.
+
+        Returns
+        -------
+        PerfStats
+            The stats, also available as `perf_stats`
+        """
+        self.perf_stats = PerfStats(on_episode_end)
+        if self.observation_pipeline is None:
+            self.obs_builder.set_perf_stats(self.perf_stats)
+        return self.perf_stats
+
+    def disable_perf_stats(self):
+        self.perf_stats = None
+        self.obs_builder.set_perf_stats(None)
+
+    def undo(self):
+        """
+        Rolls back the last step recorded since `start_journal()`, in time proportional to the number of agents and
+        cells changed by the step. The observations are not rolled back, lazy observations not accessed yet expire.
+        """
+        assert self.journal is not None, "undo() requires start_journal()"
+        if self.observation_pipeline is not None:
+            self.observation_pipeline.sync()
+        self._expire_observations()
+        self._finished_info = None
+        self.journal.undo()
+
+    def snapshot(self) -> RailEnvSnapshot:
+        """
+        Copies the dynamic state of the environment: the agents, the agent positions on the grid, the state of the
+        random generator, the elapsed steps, the dones, the rewards of the last step and the number of recorded
+        steps.
+
+        The rail, the distance map and the generators are not copied, a snapshot can only be restored in the same
+        environment before its next reset.
+        """
+        snapshot = RailEnvSnapshot(agents=[agent.get_dynamic_state() for agent in self.agents],
+                                   agent_positions=self.agent_positions.copy(),
+                                   np_random_state=self.np_random.get_state(),
+                                   elapsed_steps=self._elapsed_steps,
+                                   dones=self.dones.copy(),
+                                   active_agents=list(self.active_agents),
+                                   rewards_dict=self.rewards_dict.copy(),
+                                   episode_length=len(self.cur_episode))
+        self._tracked_snapshot = snapshot
+        self._agents_changed = set()
+        return snapshot
+
+    def restore(self, snapshot: RailEnvSnapshot):
+        """
+        Restores the dynamic state of the environment from a `snapshot()`. The same snapshot can be restored several
+        times. The steps recorded after the snapshot are dropped and the journal is cleared.
+
+        Restoring the last snapshot taken or restored only restores the agents the steps and `undo()` may have changed
+        since then, the agents ready to depart or active, in time proportional to their number. The done agents are
+        only compared with the snapshot if the steps drew their malfunctions from `np_random`. Agents modified outside
+        of the environment in the meantime are not restored. Other snapshots are compared with all agents.
+        """
+        assert len(snapshot.agents) == len(self.agents), "the snapshot was taken with a different number of agents"
+        if self.observation_pipeline is not None:
+            self.observation_pipeline.sync()
+        self._expire_observations()
+        # only the agents changed since the snapshot are restored and updated in the index, engine and hash
+        tracked = snapshot is self._tracked_snapshot and self._agents_changed is not None
+        if tracked:
+            restored = sorted(self._agents_changed)
+            for handle in restored:
+                self.agents[handle].set_dynamic_state(snapshot.agents[handle])
+        else:
+            restored = []
+        if not tracked or self._np_random_drawn:
+            for handle, (agent, state) in enumerate(zip(self.agents, snapshot.agents)):
+                if not (tracked and handle in self._agents_changed) and not agent.has_dynamic_state(state):
+                    agent.set_dynamic_state(state)
+                    restored.append(handle)
+            self.np_random.set_state(snapshot.np_random_state)
+        self._tracked_snapshot = snapshot
+        self._agents_changed = set()
+        self._np_random_drawn = False
+        np.copyto(self.agent_positions, snapshot.agent_positions)
+        self._elapsed_steps = snapshot.elapsed_steps
+        self.dones = snapshot.dones.copy()
+        self.active_agents = OrderedSet.fromkeys(snapshot.active_agents)
+        self.rewards_dict = snapshot.rewards_dict.copy()
+        del self.cur_episode[snapshot.episode_length:]
+        if self.journal is not None:
+            self.journal.clear()
+        # the info of the agents done at the snapshot is kept, they did not change since, the other agents are stepped
+        self.agent_index.sync(self.agents, restored)
+        if self.action_masks is not None:
+            self.action_masks.agents_modified(restored)
+        if self.step_engine is not None:
+            self.step_engine.agents_modified(restored)
+        if self.incremental_hash is not None:
+            for handle in restored:
+                self.incremental_hash.update(handle, self.agents[handle])
+
+    @property
+    def state_hash(self) -> int:
+        """
+        64-bit hash of the dynamic state of the agents: their cell, direction, ticks in the cell, status, remaining
+        malfunction, whether they are moving and their stored transition action. With `incremental_state_hash`, it is
+        kept up to date by the steps, otherwise it is computed from all agents.
+        """
+        if self.incremental_hash is not None:
+            return self.incremental_hash.value
+        state_hash = StateHash()
+        state_hash.reset(self.agents, self.width)
+        return state_hash.value
+
     def get_full_state_msg(self) -> Packer:
         """
         Returns state of environment in msgpack object
@@ -886,6 +1623,7 @@ class RailEnv(Environment):
         self.rail.height = self.height
         self.rail.width = self.width
         self.dones = dict.fromkeys(list(range(self.get_num_agents())) + ["__all__"], False)
+        self.agent_index.reset(self.agents)
 
     def set_full_state_dist_msg(self, msg_data):
         """
@@ -909,6 +1647,7 @@ class RailEnv(Environment):
         self.rail.height = self.height
         self.rail.width = self.width
         self.dones = dict.fromkeys(list(range(self.get_num_agents())) + ["__all__"], False)
+        self.agent_index.reset(self.agents)
 
     def save(self, filename, save_distance_maps=False):
         """
@@ -995,4 +1734,4 @@ class RailEnv(Environment):
         True if agent is ok, False otherwise
 
         """
-        return agent.malfunction_data['malfunction'] < 1
+        return agent.malfunction < 1
@@ -8,11 +8,14 @@ from flatland.core.grid.grid4 import Grid4TransitionsEnum
 from flatland.core.grid.grid4_utils import get_new_position
 from flatland.core.transition_map import GridTransitionMap
 from flatland.envs.agent_utils import RailAgentStatus
+from flatland.envs.compiled_rail import CompiledRail
 from flatland.envs.distance_map import DistanceMap
 from flatland.envs.rail_env import RailEnvNextAction, RailEnvActions, RailEnv
 from flatland.envs.rail_trainrun_data_structures import Waypoint
 from flatland.utils.ordered_set import OrderedSet
 
+_MOVE_ACTIONS = (RailEnvActions.MOVE_LEFT, RailEnvActions.MOVE_FORWARD, RailEnvActions.MOVE_RIGHT)
+
 
 def get_valid_move_actions_(agent_direction: Grid4TransitionsEnum,
                             agent_position: Tuple[int, int],
@@ -20,8 +23,7 @@ def get_valid_move_actions_(agent_direction: Grid4TransitionsEnum,
     """
     Get the valid move actions (forward, left, right) for an agent.
 
-    TODO https://gitlab.aicrowd.com/flatland/flatland/issues/299 The implementation could probably be more efficient
-    and more elegant. But given the few calls this has no priority now.
+    The move actions are looked up in the `CompiledRail` of the `rail`.
 
     Parameters
     ----------
@@ -36,38 +38,25 @@ def get_valid_move_actions_(agent_direction: Grid4TransitionsEnum,
         Possible move actions (forward,left,right) and the next position/direction they lead to.
         It is not checked that the next cell is free.
     """
-    valid_actions: Set[RailEnvNextAction] = OrderedSet()
-    possible_transitions = rail.get_transitions(*agent_position, agent_direction)
-    num_transitions = np.count_nonzero(possible_transitions)
-    # Start from the current orientation, and see which transitions are available;
-    # organize them as [left, forward, right], relative to the current orientation
-    # If only one transition is possible, the forward branch is aligned with it.
-    if rail.is_dead_end(agent_position):
-        action = RailEnvActions.MOVE_FORWARD
-        exit_direction = (agent_direction + 2) % 4
-        if possible_transitions[exit_direction]:
-            new_position = get_new_position(agent_position, exit_direction)
-            valid_actions.add(RailEnvNextAction(action, new_position, exit_direction))
-    elif num_transitions == 1:
-        action = RailEnvActions.MOVE_FORWARD
-        for new_direction in [(agent_direction + i) % 4 for i in range(-1, 2)]:
-            if possible_transitions[new_direction]:
-                new_position = get_new_position(agent_position, new_direction)
-                valid_actions.add(RailEnvNextAction(action, new_position, new_direction))
-    else:
-        for new_direction in [(agent_direction + i) % 4 for i in range(-1, 2)]:
-            if possible_transitions[new_direction]:
-                if new_direction == agent_direction:
-                    action = RailEnvActions.MOVE_FORWARD
-                elif new_direction == (agent_direction + 1) % 4:
-                    action = RailEnvActions.MOVE_RIGHT
-                elif new_direction == (agent_direction - 1) % 4:
-                    action = RailEnvActions.MOVE_LEFT
-                else:
-                    raise Exception("Illegal state")
-
-                new_position = get_new_position(agent_position, new_direction)
-                valid_actions.add(RailEnvNextAction(action, new_position, new_direction))
+    return OrderedSet.fromkeys(_valid_move_actions(CompiledRail.for_rail(rail), agent_position, agent_direction))
+
+
+def _valid_move_actions(compiled_rail: CompiledRail, agent_position: Tuple[int, int],
+                        agent_direction: int) -> Tuple[RailEnvNextAction, ...]:
+    """
+    The valid move actions of an agent, cached per cell and direction on the `compiled_rail`.
+    """
+    cache = compiled_rail.cache.setdefault('valid_move_actions', {})
+    key = (agent_position[0], agent_position[1], agent_direction)
+    valid_actions = cache.get(key)
+    if valid_actions is None:
+        valid_actions = []
+        for action in _MOVE_ACTIONS:
+            move = compiled_rail.move(agent_position, agent_direction, action)
+            if move is not None:
+                valid_actions.append(RailEnvNextAction(action, *move))
+        valid_actions = tuple(valid_actions)
+        cache[key] = valid_actions
     return valid_actions
 
 
@@ -79,8 +68,7 @@ def get_new_position_for_action(
     """
     Get the next position for this action.
 
-    TODO https://gitlab.aicrowd.com/flatland/flatland/issues/299 The implementation could probably be more efficient
-    and more elegant. But given the few calls this has no priority now.
+    The move is looked up in the `CompiledRail` of the `rail`.
 
     Parameters
     ----------
@@ -95,43 +83,7 @@ def get_new_position_for_action(
     Tuple[int,int,int]
         row, column, direction
     """
-    possible_transitions = rail.get_transitions(*agent_position, agent_direction)
-    num_transitions = np.count_nonzero(possible_transitions)
-    # Start from the current orientation, and see which transitions are available;
-    # organize them as [left, forward, right], relative to the current orientation
-    # If only one transition is possible, the forward branch is aligned with it.
-    if rail.is_dead_end(agent_position):
-        valid_action = RailEnvActions.MOVE_FORWARD
-        exit_direction = (agent_direction + 2) % 4
-        if possible_transitions[exit_direction]:
-            new_position = get_new_position(agent_position, exit_direction)
-            if valid_action == action:
-                return new_position, exit_direction
-    elif num_transitions == 1:
-        valid_action = RailEnvActions.MOVE_FORWARD
-        for new_direction in [(agent_direction + i) % 4 for i in range(-1, 2)]:
-            if possible_transitions[new_direction]:
-                new_position = get_new_position(agent_position, new_direction)
-                if valid_action == action:
-                    return new_position, new_direction
-    else:
-        for new_direction in [(agent_direction + i) % 4 for i in range(-1, 2)]:
-            if possible_transitions[new_direction]:
-                if new_direction == agent_direction:
-                    valid_action = RailEnvActions.MOVE_FORWARD
-                    if valid_action == action:
-                        new_position = get_new_position(agent_position, new_direction)
-                        return new_position, new_direction
-                elif new_direction == (agent_direction + 1) % 4:
-                    valid_action = RailEnvActions.MOVE_RIGHT
-                    if valid_action == action:
-                        new_position = get_new_position(agent_position, new_direction)
-                        return new_position, new_direction
-                elif new_direction == (agent_direction - 1) % 4:
-                    valid_action = RailEnvActions.MOVE_LEFT
-                    if valid_action == action:
-                        new_position = get_new_position(agent_position, new_direction)
-                        return new_position, new_direction
+    return CompiledRail.for_rail(rail).move(agent_position, agent_direction, action)
 
 
 def get_action_for_move(
@@ -143,8 +95,7 @@ def get_action_for_move(
     """
     Get the action (if any) to move from a position and direction to another.
 
-    TODO https://gitlab.aicrowd.com/flatland/flatland/issues/299 The implementation could probably be more efficient
-    and more elegant. But given the few calls this has no priority now.
+    The moves are looked up in the `CompiledRail` of the `rail`.
 
     Parameters
     ----------
@@ -160,43 +111,10 @@ def get_action_for_move(
     Optional[RailEnvActions]
         the action (if direct transition possible) or None.
     """
-    possible_transitions = rail.get_transitions(*agent_position, agent_direction)
-    num_transitions = np.count_nonzero(possible_transitions)
-    # Start from the current orientation, and see which transitions are available;
-    # organize them as [left, forward, right], relative to the current orientation
-    # If only one transition is possible, the forward branch is aligned with it.
-    if rail.is_dead_end(agent_position):
-        valid_action = RailEnvActions.MOVE_FORWARD
-        new_direction = (agent_direction + 2) % 4
-        if possible_transitions[new_direction]:
-            new_position = get_new_position(agent_position, new_direction)
-            if new_position == next_agent_position and new_direction == next_agent_direction:
-                return valid_action
-    elif num_transitions == 1:
-        valid_action = RailEnvActions.MOVE_FORWARD
-        for new_direction in [(agent_direction + i) % 4 for i in range(-1, 2)]:
-            if possible_transitions[new_direction]:
-                new_position = get_new_position(agent_position, new_direction)
-                if new_position == next_agent_position and new_direction == next_agent_direction:
-                    return valid_action
-    else:
-        for new_direction in [(agent_direction + i) % 4 for i in range(-1, 2)]:
-            if possible_transitions[new_direction]:
-                if new_direction == agent_direction:
-                    valid_action = RailEnvActions.MOVE_FORWARD
-                    new_position = get_new_position(agent_position, new_direction)
-                    if new_position == next_agent_position and new_direction == next_agent_direction:
-                        return valid_action
-                elif new_direction == (agent_direction + 1) % 4:
-                    valid_action = RailEnvActions.MOVE_RIGHT
-                    new_position = get_new_position(agent_position, new_direction)
-                    if new_position == next_agent_position and new_direction == next_agent_direction:
-                        return valid_action
-                elif new_direction == (agent_direction - 1) % 4:
-                    valid_action = RailEnvActions.MOVE_LEFT
-                    new_position = get_new_position(agent_position, new_direction)
-                    if new_position == next_agent_position and new_direction == next_agent_direction:
-                        return valid_action
+    for valid_action in _valid_move_actions(CompiledRail.for_rail(rail), agent_position, agent_direction):
+        if valid_action.next_position == next_agent_position and valid_action.next_direction == next_agent_direction:
+            return valid_action.action
+    return None
 
 
 # N.B. get_shortest_paths is not part of distance_map since it refers to RailEnvActions (would lead to circularity!)
@@ -302,6 +220,8 @@ def get_k_shortest_paths(env: RailEnv,
         We use a list of paths in order to keep the order of length.
     """
 
+    compiled_rail = CompiledRail.for_rail(env.rail)
+
     # P: set of shortest paths from s to t
     # P =empty,
     shortest_paths: List[Tuple[Waypoint]] = []
@@ -348,7 +268,7 @@ def get_k_shortest_paths(env: RailEnv,
         # – if countu ≤ K then
         # CAVEAT: do not allow for loopy paths
         elif count[urcd] <= k:
-            possible_transitions = env.rail.get_transitions(*urcd)
+            possible_transitions = compiled_rail.transitions[compiled_rail.cell(*u.position), u.direction]
             if debug:
                 print("  looking at neighbors of u={}, transitions are {}".format(u, possible_transitions))
             #     for each vertex v adjacent to u:
@@ -1105,22 +1105,10 @@ def sparse_rail_generator(max_num_cities: int = 5, grid_mode: bool = False, max_
 
         """
 
-        # Fix all cities with illegal transition maps
-        rails_to_fix = np.zeros(3 * grid_map.height * grid_map.width * 2, dtype='int')
-        rails_to_fix_cnt = 0
-        cells_to_fix = city_cells + inter_city_lines
-        for cell in cells_to_fix:
-            cell_valid = grid_map.cell_neighbours_valid(cell, True)
-
-            if not cell_valid:
-                rails_to_fix[3 * rails_to_fix_cnt] = cell[0]
-                rails_to_fix[3 * rails_to_fix_cnt + 1] = cell[1]
-                rails_to_fix[3 * rails_to_fix_cnt + 2] = vector_field[cell]
-
-                rails_to_fix_cnt += 1
-        # Fix all other cells
-        for cell in range(rails_to_fix_cnt):
-            grid_map.fix_transitions((rails_to_fix[3 * cell], rails_to_fix[3 * cell + 1]), rails_to_fix[3 * cell + 2])
+        # Fix all cities with illegal transition maps, the cells are all checked before the first one is fixed
+        invalid_cells = grid_map.invalid_cells(check_cells=True)
+        rails_to_fix = [cell for cell in city_cells + inter_city_lines if invalid_cells[tuple(cell)]]
+        grid_map.fix_cells(rails_to_fix, [vector_field[tuple(cell)] for cell in rails_to_fix])
 
     def _closest_neighbour_in_grid4_directions(current_city_idx: int, city_positions: IntVector2DArray) -> List[int]:
         """
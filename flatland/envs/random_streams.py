@@ -0,0 +1,47 @@
+"""
+Counter-based random streams per agent for the malfunctions of a RailEnv.
+
+By default, the malfunction generator draws the malfunctions of all agents from the single random stream `np_random`
+of the environment, one agent after the other. The draws of an agent then depend on the number of agents and on the
+order they are processed in. The `AgentRandomStreams` derive the draws of an agent at a step from the Philox
+counter-based generator instead: the key is derived from the seed of the environment and the episode, counted from
+the seeding, the counter from the agent handle and the step. The malfunctions are then the same whatever order or
+batches the agents are stepped in.
+"""
+import numpy as np
+from numpy.random.mtrand import RandomState
+
+
+class AgentRandomStreams:
+    """
+    Independent random streams per (seed, episode, agent handle, step).
+
+    `for_agent` returns a `RandomState` positioned at the beginning of the stream of an agent at a step, which can be
+    passed to the malfunction generators in place of `np_random`. The same `RandomState` is repositioned by each
+    call, the draws from a stream have to be made before the next call.
+    """
+
+    def __init__(self):
+        self._bit_generator = np.random.Philox(0)
+        self._random_state = RandomState(self._bit_generator)
+        self._key = np.zeros(2, dtype=np.uint64)
+
+    def reset(self, seed: int, episode: int):
+        """
+        Derives the key of the streams of an `episode` of the environment seeded with `seed`.
+        """
+        self._key = np.random.SeedSequence([seed, episode]).generate_state(2, dtype=np.uint64)
+
+    def for_agent(self, handle: int, step: int) -> RandomState:
+        """
+        The stream of the agent with `handle` at `step`.
+        """
+        self._bit_generator.state = {
+            'bit_generator': 'Philox',
+            'state': {'counter': np.array([0, step, handle, 0], dtype=np.uint64), 'key': self._key},
+            'buffer': np.zeros(4, dtype=np.uint64),
+            'buffer_pos': 4,
+            'has_uint32': 0,
+            'uinteger': 0
+        }
+        return self._random_state
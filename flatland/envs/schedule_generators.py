@@ -297,8 +297,8 @@ def schedule_from_file(filename, load_from_package=None) -> ScheduleGenerator:
         agents_position = [a.initial_position for a in agents]
         agents_direction = [a.direction for a in agents]
         agents_target = [a.target for a in agents]
-        agents_speed = [a.speed_data['speed'] for a in agents]
-        agents_malfunction = [a.malfunction_data['malfunction_rate'] for a in agents]
+        agents_speed = [a.speed for a in agents]
+        agents_malfunction = [a.malfunction_rate for a in agents]
 
         return Schedule(agent_positions=agents_position, agent_directions=agents_direction,
                         agent_targets=agents_target, agent_speeds=agents_speed, agent_malfunction_rates=None)
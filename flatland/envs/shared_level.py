@@ -0,0 +1,178 @@
+"""
+Level shared read-only by many RailEnv instances.
+
+When many environments run the same level, e.g. for population-based training on one evaluation scenario, each
+of them would hold its own copy of the grid, of its compiled rail and of the `(n_agents, height, width, 4)` distance
+map. A `SharedLevel` holds the grid, the compiled rail, the schedule and the distance map of a level once, read-only.
+The environments created by `make_env` (or with its `rail_generator` and `schedule_generator`) reference them, such
+that the memory per environment scales with its dynamic state only.
+
+Across processes, the level is saved once with `save` and loaded in each process with `load`, which maps the arrays
+from the files: the pages are shared by the processes through the page cache, read-only or copy-on-write.
+"""
+import os
+from typing import Any, Optional
+
+import msgpack
+import numpy as np
+from numpy.random.mtrand import RandomState
+
+from flatland.core.grid.rail_env_grid import RailEnvTransitions
+from flatland.core.transition_map import GridTransitionMap
+from flatland.envs.agent_utils import EnvAgent
+from flatland.envs.compiled_rail import CompiledRail
+from flatland.envs.distance_map import DistanceMap
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import RailGenerator, RailGeneratorProduct
+from flatland.envs.schedule_generators import ScheduleGenerator
+from flatland.envs.schedule_utils import Schedule
+
+GRID_FILE = 'grid.npy'
+DISTANCE_MAP_FILE = 'distance_map.npy'
+SCHEDULE_FILE = 'schedule.mpk'
+
+
+class SharedLevel:
+    """
+    Read-only grid, schedule and distance map of a level, referenced by the environments on this level.
+
+    Each environment gets its own `GridTransitionMap` on the shared grid array, the grid cannot be modified, with the
+    shared `CompiledRail` of the grid. The maximum number of steps of the episodes is computed from the size of the
+    grid, as for levels loaded from files.
+    """
+
+    def __init__(self, grid: np.ndarray, schedule: Schedule, distance_map: Optional[np.ndarray] = None):
+        """
+        Parameters
+        ----------
+        grid : np.ndarray
+            The cells of the rail with `RailEnvTransitions`, copied unless it is read-only already.
+        schedule : Schedule
+            The agents of the level.
+        distance_map : np.ndarray, optional
+            The distance map of the agents on the grid, computed if not given.
+        """
+        if grid.flags.writeable:
+            grid = grid.copy()
+            grid.flags.writeable = False
+        self.grid = grid
+        self.height, self.width = grid.shape
+        self.schedule = schedule
+        self.fingerprint = self._new_rail().fingerprint()
+        self.compiled_rail = CompiledRail.for_rail(self._new_rail(), fingerprint=self.fingerprint)
+
+        if distance_map is None:
+            rail = self._new_rail()
+            agents = EnvAgent.from_schedule(schedule)
+            distance_map_builder = DistanceMap(agents, self.height, self.width)
+            distance_map_builder.reset(agents, rail)
+            distance_map = distance_map_builder.get()
+        if distance_map.flags.writeable:
+            distance_map = distance_map.copy()
+            distance_map.flags.writeable = False
+        self.distance_map = distance_map
+
+    @staticmethod
+    def from_env(env: RailEnv) -> 'SharedLevel':
+        """
+        The level of the current episode of `env`, after its reset.
+        """
+        agents = env.agents
+        schedule = Schedule(agent_positions=[agent.initial_position for agent in agents],
+                            agent_directions=[agent.initial_direction for agent in agents],
+                            agent_targets=[agent.target for agent in agents],
+                            agent_speeds=[agent.speed for agent in agents],
+                            agent_malfunction_rates=[agent.malfunction_rate for agent in agents])
+        return SharedLevel(env.rail.grid, schedule, env.distance_map.get())
+
+    def _new_rail(self) -> GridTransitionMap:
+        rail = GridTransitionMap(width=self.width, height=self.height, transitions=RailEnvTransitions())
+        rail.grid = self.grid
+        fingerprint = getattr(self, 'fingerprint', None)
+        if fingerprint is not None:
+            rail.fingerprint_of_grid = (self.grid, fingerprint)
+        rail.compiled_rail = getattr(self, 'compiled_rail', None)
+        return rail
+
+    def rail_generator(self) -> RailGenerator:
+        """
+        Rail generator returning a rail on the shared grid, with the shared distance map.
+        """
+
+        def generator(width: int, height: int, num_agents: int, num_resets: int = 0,
+                      np_random: RandomState = None) -> RailGeneratorProduct:
+            return self._new_rail(), {'distance_map': self.distance_map}
+
+        return generator
+
+    def schedule_generator(self) -> ScheduleGenerator:
+        """
+        Schedule generator returning the schedule of the level.
+        """
+
+        def generator(rail: GridTransitionMap, num_agents: int, hints: Any = None, num_resets: int = 0,
+                      np_random: RandomState = None) -> Schedule:
+            return self.schedule
+
+        return generator
+
+    def make_env(self, **kwargs) -> RailEnv:
+        """
+        Creates an environment on the level, `kwargs` are passed to the `RailEnv`, e.g. the `obs_builder_object`.
+        """
+        return RailEnv(width=self.width, height=self.height, rail_generator=self.rail_generator(),
+                       schedule_generator=self.schedule_generator(),
+                       number_of_agents=len(self.schedule.agent_positions), **kwargs)
+
+    def save(self, directory: str):
+        """
+        Saves the level into `directory`, to be loaded by `load`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, GRID_FILE), self.grid)
+        np.save(os.path.join(directory, DISTANCE_MAP_FILE), self.distance_map)
+        schedule = self.schedule
+        schedule_data = {
+            'agent_positions': [[int(x) for x in position] for position in schedule.agent_positions],
+            'agent_directions': [int(direction) for direction in schedule.agent_directions],
+            'agent_targets': [[int(x) for x in target] for target in schedule.agent_targets],
+            'agent_speeds': None if schedule.agent_speeds is None else [float(s) for s in schedule.agent_speeds],
+            'agent_malfunction_rates': None if schedule.agent_malfunction_rates is None else [
+                float(rate) for rate in schedule.agent_malfunction_rates]
+        }
+        with open(os.path.join(directory, SCHEDULE_FILE), "wb") as file_out:
+            file_out.write(msgpack.packb(schedule_data, use_bin_type=True))
+
+    @staticmethod
+    def load(directory: str, mmap_mode: Optional[str] = 'r') -> 'SharedLevel':
+        """
+        Loads a level saved by `save`.
+
+        Parameters
+        ----------
+        directory : str
+        mmap_mode : str, optional
+            'r' maps the grid and the distance map read-only from the files, 'c' copy-on-write, None reads them into
+            memory.
+        """
+        grid = np.load(os.path.join(directory, GRID_FILE), mmap_mode=mmap_mode)
+        distance_map = np.load(os.path.join(directory, DISTANCE_MAP_FILE), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, SCHEDULE_FILE), "rb") as file_in:
+            data = msgpack.unpackb(file_in.read(), use_list=False, encoding='utf-8')
+        schedule = Schedule(agent_positions=[tuple(position) for position in data['agent_positions']],
+                            agent_directions=list(data['agent_directions']),
+                            agent_targets=[tuple(target) for target in data['agent_targets']],
+                            agent_speeds=None if data['agent_speeds'] is None else list(data['agent_speeds']),
+                            agent_malfunction_rates=None if data['agent_malfunction_rates'] is None else list(
+                                data['agent_malfunction_rates']))
+        return SharedLevel(_read_only(grid), schedule, _read_only(distance_map))
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    """
+    Read-only view of an array mapped copy-on-write, which is then not copied by the `SharedLevel`.
+    """
+    if array.flags.writeable and isinstance(array, np.memmap):
+        array = array.view()
+        array.flags.writeable = False
+    return array
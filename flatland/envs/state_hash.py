@@ -0,0 +1,101 @@
+"""
+Incremental hash of the dynamic state of the agents of a RailEnv.
+
+Planners detect transpositions, i.e. states reached on different paths, by hashing the state at every node. The
+`StateHash` combines a 64-bit hash per agent by xor, Zobrist-style: when an agent changes, its old hash is xored out
+and its new hash xored in, such that the hash of the whole state is updated in O(1) per changed agent.
+
+The hash of an agent covers its cell, direction, ticks in the cell, status, remaining malfunction steps, whether it
+is moving and its stored transition action, which together determine how it continues.
+"""
+from functools import reduce
+from operator import xor
+from typing import List
+
+import numpy as np
+
+from flatland.envs.agent_utils import EnvAgent
+
+_MASK = (1 << 64) - 1
+_SEED = 0x9e3779b97f4a7c15
+_MIX_1 = 0xbf58476d1ce4e5b9
+_MIX_2 = 0x94d049bb133111eb
+
+
+def _mix(z: int) -> int:
+    """
+    splitmix64 finalizer on Python ints.
+    """
+    z = ((z ^ (z >> 30)) * _MIX_1) & _MASK
+    z = ((z ^ (z >> 27)) * _MIX_2) & _MASK
+    return z ^ (z >> 31)
+
+
+def _mix_array(z: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 finalizer on uint64 arrays, the multiplications wrap around like `_mix`.
+    """
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(_MIX_1)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(_MIX_2)
+    return z ^ (z >> np.uint64(31))
+
+
+class StateHash:
+    """
+    Hash of the dynamic state of the agents, kept up to date by the environment steps.
+
+    Changes made to the agents outside of the environment steps are not noticed, `reset` the hash after them.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.width = 0
+        self.agent_hashes: List[int] = []
+
+    def reset(self, agents: List[EnvAgent], width: int):
+        """
+        Recomputes the hash of all `agents` on a grid of `width` columns.
+        """
+        self.width = width
+        self.agent_hashes = [self.agent_hash(handle, agent) for handle, agent in enumerate(agents)]
+        self.value = reduce(xor, self.agent_hashes, 0)
+
+    def update(self, handle: int, agent: EnvAgent):
+        """
+        Updates the hash after the `agent` with `handle` changed.
+        """
+        agent_hash = self.agent_hash(handle, agent)
+        self.value ^= self.agent_hashes[handle] ^ agent_hash
+        self.agent_hashes[handle] = agent_hash
+
+    def update_arrays(self, handles: np.ndarray, arrays):
+        """
+        Updates the hash after the agents with `handles` changed, from the `AgentArrays` of a vectorized step engine.
+        """
+        if len(handles) == 0:
+            return
+        position = arrays.position[handles]
+        cell = np.where(position[:, 0] < 0, 0, position[:, 0] * self.width + position[:, 1] + 1)
+        agent_hash = np.full(len(handles), _SEED, dtype=np.uint64)
+        for field in [handles, cell, arrays.direction[handles] + 1, arrays.ticks[handles], arrays.status[handles],
+                      arrays.malfunction[handles], arrays.moving[handles],
+                      arrays.transition_action_on_cellexit[handles]]:
+            agent_hash = _mix_array(agent_hash ^ np.asarray(field).astype(np.uint64))
+        agent_hashes = self.agent_hashes
+        value = self.value
+        for handle, new_hash in zip(handles.tolist(), agent_hash.tolist()):
+            value ^= agent_hashes[handle] ^ new_hash
+            agent_hashes[handle] = new_hash
+        self.value = value
+
+    def agent_hash(self, handle: int, agent: EnvAgent) -> int:
+        """
+        The 64-bit hash of the dynamic state of the `agent` with `handle`.
+        """
+        position = agent.position
+        cell = 0 if position is None else int(position[0]) * self.width + int(position[1]) + 1
+        agent_hash = _SEED
+        for field in (handle, cell, int(agent.direction) + 1, agent.ticks, int(agent.status), int(agent.malfunction),
+                      int(agent.moving), int(agent.transition_action_on_cellexit)):
+            agent_hash = _mix(agent_hash ^ field)
+        return agent_hash
@@ -0,0 +1,491 @@
+"""
+Step engines for the RailEnv.
+
+A step engine advances all agents of a `RailEnv` by one time step. The `VectorizedStepEngine` keeps the dynamic
+state of the agents in a struct of numpy arrays (`AgentArrays`) between steps and updates all agents with batched
+array operations, the values it changes are written back to the agents at the end of each step. Only the agents
+competing for a cell (departures, cell exits and arrivals at the target) are resolved one by one in the order of their
+handle, which keeps the conflict semantics of `RailEnv._step_agent`. The `JitStepEngine` resolves them in a kernel
+compiled with numba if it is installed.
+"""
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+from flatland.envs.compiled_rail import CompiledRail, DIRECTION_OFFSETS
+from flatland.envs.malfunction_generators import is_no_malfunction_generator
+from flatland.envs.rail_env import RailEnv, RailEnvActions
+from flatland.envs.step_journal import StepJournal
+from flatland.envs.step_kernels import NUMBA_AVAILABLE, ARRIVED, UNCHANGED, move_agents
+
+# lookup table from the status stored in the arrays to the enum stored in the agents
+_AGENT_STATUS = tuple(RailAgentStatus)
+
+
+class AgentArrays:
+    """
+    Struct of arrays holding the dynamic state of the agents of a `RailEnv`.
+
+    Positions of agents which are not in the grid (position `None`) are stored as (-1, -1), unset directions as -1.
+    """
+
+    # the arrays written back into the agents by `push`
+    _PUSHED = ['position', 'direction', 'old_position', 'old_direction', 'status', 'moving', 'ticks',
+               'transition_action_on_cellexit', 'malfunction']
+
+    def __init__(self, number_of_agents: int):
+        self.number_of_agents = number_of_agents
+        self.position = np.full((number_of_agents, 2), -1, dtype=int)
+        self.direction = np.zeros(number_of_agents, dtype=int)
+        self.old_position = np.full((number_of_agents, 2), -1, dtype=int)
+        self.old_direction = np.full(number_of_agents, -1, dtype=int)
+        self.initial_position = np.full((number_of_agents, 2), -1, dtype=int)
+        self.target = np.full((number_of_agents, 2), -1, dtype=int)
+        self.status = np.zeros(number_of_agents, dtype=int)
+        self.moving = np.zeros(number_of_agents, dtype=bool)
+        self.speed = np.ones(number_of_agents)
+        self.ticks = np.zeros(number_of_agents, dtype=int)
+        self.ticks_per_cell = np.ones(number_of_agents, dtype=int)
+        self.transition_action_on_cellexit = np.zeros(number_of_agents, dtype=int)
+        self.malfunction = np.zeros(number_of_agents, dtype=int)
+        self._snapshot()
+
+    def pull(self, agents: List[EnvAgent], handles: Optional[np.ndarray] = None):
+        """
+        Copies the state of the agents with the given `handles` (all agents by default) into the arrays.
+        """
+        if handles is None:
+            handles = np.arange(len(agents))
+        if len(handles) == 0:
+            return
+        handles = np.asarray(handles, dtype=int)
+        agents = [agents[i] for i in handles.tolist()]
+        self.position[handles] = [(-1, -1) if agent.position is None else agent.position for agent in agents]
+        self.direction[handles] = [agent.direction for agent in agents]
+        self.old_position[handles] = [(-1, -1) if agent.old_position is None else agent.old_position
+                                      for agent in agents]
+        self.old_direction[handles] = [-1 if agent.old_direction is None else agent.old_direction for agent in agents]
+        self.initial_position[handles] = [agent.initial_position for agent in agents]
+        self.target[handles] = [agent.target for agent in agents]
+        self.status[handles] = [agent.status for agent in agents]
+        self.moving[handles] = [agent.moving for agent in agents]
+        self.speed[handles] = [agent.speed for agent in agents]
+        self.ticks[handles] = [agent.ticks for agent in agents]
+        self.ticks_per_cell[handles] = [agent.ticks_per_cell for agent in agents]
+        self.transition_action_on_cellexit[handles] = [agent.transition_action_on_cellexit
+                                                       for agent in agents]
+        self.malfunction[handles] = [agent.malfunction for agent in agents]
+        for name in self._PUSHED:
+            self._pulled[name][handles] = getattr(self, name)[handles]
+
+    def push(self, agents: List[EnvAgent], handles: np.ndarray, journal: Optional[StepJournal] = None) -> np.ndarray:
+        """
+        Copies the state of the agents with the given `handles` from the arrays back into the `agents`. Only the
+        values changed since the last `pull` or `push` are written, the changed agents are recorded in the `journal`
+        if given.
+
+        Returns
+        -------
+        np.ndarray
+            The handles of the changed agents, in ascending order
+        """
+        def changed(name: str) -> List[int]:
+            values, pulled = getattr(self, name)[handles], self._pulled[name][handles]
+            differs = values != pulled if values.ndim == 1 else np.any(values != pulled, axis=1)
+            return handles[differs].tolist()
+
+        changes = {name: changed(name) for name in self._PUSHED}
+        changed_agents = sorted(set().union(*changes.values()))
+        if journal is not None:
+            for i in changed_agents:
+                journal.record_agent(agents[i])
+        for i in changes['position']:
+            agents[i].position = None if self.position[i, 0] < 0 else tuple(self.position[i].tolist())
+        for i in changes['direction']:
+            agents[i].direction = int(self.direction[i])
+        for i in changes['old_position']:
+            agents[i].old_position = None if self.old_position[i, 0] < 0 else tuple(self.old_position[i].tolist())
+        for i in changes['old_direction']:
+            agents[i].old_direction = None if self.old_direction[i] < 0 else int(self.old_direction[i])
+        for i in changes['status']:
+            agents[i].status = _AGENT_STATUS[self.status[i]]
+        for i in changes['moving']:
+            agents[i].moving = bool(self.moving[i])
+        for i in changes['ticks']:
+            agents[i].ticks = int(self.ticks[i])
+        for i in changes['transition_action_on_cellexit']:
+            agents[i].transition_action_on_cellexit = int(self.transition_action_on_cellexit[i])
+        for i in changes['malfunction']:
+            agents[i].malfunction = int(self.malfunction[i])
+        self._snapshot()
+        return np.array(changed_agents, dtype=int)
+
+    def _snapshot(self):
+        self._pulled = {name: getattr(self, name).copy() for name in self._PUSHED}
+
+
+class StepEngine:
+    """
+    StepEngine base class.
+
+    A step engine performs the malfunction, action handling and movement part of `RailEnv.step` for all agents.
+    """
+
+    def __init__(self):
+        self.env: Optional[RailEnv] = None
+
+    def set_env(self, env: RailEnv):
+        self.env = env
+
+    def reset(self):
+        """
+        Called at the end of each environment reset.
+        """
+        raise NotImplementedError()
+
+    def agents_modified(self, handles: Optional[Iterable[int]] = None):
+        """
+        Called after the agents with `handles` (all agents by default) were modified outside of the steps of the
+        engine, e.g. by `RailEnv.undo()`. Engines which keep a copy of the state of the agents update it from them.
+        """
+        pass
+
+    def step(self, actions: np.ndarray, rewards: np.ndarray, info: Dict[str, np.ndarray]):
+        """
+        Advances all agents of the environment by one step.
+
+        Parameters
+        ----------
+        actions : np.ndarray
+            One action per agent, indexed by the agent handle. Use `RailEnvActions.DO_NOTHING` for agents without
+            action.
+        rewards : np.ndarray
+            Buffer the step rewards of the agents are written into.
+        info : Dict[str, np.ndarray]
+            Buffers the 'action_required', 'malfunction', 'speed' and 'status' of the agents are written into.
+        """
+        raise NotImplementedError()
+
+
+class VectorizedStepEngine(StepEngine):
+    """
+    Step engine advancing all agents with batched numpy operations on `AgentArrays`.
+
+    The arrays hold the state of the agents between steps, they are pulled from `env.agents` at reset only. The values
+    changed by a step are pushed back into `env.agents` at its end, such that the agents can be read between steps.
+    Agents modified outside of the steps have to be reported with `agents_modified()`, the environment does so for
+    `undo()`, `restore()` and the steps skipped by `advance_until_decision()`.
+    Besides the per-agent calls of the malfunction generator, a step works on the arrays and on the agents competing
+    for a cell. The generator is only called for the done agents if the environment does not skip them, and not at
+    all with `no_malfunction_generator`, in which case a step only does per-agent work for the agents competing for a
+    cell and the agents changed by the step.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.agent_arrays: Optional[AgentArrays] = None
+        # handles of the agents modified outside of the steps, pulled at the beginning of the next step
+        self._modified = set()
+
+    def reset(self):
+        self.agent_arrays = AgentArrays(self.env.get_num_agents())
+        self.agent_arrays.pull(self.env.agents)
+        self._modified = set()
+
+    def agents_modified(self, handles: Optional[Iterable[int]] = None):
+        self._modified.update(range(len(self.env.agents)) if handles is None else handles)
+
+    def step(self, actions: np.ndarray, rewards: np.ndarray, info: Dict[str, np.ndarray]):
+        env = self.env
+        agents = env.agents
+        index = env.agent_index
+        if len(index.status) != len(agents):
+            index.reset(agents)
+        if self.agent_arrays is None or self.agent_arrays.number_of_agents != len(agents):
+            self.reset()
+
+        # Induce malfunctions before we do a step, thus a broken agent can't move in this step.
+        # Done agents are sampled as well to keep the shared random stream of the malfunction generator, unless the
+        # environment skips them.
+        # Without a malfunction generator, no agent can break and the generator is not called.
+        modified = self._modified
+        if not is_no_malfunction_generator(env.malfunction_generator):
+            handles = index.live_handles().tolist() if env.skips_finished_agents() else range(len(agents))
+            modified.update([i_agent for i_agent in handles if env._break_agent(agents[i_agent])])
+        perf = env.perf_stats
+        if perf is not None:
+            perf.lap('malfunction')
+
+        arrays = self.agent_arrays
+        pulled = np.array(sorted(modified), dtype=int)
+        if len(modified) > 0:
+            arrays.pull(agents, pulled)
+            modified.clear()
+        broken = arrays.malfunction >= 1
+
+        rewards[:] = 0
+        done = arrays.status >= RailAgentStatus.DONE
+        active = arrays.status == RailAgentStatus.ACTIVE
+        arrays.old_position[active] = arrays.position[active]
+        arrays.old_direction[active] = arrays.direction[active]
+
+        # if agent is broken, actions are ignored and agent does not move.
+        working = active & (arrays.malfunction <= 0)
+        self._handle_actions(actions, working, rewards)
+        if perf is not None:
+            perf.lap('actions')
+
+        # Now perform a movement: advance all moving agents by one tick in their cell
+        moving = working & arrays.moving
+        arrays.ticks[moving & (arrays.ticks_per_cell > 0)] += 1
+        exiting = moving & (arrays.ticks_per_cell > 0) & (arrays.ticks >= arrays.ticks_per_cell)
+        at_target = moving & np.all(arrays.position == arrays.target, axis=1)
+
+        arrived, changed = self._move_agents(actions, exiting, at_target)
+
+        penalized = ~done & ~arrived
+        rewards[penalized] += env.step_penalty * arrays.speed[penalized]
+        if perf is not None:
+            perf.lap('movement')
+
+        info['action_required'][:] = (arrays.status == RailAgentStatus.READY_TO_DEPART) | (
+            (arrays.status == RailAgentStatus.ACTIVE) & (arrays.ticks == 0))
+        info['malfunction'][:] = arrays.malfunction
+        info['speed'][:] = arrays.speed
+        info['status'][:] = arrays.status
+        if perf is not None:
+            perf.lap('info')
+
+        # Fix agents that finished their malfunction such that they can perform an action in the next step
+        for i_agent in np.flatnonzero(broken & (arrays.malfunction == 1)):
+            moving_before_malfunction = agents[i_agent].moving_before_malfunction
+            if moving_before_malfunction is not None:
+                arrays.moving[i_agent] = moving_before_malfunction
+        arrays.malfunction[broken] -= 1
+        if perf is not None:
+            perf.lap('malfunction')
+
+        pushed = arrays.push(agents, np.flatnonzero(~done | broken), env.journal)
+        if env.incremental_hash is not None:
+            env.incremental_hash.update_arrays(pushed, arrays)
+        if env.action_masks is not None:
+            env.action_masks.agents_modified(pulled.tolist() + pushed.tolist())
+        for i_agent in changed:
+            index.update(i_agent, agents[i_agent])
+        if perf is not None:
+            perf.lap('movement')
+
+    def _move_agents(self, actions: np.ndarray, exiting: np.ndarray, at_target: np.ndarray):
+        """
+        Departures, cell exits and arrivals, resolved one by one in the order of the agent handles.
+
+        Returns
+        -------
+        arrived : np.ndarray
+            Per agent, whether it arrived at its target in this step.
+        changed : List[int]
+            Handles of the agents whose status changed.
+        """
+        arrays = self.agent_arrays
+        index = self.env.agent_index
+        # Per start cell, the first waiting agent with a move action tries to depart. Only if it fails, the next
+        # one in the departure queue may depart, once the cell is taken the other agents have to wait.
+        departure_move = (actions == RailEnvActions.MOVE_LEFT) | (actions == RailEnvActions.MOVE_FORWARD) | (
+            actions == RailEnvActions.MOVE_RIGHT)
+        departing = {}
+        for queue in index.departure_queues.values():
+            self._next_departing(queue, 0, departure_move, departing)
+
+        # The cells the exiting agents move to, whether they are free is checked one by one below.
+        # Cell and transition validity was checked when we stored transition_action_on_cellexit!
+        exiting_agents = np.flatnonzero(exiting)
+        compiled_rail = CompiledRail.for_rail(self.env.rail)
+        positions = arrays.position[exiting_agents]
+        cells = (compiled_rail.cell_index(positions[:, 0], positions[:, 1]), arrays.direction[exiting_agents],
+                 np.minimum(arrays.transition_action_on_cellexit[exiting_agents], RailEnvActions.STOP_MOVING))
+        assert np.all(compiled_rail.action_valid[cells])
+        new_directions = compiled_rail.action_direction[cells]
+        new_positions = positions + DIRECTION_OFFSETS[new_directions]
+        reaching_target = np.all(new_positions == arrays.target[exiting_agents], axis=1)
+        moves = dict(zip(exiting_agents.tolist(), zip(map(tuple, positions.tolist()),
+                                                      map(tuple, new_positions.tolist()), new_directions.tolist(),
+                                                      reaching_target.tolist())))
+        staying_at_target = at_target.tolist()
+
+        # Agents competing for cells are resolved one by one in the order of their handle
+        candidates = np.flatnonzero(exiting | at_target).tolist() + list(departing.keys())
+        heapq.heapify(candidates)
+        arrived = np.zeros(arrays.number_of_agents, dtype=bool)
+        changed = []
+        while len(candidates) > 0:
+            i_agent = heapq.heappop(candidates)
+            if i_agent in departing:
+                queue, i_queue = departing.pop(i_agent)
+                if self._depart(i_agent):
+                    changed.append(i_agent)
+                else:
+                    next_agent = self._next_departing(queue, i_queue + 1, departure_move, departing)
+                    if next_agent is not None:
+                        heapq.heappush(candidates, next_agent)
+                continue
+            move = moves.get(i_agent)
+            if move is not None and self._exit_cell(i_agent, *move[:3]):
+                at_target = move[3]
+            else:
+                at_target = staying_at_target[i_agent]
+            if at_target:
+                self._arrive(i_agent)
+                arrived[i_agent] = True
+                changed.append(i_agent)
+        return arrived, changed
+
+    @staticmethod
+    def _next_departing(queue: List[int], start: int, departure_move: np.ndarray, departing: Dict) -> Optional[int]:
+        """
+        Finds the first agent from position `start` on in the departure `queue` with a move action and registers it
+        in `departing`.
+        """
+        for i_queue in range(start, len(queue)):
+            i_agent = queue[i_queue]
+            if departure_move[i_agent]:
+                departing[i_agent] = (queue, i_queue)
+                return i_agent
+        return None
+
+    def _handle_actions(self, actions: np.ndarray, working: np.ndarray, rewards: np.ndarray):
+        """
+        Action handling for the agents at the beginning of a cell: as long as the agent is malfunctioning or stopped
+        at the beginning of the cell, different actions may be taken.
+        """
+        env = self.env
+        arrays = self.agent_arrays
+        at_cell_start = working & (arrays.ticks == 0)
+
+        illegal = at_cell_start & ((actions < 0) | (actions > len(RailEnvActions)))
+        for i_agent in np.flatnonzero(illegal):
+            print('ERROR: illegal action=', actions[i_agent],
+                  'for agent with index=', i_agent,
+                  '"DO NOTHING" will be executed instead')
+        action = np.where(illegal, RailEnvActions.DO_NOTHING, actions)
+
+        # Keep moving
+        action[at_cell_start & (action == RailEnvActions.DO_NOTHING) & arrays.moving] = RailEnvActions.MOVE_FORWARD
+
+        # Only allow halting an agent on entering new cells.
+        stopping = at_cell_start & (action == RailEnvActions.STOP_MOVING) & arrays.moving
+        arrays.moving[stopping] = False
+        rewards[stopping] += env.stop_penalty
+
+        # Allow agent to start with any forward or direction action
+        starting = at_cell_start & ~arrays.moving & (action != RailEnvActions.DO_NOTHING) & (
+            action != RailEnvActions.STOP_MOVING)
+        arrays.moving[starting] = True
+        rewards[starting] += env.start_penalty
+
+        # Store the action if action is moving, try to keep moving forward if the chosen action is invalid
+        compiled_rail = CompiledRail.for_rail(env.rail)
+        storing = np.flatnonzero(at_cell_start & arrays.moving)
+        cells = compiled_rail.cell_index(arrays.position[storing, 0], arrays.position[storing, 1])
+        directions = arrays.direction[storing]
+        stored_action = action[storing]
+        table_action = np.minimum(stored_action, RailEnvActions.STOP_MOVING)
+        valid = compiled_rail.action_valid[cells, directions, table_action]
+        turning = (stored_action == RailEnvActions.MOVE_LEFT) | (stored_action == RailEnvActions.MOVE_RIGHT)
+        forward_valid = compiled_rail.action_valid[cells, directions, RailEnvActions.MOVE_FORWARD]
+        forward = ~valid & turning & forward_valid
+        arrays.transition_action_on_cellexit[storing[valid]] = stored_action[valid]
+        arrays.transition_action_on_cellexit[storing[forward]] = RailEnvActions.MOVE_FORWARD
+
+        # If the agent cannot move due to an invalid transition, we set its state to not moving
+        invalid = storing[~valid & ~forward]
+        rewards[invalid] += env.invalid_action_penalty
+        rewards[invalid] += env.stop_penalty
+        arrays.moving[invalid] = False
+
+    def _depart(self, i_agent: int) -> bool:
+        arrays = self.agent_arrays
+        initial_position = tuple(arrays.initial_position[i_agent].tolist())
+        if not self.env.cell_free(initial_position):
+            return False
+        if self.env.journal is not None:
+            self.env.journal.record_cell(initial_position)
+        arrays.status[i_agent] = RailAgentStatus.ACTIVE
+        arrays.position[i_agent] = initial_position
+        self.env.agent_positions[initial_position] = i_agent
+        return True
+
+    def _exit_cell(self, i_agent: int, position: Tuple[int, int], new_position: Tuple[int, int],
+                   new_direction: int) -> bool:
+        env = self.env
+        if not env.cell_free(new_position):
+            return False
+        if env.journal is not None:
+            env.journal.record_cell(position)
+            env.journal.record_cell(new_position)
+        env.agent_positions[position] = -1
+        env.agent_positions[new_position] = i_agent
+        arrays = self.agent_arrays
+        arrays.position[i_agent] = new_position
+        arrays.direction[i_agent] = new_direction
+        arrays.ticks[i_agent] = 0
+        return True
+
+    def _arrive(self, i_agent: int):
+        env = self.env
+        arrays = self.agent_arrays
+        if env.journal is not None:
+            env.journal.record_dones()
+            env.journal.record_cell(tuple(arrays.position[i_agent].tolist()))
+        arrays.status[i_agent] = RailAgentStatus.DONE
+        env.dones[i_agent] = True
+        env.active_agents.remove(i_agent)
+        arrays.moving[i_agent] = False
+        env.agent_positions[tuple(arrays.position[i_agent])] = -1
+        if env.remove_agents_at_target:
+            arrays.position[i_agent] = -1
+            arrays.status[i_agent] = RailAgentStatus.DONE_REMOVED
+
+
+class JitStepEngine(VectorizedStepEngine):
+    """
+    Vectorized step engine resolving the departures, cell exits and arrivals with the compiled kernel
+    `step_kernels.move_agents`.
+
+    The kernel is compiled by numba if it is installed. Otherwise the engine falls back to the Python resolution of
+    the `VectorizedStepEngine`, unless `jit=True` is given, in which case the kernel runs uncompiled. The malfunctions
+    are still sampled in Python, as the malfunction generators draw from the random stream of the environment.
+    While a journal is enabled, the Python resolution is used, as it records the cells it changes.
+    """
+
+    def __init__(self, jit: Optional[bool] = None):
+        super().__init__()
+        self.jit = NUMBA_AVAILABLE if jit is None else jit
+        self._result: Optional[np.ndarray] = None
+
+    def _move_agents(self, actions: np.ndarray, exiting: np.ndarray, at_target: np.ndarray):
+        if not self.jit or self.env.journal is not None:
+            return super()._move_agents(actions, exiting, at_target)
+        env = self.env
+        arrays = self.agent_arrays
+        if self._result is None or len(self._result) != arrays.number_of_agents:
+            self._result = np.zeros(arrays.number_of_agents, dtype=np.int8)
+        departing = (arrays.status == RailAgentStatus.READY_TO_DEPART) & (
+            (actions == RailEnvActions.MOVE_LEFT) | (actions == RailEnvActions.MOVE_FORWARD) | (
+                actions == RailEnvActions.MOVE_RIGHT))
+        candidates = np.flatnonzero(departing | exiting | at_target)
+        compiled_rail = CompiledRail.for_rail(env.rail)
+        cells = compiled_rail.cell_index(arrays.position[:, 0], arrays.position[:, 1])
+        move_agents(candidates, departing, exiting, arrays.status, arrays.position, arrays.direction,
+                    arrays.initial_position, arrays.target, arrays.moving, arrays.ticks,
+                    arrays.transition_action_on_cellexit, env.agent_positions, cells, compiled_rail.action_direction,
+                    DIRECTION_OFFSETS, bool(env.remove_agents_at_target), self._result)
+
+        result = self._result[candidates]
+        arrived = np.zeros(arrays.number_of_agents, dtype=bool)
+        arrived[candidates[result == ARRIVED]] = True
+        for i_agent in candidates[result == ARRIVED].tolist():
+            env.dones[i_agent] = True
+            env.active_agents.remove(i_agent)
+        return arrived, candidates[result != UNCHANGED].tolist()
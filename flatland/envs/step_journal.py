@@ -0,0 +1,147 @@
+"""
+Journal of the steps of a RailEnv.
+
+While the journal is enabled, the environment records the previous values of the agents and grid cells a step
+changes at the points where it changes them, together with the state of the random generator and the episode
+counters, such that `RailEnv.undo()` can roll back the last steps. Both recording and rolling back a step take time
+proportional to its changes. This is cheaper than restoring a full `RailEnv.snapshot()` at every node of a
+depth-first search.
+"""
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from flatland.utils.ordered_set import OrderedSet
+
+JournalEntry = NamedTuple('JournalEntry', [('agents', List[Tuple[int, Tuple]]),
+                                           ('cells', List[Tuple[Tuple[int, int], int]]),
+                                           ('np_random_state', Optional[Tuple]),
+                                           ('elapsed_steps', int),
+                                           ('dones', Optional[Dict]),
+                                           ('active_agents', Optional[List[int]]),
+                                           ('rewards_dict', Dict),
+                                           ('episode_length', int)])
+
+
+class StepJournal:
+    """
+    Journal of the last `max_steps` steps of a `RailEnv` (all steps by default).
+
+    `begin()` is called at the beginning of each step. During the step, the environment and its step engine call
+    `record_agent()`, `record_cell()`, `record_random_state()` and `record_dones()` before they change an agent, a cell
+    of `agent_positions`, the random generator or the dones, the first value recorded in a step is kept. Changes made
+    to the environment between two steps are not recorded.
+    """
+
+    def __init__(self, env, max_steps: Optional[int] = None):
+        self.env = env
+        self.entries = deque(maxlen=max_steps)
+        # previous values recorded by the step in progress, None between steps
+        self._agents: Optional[Dict[int, Tuple]] = None
+        self._cells: Optional[Dict[Tuple[int, int], int]] = None
+        self._np_random_state = None
+        self._dones = None
+        self._active_agents = None
+        self._counters = None
+
+    def __len__(self):
+        return len(self.entries) + (self._agents is not None)
+
+    def clear(self):
+        self.entries.clear()
+        self._agents = None
+
+    def begin(self):
+        """
+        Starts recording the changes of a step.
+        """
+        self.commit()
+        env = self.env
+        self._agents = {}
+        self._cells = {}
+        self._np_random_state = None
+        self._dones = None
+        self._active_agents = None
+        # the steps assign a new rewards dict, the previous one is kept as is
+        self._counters = (env._elapsed_steps, env.rewards_dict, len(env.cur_episode))
+
+    def record_agent(self, agent):
+        """
+        Records the dynamic state of `agent` before the step in progress changes it.
+        """
+        if self._agents is not None and agent.handle not in self._agents:
+            self._agents[agent.handle] = agent.get_dynamic_state()
+
+    def record_cell(self, position: Tuple[int, int]):
+        """
+        Records the value of the `agent_positions` cell at `position` before the step in progress changes it.
+        """
+        if self._cells is not None and position not in self._cells:
+            self._cells[position] = int(self.env.agent_positions[position])
+
+    def record_random_state(self):
+        """
+        Records the state of `env.np_random` before the step in progress draws from it.
+        """
+        if self._agents is not None and self._np_random_state is None:
+            self._np_random_state = self.env.np_random.get_state()
+
+    def record_dones(self):
+        """
+        Records the dones and the active agents before the step in progress changes them.
+        """
+        if self._agents is not None and self._dones is None:
+            self._dones = self.env.dones.copy()
+            self._active_agents = list(self.env.active_agents)
+
+    def commit(self):
+        """
+        Closes the step in progress, if any.
+        """
+        if self._agents is None:
+            return
+        elapsed_steps, rewards_dict, episode_length = self._counters
+        self.entries.append(JournalEntry(agents=list(self._agents.items()),
+                                         cells=list(self._cells.items()),
+                                         np_random_state=self._np_random_state,
+                                         elapsed_steps=elapsed_steps,
+                                         dones=self._dones,
+                                         active_agents=self._active_agents,
+                                         rewards_dict=rewards_dict,
+                                         episode_length=episode_length))
+        self._agents = None
+        self._cells = None
+
+    def undo(self):
+        """
+        Rolls the environment back to the beginning of the last recorded step.
+        """
+        self.commit()
+        assert len(self.entries) > 0, "no step to undo"
+        entry = self.entries.pop()
+        env = self.env
+        for handle, state in entry.agents:
+            agent = env.agents[handle]
+            agent.set_dynamic_state(state)
+            if agent.status != env.agent_index.status[handle]:
+                env.agent_index.update(handle, agent)
+            if env.incremental_hash is not None:
+                env.incremental_hash.update(handle, agent)
+        if env._agents_changed is not None:
+            env._agents_changed.update(handle for handle, _ in entry.agents)
+        if env.step_engine is not None:
+            env.step_engine.agents_modified([handle for handle, _ in entry.agents])
+        if env.action_masks is not None:
+            env.action_masks.agents_modified([handle for handle, _ in entry.agents])
+        for position, value in entry.cells:
+            env.agent_positions[position] = value
+        if entry.np_random_state is not None:
+            env.np_random.set_state(entry.np_random_state)
+            # restoring the last snapshot has to restore the random state as well
+            env._np_random_drawn = True
+        env._elapsed_steps = entry.elapsed_steps
+        if entry.dones is not None:
+            env.dones = entry.dones
+        if entry.active_agents is not None:
+            env.active_agents = OrderedSet.fromkeys(entry.active_agents)
+        env.rewards_dict = entry.rewards_dict
+        del env.cur_episode[entry.episode_length:]
@@ -0,0 +1,99 @@
+"""
+Compiled kernels of the step engines.
+
+The kernels work on the `AgentArrays` of a step engine and the tables of the `CompiledRail` only, such that they can
+be compiled by numba. numba is an optional dependency: if it is not installed, `NUMBA_AVAILABLE` is False and the
+kernels are plain Python functions, which give the same results but are slow.
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+# same values as RailAgentStatus
+_READY_TO_DEPART = 0
+_ACTIVE = 1
+_DONE = 2
+_DONE_REMOVED = 3
+
+# results of `move_agents` per agent
+UNCHANGED = 0
+DEPARTED = 1
+ARRIVED = 2
+
+
+def _jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@_jit
+def move_agents(candidates: np.ndarray, departing: np.ndarray, exiting: np.ndarray, status: np.ndarray,
+                position: np.ndarray, direction: np.ndarray, initial_position: np.ndarray, target: np.ndarray,
+                moving: np.ndarray, ticks: np.ndarray, transition_action_on_cellexit: np.ndarray,
+                agent_positions: np.ndarray, cells: np.ndarray, action_direction: np.ndarray,
+                direction_offsets: np.ndarray,
+                remove_agents_at_target: bool, result: np.ndarray):
+    """
+    Departures, cell exits and arrivals of the `candidates` in the given order, like `RailEnv._step_agent`.
+
+    Parameters
+    ----------
+    candidates : np.ndarray
+        Handles of the agents which may depart, exit their cell or arrive at their target, in ascending order.
+    departing : np.ndarray
+        Per agent, whether it is ready to depart and has a move action.
+    exiting : np.ndarray
+        Per agent, whether it is moving and has completed its cell.
+    agent_positions : np.ndarray
+        The `RailEnv.agent_positions`, updated in place.
+    cells : np.ndarray
+        Per agent, the `CompiledRail.cell_index` of its position at the beginning of the kernel.
+    action_direction : np.ndarray
+        `CompiledRail.action_direction`
+    result : np.ndarray
+        Buffer receiving per agent `DEPARTED`, `ARRIVED` or `UNCHANGED`.
+    """
+    for k in range(candidates.shape[0]):
+        i = candidates[k]
+        result[i] = UNCHANGED
+        if departing[i]:
+            row, column = initial_position[i, 0], initial_position[i, 1]
+            if agent_positions[row, column] == -1:
+                status[i] = _ACTIVE
+                position[i, 0] = row
+                position[i, 1] = column
+                agent_positions[row, column] = i
+                result[i] = DEPARTED
+            continue
+
+        row, column = position[i, 0], position[i, 1]
+        if exiting[i]:
+            # cell and transition validity was checked when we stored transition_action_on_cellexit!
+            action = min(transition_action_on_cellexit[i], 4)
+            new_direction = action_direction[cells[i], direction[i], action]
+            new_row = row + direction_offsets[new_direction, 0]
+            new_column = column + direction_offsets[new_direction, 1]
+            if agent_positions[new_row, new_column] == -1:
+                agent_positions[row, column] = -1
+                agent_positions[new_row, new_column] = i
+                position[i, 0] = new_row
+                position[i, 1] = new_column
+                direction[i] = new_direction
+                ticks[i] = 0
+                row, column = new_row, new_column
+
+        if row == target[i, 0] and column == target[i, 1]:
+            status[i] = _DONE
+            moving[i] = False
+            agent_positions[row, column] = -1
+            if remove_agents_at_target:
+                position[i, 0] = -1
+                position[i, 1] = -1
+                status[i] = _DONE_REMOVED
+            result[i] = ARRIVED
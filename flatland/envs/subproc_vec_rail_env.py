@@ -0,0 +1,235 @@
+"""
+Vector environment stepping RailEnv instances in worker processes.
+
+Each worker process of the `SubprocVecRailEnv` owns one `RailEnv` and its observation builder. The actions, and the
+observations, rewards, dones and info of the agents, are exchanged through numpy arrays in shared memory, which are
+preallocated for a maximum number of agents. The pipe to each worker only carries the commands and their
+acknowledgements, no observations are pickled.
+
+The observations must therefore be encoded into numpy arrays of a fixed shape in the worker, e.g. by flattening the
+tree of `TreeObsForRailEnv` with `encode_observation`.
+"""
+import multiprocessing
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.vec_rail_env import INFO_PADDING
+
+# commands sent to the workers
+_RESET = 'reset'
+_STEP = 'step'
+
+
+def _buffer_specs(num_envs: int, max_agents: int, observation_shape: Tuple[int, ...],
+                  observation_dtype) -> Dict[str, Tuple[Tuple[int, ...], np.dtype]]:
+    """
+    Shapes and dtypes of the shared buffers by name.
+    """
+    agents = (num_envs, max_agents)
+    return {
+        'actions': (agents, np.dtype(int)),
+        'observations': (agents + tuple(observation_shape), np.dtype(observation_dtype)),
+        'rewards': (agents, np.dtype(float)),
+        'dones': (agents, np.dtype(bool)),
+        'action_required': (agents, np.dtype(bool)),
+        'malfunction': (agents, np.dtype(int)),
+        'speed': (agents, np.dtype(float)),
+        'status': (agents, np.dtype(int)),
+        'agent_mask': (agents, np.dtype(bool)),
+        'episode_done': ((num_envs,), np.dtype(bool)),
+    }
+
+
+def _as_arrays(raw_buffers: Dict[str, Any],
+               specs: Dict[str, Tuple[Tuple[int, ...], np.dtype]]) -> Dict[str, np.ndarray]:
+    return {name: np.frombuffer(raw_buffers[name], dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            for name, (shape, dtype) in specs.items()}
+
+
+def _write_observations(arrays: Dict[str, np.ndarray], observations, number_of_agents: int,
+                        encode_observation: Optional[Callable[[Any], np.ndarray]]):
+    buffer = arrays['observations']
+    buffer[number_of_agents:] = 0
+    for handle in range(number_of_agents):
+        observation = observations.get(handle)
+        buffer[handle] = 0
+        if observation is not None:
+            observation = observation if encode_observation is None else encode_observation(observation)
+            buffer[(handle,) + tuple(slice(0, size) for size in np.shape(observation))] = observation
+
+
+def _write_step(arrays: Dict[str, np.ndarray], rewards: np.ndarray, dones: np.ndarray, info: Dict[str, np.ndarray]):
+    number_of_agents = len(rewards)
+    arrays['rewards'][:number_of_agents] = rewards
+    arrays['rewards'][number_of_agents:] = 0
+    arrays['dones'][:number_of_agents] = dones
+    arrays['dones'][number_of_agents:] = True
+    for key, fill in INFO_PADDING.items():
+        arrays[key][:number_of_agents] = info[key]
+        arrays[key][number_of_agents:] = fill
+    arrays['agent_mask'][:number_of_agents] = True
+    arrays['agent_mask'][number_of_agents:] = False
+
+
+def _vec_env_worker(i_env: int, env_fn: Callable[[], RailEnv], raw_buffers: Dict[str, Any], specs: Dict,
+                    encode_observation: Optional[Callable[[Any], np.ndarray]], auto_reset: bool, reset_kwargs: Dict,
+                    connection):
+    env = env_fn()
+    # the rows of this environment in the shared buffers, 'episode_done' as a one element view to be writable
+    arrays = {name: array[i_env] if array.ndim > 1 else array[i_env:i_env + 1]
+              for name, array in _as_arrays(raw_buffers, specs).items()}
+    max_agents = len(arrays['actions'])
+
+    def reset(random_seed: Optional[int]):
+        kwargs = dict(reset_kwargs)
+        if random_seed is not None:
+            kwargs['random_seed'] = random_seed
+        observations, info = env.reset_arrays(**kwargs)
+        number_of_agents = env.get_num_agents()
+        assert number_of_agents <= max_agents, "the environment has more than max_agents={} agents".format(
+            max_agents)
+        _write_observations(arrays, observations, number_of_agents, encode_observation)
+        return info
+
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        try:
+            if command[0] == _RESET:
+                info = reset(command[1])
+                _write_step(arrays, np.zeros(env.get_num_agents()), np.zeros(env.get_num_agents(), dtype=bool), info)
+                arrays['episode_done'][...] = False
+            elif command[0] == _STEP:
+                number_of_agents = env.get_num_agents()
+                observations, rewards, dones, info = env.step_arrays(arrays['actions'][:number_of_agents])
+                _write_step(arrays, rewards, dones, info)
+                episode_done = env.dones["__all__"]
+                arrays['episode_done'][...] = episode_done
+                if episode_done and auto_reset:
+                    reset(None)
+                else:
+                    _write_observations(arrays, observations, number_of_agents, encode_observation)
+            connection.send(None)
+        except Exception as e:
+            connection.send(e)
+    connection.close()
+
+
+class SubprocVecRailEnv:
+    """
+    Steps N `RailEnv` instances, each in its own worker process, exchanging the arrays through shared memory.
+
+    The returned arrays are views of the shared buffers, which are overwritten by the next `reset()` or `step()`,
+    copy them if they need to be kept. With `auto_reset`, an environment whose episode is done is reset in the same
+    `step()`: the rewards, dones and info are those of its last step, the observations those of its new episode.
+    """
+
+    def __init__(self, env_fns: Sequence[Callable[[], RailEnv]], max_agents: int, observation_shape: Tuple[int, ...],
+                 observation_dtype=np.float32, encode_observation: Optional[Callable[[Any], np.ndarray]] = None,
+                 auto_reset: bool = True, reset_kwargs: Optional[Dict] = None, start_method: str = 'fork'):
+        """
+        Parameters
+        ----------
+        env_fns : Sequence[Callable[[], RailEnv]]
+            Functions creating the environment of each worker, called in the worker.
+        max_agents : int
+            Maximum number of agents of the environments, the buffers are padded to it.
+        observation_shape : Tuple[int, ...]
+            Shape of the encoded observation of an agent, smaller observations are padded with zeros.
+        observation_dtype : np.dtype
+            Type of the encoded observations.
+        encode_observation : Callable[[Any], np.ndarray], optional
+            Encodes the observation of an agent into an array, called in the workers. Without it, the observations
+            must be numpy arrays already.
+        auto_reset : bool
+            Whether environments whose episode is done are reset by `step()`.
+        reset_kwargs : Dict, optional
+            Keyword arguments of the `RailEnv.reset()` calls, e.g. `regenerate_rail=False`.
+        start_method : str
+            Start method of multiprocessing, `env_fns` and `encode_observation` must be picklable unless it is 'fork'.
+        """
+        self.num_envs = len(env_fns)
+        self.max_agents = max_agents
+        context = multiprocessing.get_context(start_method)
+        specs = _buffer_specs(self.num_envs, max_agents, observation_shape, observation_dtype)
+        raw_buffers = {name: context.RawArray('b', max(int(np.prod(shape)) * dtype.itemsize, 1))
+                       for name, (shape, dtype) in specs.items()}
+        self.arrays = _as_arrays(raw_buffers, specs)
+
+        self._connections = []
+        self._processes = []
+        for i_env, env_fn in enumerate(env_fns):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_vec_env_worker,
+                                      args=(i_env, env_fn, raw_buffers, specs, encode_observation, auto_reset,
+                                            reset_kwargs or {}, worker_connection),
+                                      daemon=True)
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def reset(self, random_seeds: Optional[Sequence[Optional[int]]] = None) -> (np.ndarray, Dict[str, np.ndarray]):
+        """
+        Resets all environments.
+
+        Returns
+        -------
+        observations: np.ndarray
+            `(N, max_agents, *observation_shape)` observations
+        info: Dict[str, np.ndarray]
+            `(N, max_agents)` arrays 'action_required', 'malfunction', 'speed', 'status' and 'agent_mask'
+        """
+        for i_env, connection in enumerate(self._connections):
+            connection.send((_RESET, random_seeds[i_env] if random_seeds is not None else None))
+        self._wait()
+        return self.arrays['observations'], self._info()
+
+    def step(self, actions: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, Dict[str, np.ndarray]):
+        """
+        Steps all environments.
+
+        Parameters
+        ----------
+        actions : np.ndarray
+            `(N, max_agents)` actions of the agents of each environment, the actions of padded agents are ignored.
+
+        Returns
+        -------
+        observations: np.ndarray
+            `(N, max_agents, *observation_shape)` observations
+        rewards: np.ndarray
+            `(N, max_agents)` rewards of the agents
+        dones: np.ndarray
+            `(N, max_agents)` dones of the agents, True for padded agents
+        info: Dict[str, np.ndarray]
+            `(N, max_agents)` arrays 'action_required', 'malfunction', 'speed', 'status' and 'agent_mask', and the
+            `(N,)` array 'episode_done' of the environments whose episode is done
+        """
+        self.arrays['actions'][:] = actions
+        for connection in self._connections:
+            connection.send((_STEP,))
+        self._wait()
+        info = self._info()
+        info['episode_done'] = self.arrays['episode_done']
+        return self.arrays['observations'], self.arrays['rewards'], self.arrays['dones'], info
+
+    def _wait(self):
+        errors = [connection.recv() for connection in self._connections]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _info(self) -> Dict[str, np.ndarray]:
+        return {key: self.arrays[key] for key in list(INFO_PADDING.keys()) + ['agent_mask']}
+
+    def close(self):
+        for connection, process in zip(self._connections, self._processes):
+            connection.send(None)
+            process.join()
+            connection.close()
+        self._connections = []
+        self._processes = []
@@ -0,0 +1,194 @@
+"""
+Vector environment stepping many RailEnv instances in lockstep.
+
+The `VecRailEnv` owns N `RailEnv` instances and steps all of them with one `(N, n_agents)` action array. The
+rewards, dones and info of the agents are returned as `(N, n_agents)` arrays, the observations are stacked when they
+are numpy arrays or tuples of numpy arrays. Environments with different numbers of agents or grid sizes are padded to
+the largest one, the 'agent_mask' of the info tells the real agents from the padding.
+
+The environments are stepped with `RailEnv.step_arrays()`. Environments on the same level share their compiled rail
+and distance map if they are created with the same `LevelCache`, or on a `SharedLevel`.
+"""
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from flatland.envs.agent_utils import RailAgentStatus
+from flatland.envs.rail_env import RailEnv
+
+# keys of the info arrays of the RailEnv which are stacked, and their padding values
+INFO_PADDING = {
+    'action_required': False,
+    'malfunction': 0,
+    'speed': 0.,
+    'status': RailAgentStatus.DONE_REMOVED,
+}
+
+
+def pad_stack(arrays: Sequence[np.ndarray], fill=0, dtype=None) -> np.ndarray:
+    """
+    Stacks `arrays` of the same number of dimensions, padding each dimension with `fill` to the largest size.
+    """
+    shape = tuple(np.max([array.shape for array in arrays], axis=0)) if len(arrays) > 0 else (0,)
+    dtype = dtype if dtype is not None else np.result_type(*arrays)
+    stacked = np.full((len(arrays),) + shape, fill, dtype=dtype)
+    for i, array in enumerate(arrays):
+        stacked[(i,) + tuple(slice(0, size) for size in array.shape)] = array
+    return stacked
+
+
+def stack_observations(observations: Sequence[Mapping[int, Any]], number_of_agents: Sequence[int]) -> Any:
+    """
+    Stacks the observations of the agents of several environments into `(N, n_agents, ...)` arrays.
+
+    Observations which are numpy arrays are stacked into one array, observations which are tuples of numpy arrays
+    into a tuple of arrays, padded with zeros. Other observations, e.g. the trees of `TreeObsForRailEnv`, are returned
+    in an `(N, n_agents)` object array. Agents without observation are zeros or None.
+    """
+    rows = [[env_observations.get(handle) for handle in range(n)] for env_observations, n in
+            zip(observations, number_of_agents)]
+    values = [value for row in rows for value in row if value is not None]
+    max_agents = max(number_of_agents, default=0)
+    if len(values) > 0 and all(isinstance(value, np.ndarray) and value.ndim == values[0].ndim for value in values):
+        return _stack_arrays(rows, values, max_agents)
+    if len(values) > 0 and all(
+        isinstance(value, tuple) and len(value) == len(values[0]) and all(
+            isinstance(part, np.ndarray) and part.ndim == first.ndim for part, first in zip(value, values[0]))
+            for value in values):
+        return tuple(_stack_arrays([[None if value is None else value[i] for value in row] for row in rows],
+                                   [value[i] for value in values], max_agents) for i in range(len(values[0])))
+    stacked = np.full((len(rows), max_agents), None, dtype=object)
+    for i_env, row in enumerate(rows):
+        for handle, value in enumerate(row):
+            stacked[i_env, handle] = value
+    return stacked
+
+
+def _stack_arrays(rows: List[List[Optional[np.ndarray]]], values: List[np.ndarray], max_agents: int) -> np.ndarray:
+    shape = tuple(np.max([value.shape for value in values], axis=0))
+    stacked = np.zeros((len(rows), max_agents) + shape, dtype=np.result_type(*values))
+    for i_env, row in enumerate(rows):
+        for handle, value in enumerate(row):
+            if value is not None:
+                stacked[(i_env, handle) + tuple(slice(0, size) for size in value.shape)] = value
+    return stacked
+
+
+class VecRailEnv:
+    """
+    Steps N `RailEnv` instances in lockstep.
+
+    With `auto_reset`, an environment whose episode is done is reset in the same `step()`: the rewards, dones and
+    info are those of its last step, the observations those of its new episode. The observations of the last step are
+    kept in `terminal_observations`.
+    """
+
+    def __init__(self, envs: List[RailEnv], auto_reset: bool = True, reset_kwargs: Optional[Dict] = None):
+        """
+        Parameters
+        ----------
+        envs : List[RailEnv]
+            The environments, owned by the vector environment from now on.
+        auto_reset : bool
+            Whether environments whose episode is done are reset by `step()`.
+        reset_kwargs : Dict, optional
+            Keyword arguments of the `RailEnv.reset()` calls, e.g. `regenerate_rail=False`.
+        """
+        self.envs = envs
+        self.auto_reset = auto_reset
+        self.reset_kwargs = reset_kwargs or {}
+        self.terminal_observations: List[Optional[Mapping]] = [None] * len(envs)
+        self._observations: List[Mapping] = [{}] * len(envs)
+
+    @property
+    def num_envs(self) -> int:
+        return len(self.envs)
+
+    @property
+    def number_of_agents(self) -> List[int]:
+        """
+        The number of agents of each environment.
+        """
+        return [env.get_num_agents() for env in self.envs]
+
+    def reset(self, random_seeds: Optional[Sequence[Optional[int]]] = None) -> (Any, Dict[str, np.ndarray]):
+        """
+        Resets all environments.
+
+        Parameters
+        ----------
+        random_seeds : Sequence[Optional[int]], optional
+            The random seed of the reset of each environment.
+
+        Returns
+        -------
+        observations
+            The stacked observations, see `stack_observations`
+        info: Dict[str, np.ndarray]
+            `(N, n_agents)` arrays 'action_required', 'malfunction', 'speed', 'status' and 'agent_mask'
+        """
+        infos = []
+        for i_env, env in enumerate(self.envs):
+            random_seed = random_seeds[i_env] if random_seeds is not None else None
+            self._observations[i_env], info = self._reset_env(env, random_seed)
+            infos.append(info)
+        return stack_observations(self._observations, self.number_of_agents), self._stack_info(infos)
+
+    def step(self, actions: np.ndarray) -> (Any, np.ndarray, np.ndarray, Dict[str, np.ndarray]):
+        """
+        Steps all environments.
+
+        Parameters
+        ----------
+        actions : np.ndarray
+            `(N, n_agents)` actions of the agents of each environment, the actions of padded agents are ignored.
+
+        Returns
+        -------
+        observations
+            The stacked observations, see `stack_observations`
+        rewards: np.ndarray
+            `(N, n_agents)` rewards of the agents
+        dones: np.ndarray
+            `(N, n_agents)` dones of the agents, True for padded agents
+        info: Dict[str, np.ndarray]
+            `(N, n_agents)` arrays 'action_required', 'malfunction', 'speed', 'status' and 'agent_mask', and the
+            `(N,)` array 'episode_done' of the environments whose episode is done
+        """
+        actions = np.asarray(actions, dtype=int)
+        assert len(actions) == self.num_envs, "one row of actions per environment is required"
+        rewards, dones, infos = [], [], []
+        episode_done = np.zeros(self.num_envs, dtype=bool)
+        for i_env, env in enumerate(self.envs):
+            observations, env_rewards, env_dones, info = env.step_arrays(actions[i_env, :env.get_num_agents()])
+            rewards.append(env_rewards.copy())
+            dones.append(env_dones.copy())
+            infos.append({key: info[key].copy() for key in INFO_PADDING})
+            episode_done[i_env] = env.dones["__all__"]
+            if episode_done[i_env] and self.auto_reset:
+                self.terminal_observations[i_env] = observations
+                observations, _ = self._reset_env(env)
+            self._observations[i_env] = observations
+
+        info = self._stack_info(infos)
+        info['episode_done'] = episode_done
+        return stack_observations(self._observations, self.number_of_agents), pad_stack(rewards, 0.), \
+            pad_stack(dones, True, dtype=bool), info
+
+    def _reset_env(self, env: RailEnv, random_seed: Optional[int] = None) -> (Mapping, Dict[str, np.ndarray]):
+        kwargs = dict(self.reset_kwargs)
+        if random_seed is not None:
+            kwargs['random_seed'] = random_seed
+        observations, info = env.reset_arrays(**kwargs)
+        return observations, {key: info[key].copy() for key in INFO_PADDING}
+
+    @staticmethod
+    def _stack_info(infos: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        info = {key: pad_stack([env_info[key] for env_info in infos], fill) for key, fill in INFO_PADDING.items()}
+        info['agent_mask'] = pad_stack([np.ones(len(env_info['status']), dtype=bool) for env_info in infos], False)
+        return info
+
+    def close(self):
+        for env in self.envs:
+            if env.observation_pipeline is not None:
+                env.observation_pipeline.close()
@@ -80,7 +80,8 @@ class FlatlandRemoteEvaluationService:
                  visualize=False,
                  video_generation_envs=[],
                  report=None,
-                 verbose=False):
+                 verbose=False,
+                 perf_stats=False):
 
         # Test Env folder Paths
         self.test_env_folder = test_env_folder
@@ -94,6 +95,8 @@ class FlatlandRemoteEvaluationService:
         # Logging and Reporting related vars
         self.verbose = verbose
         self.report = report
+        # Whether the time of the phases of the env steps is measured and reported in the stats
+        self.perf_stats = perf_stats
 
         # Communication Protocol Related vars
         self.namespace = "flatland-rl"
@@ -152,6 +155,15 @@ class FlatlandRemoteEvaluationService:
                 shutil.rmtree(self.vizualization_folder_name)
             os.mkdir(self.vizualization_folder_name)
 
+    def update_perf_stats(self, perf_stats):
+        """
+        Registers the mean time per step of each phase of the env steps of an episode in the running mean stats
+        """
+        steps = max(perf_stats.steps, 1)
+        for phase, seconds in perf_stats.time.items():
+            self.update_running_mean_stats("internal_env_{}_time".format(phase), seconds / steps)
+        perf_stats.reset()
+
     def update_running_mean_stats(self, key, scalar):
         """
         Computes the running mean for certain params
@@ -340,6 +352,8 @@ class FlatlandRemoteEvaluationService:
                                schedule_generator=schedule_from_file(test_env_file_path),
                                malfunction_generator_and_process_data=malfunction_from_file(test_env_file_path),
                                obs_builder_object=DummyObservationBuilder())
+            if self.perf_stats:
+                self.env.enable_perf_stats(on_episode_end=self.update_perf_stats)
 
             if self.begin_simulation:
                 # If begin simulation has already been initialized
@@ -684,6 +698,11 @@ if __name__ == "__main__":
                         default="../../../submission-scoring/Envs-Small",
                         help="Folder containing the files for the test envs",
                         required=False)
+    parser.add_argument('--perf_stats',
+                        dest='perf_stats',
+                        action='store_true',
+                        help="Measure the time of the phases of the env steps",
+                        required=False)
     args = parser.parse_args()
 
     test_folder = args.test_folder
@@ -693,7 +712,8 @@ if __name__ == "__main__":
         flatland_rl_service_id=args.service_id,
         verbose=True,
         visualize=True,
-        video_generation_envs=["Test_0/Level_1.pkl"]
+        video_generation_envs=["Test_0/Level_1.pkl"],
+        perf_stats=args.perf_stats
     )
     result = grader.run()
     if result['type'] == messages.FLATLAND_RL.ENV_SUBMIT_RESPONSE:
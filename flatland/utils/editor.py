@@ -591,6 +591,9 @@ class EditorModel(object):
 
     def clear(self):
         self.env.rail.grid[:, :] = 0
+        # the compiled rail and the waypoint graph do not notice writes into the grid array
+        self.env.rail.compiled_rail = None
+        self.env.rail.cached_waypoint_graph = None
         self.env.agents = []
 
         self.redraw()
@@ -598,6 +601,8 @@ class EditorModel(object):
     def clear_cell(self, cell_row_col):
         self.debug_cell(cell_row_col)
         self.env.rail.grid[cell_row_col[0], cell_row_col[1]] = 0
+        self.env.rail.compiled_rail = None
+        self.env.rail.cached_waypoint_graph = None
         self.redraw()
 
     def reset(self, regenerate_schedule=False, nAgents=0):
@@ -0,0 +1,118 @@
+"""
+Per-phase timing of the environment steps.
+
+`PerfStats` accumulates the wall time of each phase of `RailEnv.step()` and the number of steps in which it was
+measured. The phases are measured as consecutive laps: `start()` is called at the beginning of a step and each
+`lap(phase)` adds the time since the previous lap to `phase`, a phase lapped several times in a step (e.g. once per
+agent) counts as one call.
+"""
+import json
+import sys
+import time
+from typing import Callable, Dict, Optional
+
+# the phases measured by the RailEnv, in the order of a step
+PHASES = ('malfunction', 'actions', 'movement', 'info', 'recording', 'prediction', 'observations')
+
+
+class PerfStats:
+    """
+    Wall time and number of steps measured per phase, and the number and total time of the steps.
+
+    Parameters
+    ----------
+    on_episode_end : Callable[[PerfStats], None], optional
+        Called with the stats at the end of each episode, e.g. `PerfStats.dump`.
+    """
+
+    def __init__(self, on_episode_end: Optional[Callable[['PerfStats'], None]] = None):
+        self.on_episode_end = on_episode_end
+        self.time: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.steps = 0
+        self.step_time = 0.0
+        self._step_start = None
+        self._last = None
+        self._lapped = set()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the accumulated times and counts.
+        """
+        self.time = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.steps = 0
+        self.step_time = 0.0
+
+    def start(self):
+        """
+        Called at the beginning of a step.
+        """
+        self._step_start = self._last = time.perf_counter()
+        self._lapped.clear()
+
+    def lap(self, phase: str):
+        """
+        Adds the time since the previous lap (or `start()`) to `phase`. Laps outside of a step are ignored.
+        """
+        if self._last is None:
+            return
+        now = time.perf_counter()
+        self.time[phase] = self.time.get(phase, 0.0) + now - self._last
+        self._lapped.add(phase)
+        self._last = now
+
+    def stop(self):
+        """
+        Called at the end of a step.
+        """
+        self.step_time += time.perf_counter() - self._step_start
+        self.steps += 1
+        for phase in self._lapped:
+            self.calls[phase] = self.calls.get(phase, 0) + 1
+        self._last = None
+
+    def episode_end(self):
+        """
+        Called at the end of an episode, passes the stats to `on_episode_end`.
+        """
+        if self.on_episode_end is not None:
+            self.on_episode_end(self)
+
+    def as_dict(self) -> Dict:
+        """
+        Returns
+        -------
+        Dict
+            'steps', 'step_time' and per phase the 'time' and 'calls'
+        """
+        return {
+            'steps': self.steps,
+            'step_time': self.step_time,
+            'phases': {phase: {'time': self.time[phase], 'calls': self.calls[phase]} for phase in self.time}
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict())
+
+    def table(self) -> str:
+        """
+        The stats as a text table with the total and per step time of each phase in milliseconds.
+        """
+        steps = max(self.steps, 1)
+        lines = ["{:<14}{:>12}{:>14}{:>10}{:>10}".format('phase', 'total [ms]', 'per step [ms]', 'share', 'calls')]
+        row = "{:<14}{:>12.3f}{:>14.4f}{:>10}{:>10d}"
+        for phase, seconds in self.time.items():
+            share = seconds / self.step_time if self.step_time > 0 else 0.0
+            lines.append(row.format(phase, seconds * 1000, seconds * 1000 / steps, "{:.1%}".format(share),
+                                    self.calls[phase]))
+        lines.append(row.format('step', self.step_time * 1000, self.step_time * 1000 / steps, '', self.steps))
+        return "\n".join(lines)
+
+    def dump(self, file=None, fmt: str = 'table'):
+        """
+        Writes the stats as 'table' or 'json' to `file` (stdout by default).
+        """
+        file = file or sys.stdout
+        print(self.to_json() if fmt == 'json' else self.table(), file=file)
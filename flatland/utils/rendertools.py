@@ -545,7 +545,7 @@ class RenderTool(object):
                 if agent is None or agent.position is None:
                     continue
 
-                is_malfunction = agent.malfunction_data["malfunction"] > 0
+                is_malfunction = agent.malfunction > 0
 
                 if self.agent_render_variant == AgentRenderVariant.BOX_ONLY:
                     self.gl.set_cell_occupied(agent_idx, *(agent.position))
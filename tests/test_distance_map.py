@@ -1,12 +1,16 @@
 import numpy as np
 
 from flatland.core.grid.rail_env_grid import RailEnvTransitions
-from flatland.core.transition_map import GridTransitionMap
+from flatland.core.transition_map import GridTransitionMap, SparseGridTransitionMap
+from flatland.envs.compiled_rail import CompiledRail
+from flatland.envs.distance_map import DistanceMap
+from flatland.envs.level_cache import LevelCache
 from flatland.envs.observations import TreeObsForRailEnv
 from flatland.envs.predictions import ShortestPathPredictorForRailEnv
 from flatland.envs.rail_env import RailEnv
 from flatland.envs.rail_generators import rail_from_grid_transition_map
 from flatland.envs.schedule_generators import random_schedule_generator
+from flatland.utils.simple_rail import make_simple_rail
 
 
 def test_walker():
@@ -47,3 +51,78 @@ def test_walker():
     assert env.distance_map.get()[(0, *[0, 1], 1)] == 3
     print(env.distance_map.get()[(0, *[0, 2], 3)])
     assert env.distance_map.get()[(0, *[0, 2], 1)] == 2
+
+
+def test_distance_map_reused_for_unchanged_rail():
+    rail, rail_map = make_simple_rail()
+    env = RailEnv(width=rail_map.shape[1], height=rail_map.shape[0], rail_generator=rail_from_grid_transition_map(rail),
+                  schedule_generator=random_schedule_generator(), number_of_agents=2)
+    env.reset()
+    distance_map = env.distance_map.get()
+
+    computed = []
+    walker = DistanceMap._distance_map_walker
+
+    def counting_walker(self, *args, **kwargs):
+        computed.append(args)
+        return walker(self, *args, **kwargs)
+
+    DistanceMap._distance_map_walker = counting_walker
+    try:
+        env.reset(regenerate_rail=False, regenerate_schedule=False)
+        assert env.distance_map.get() is distance_map
+        assert len(computed) == 0
+
+        # other targets on the same rail
+        env.agents[1].target = (3, 9) if env.agents[1].target != (3, 9) else (6, 6)
+        env.reset(regenerate_rail=False, regenerate_schedule=False)
+        assert env.distance_map.get() is not distance_map
+        assert len(computed) > 0
+    finally:
+        DistanceMap._distance_map_walker = walker
+    # only the distance maps shared through a level cache are read-only
+    assert distance_map.flags.writeable
+
+
+def test_distance_map_shared_through_level_cache():
+    def make_env(level_cache=None):
+        rail, rail_map = make_simple_rail()
+        env = RailEnv(width=rail_map.shape[1], height=rail_map.shape[0],
+                      rail_generator=rail_from_grid_transition_map(rail),
+                      schedule_generator=random_schedule_generator(seed=1), number_of_agents=2,
+                      level_cache=level_cache)
+        env.reset()
+        return env
+
+    # without a cache, the environments do not keep each other's distance maps
+    assert make_env().distance_map.get() is not make_env().distance_map.get()
+
+    level_cache = LevelCache(max_distance_maps=1)
+    env = make_env(level_cache)
+    distance_map = env.distance_map.get()
+    other_env = make_env(level_cache)
+    assert other_env.distance_map.get() is distance_map
+    assert not distance_map.flags.writeable
+    assert CompiledRail.for_rail(other_env.rail).action_valid is CompiledRail.for_rail(env.rail).action_valid
+    level_cache.clear()
+    assert make_env(level_cache).distance_map.get() is not distance_map
+
+
+def test_distance_map_of_sparse_rail():
+    rail, rail_map = make_simple_rail()
+    sparse_rail = SparseGridTransitionMap(width=rail.width, height=rail.height, transitions=rail.transitions)
+    sparse_rail.grid = rail_map
+    env = RailEnv(width=rail_map.shape[1], height=rail_map.shape[0], rail_generator=rail_from_grid_transition_map(rail),
+                  schedule_generator=random_schedule_generator(seed=1), number_of_agents=2)
+    env.reset()
+    sparse_env = RailEnv(width=rail_map.shape[1], height=rail_map.shape[0],
+                         rail_generator=rail_from_grid_transition_map(sparse_rail),
+                         schedule_generator=random_schedule_generator(seed=1), number_of_agents=2)
+    sparse_env.reset()
+    distance_map = env.distance_map.get()
+    assert np.array_equal(sparse_env.distance_map.get(), distance_map)
+
+    compact_distance_map = sparse_env.distance_map.get_compact()
+    assert compact_distance_map.shape == (2, sparse_rail.number_of_cells, 4)
+    rows, columns = sparse_rail.cell_positions.T
+    assert np.array_equal(compact_distance_map, distance_map[:, rows, columns])
@@ -1,14 +1,17 @@
+import numpy as np
+
 from flatland.core.grid.grid4 import Grid4Transitions, Grid4TransitionsEnum
+from flatland.core.grid.grid4_utils import get_new_position
 from flatland.core.grid.grid8 import Grid8Transitions, Grid8TransitionsEnum
 from flatland.core.grid.rail_env_grid import RailEnvTransitions
-from flatland.core.transition_map import GridTransitionMap
+from flatland.core.transition_map import GridTransitionMap, SparseGridTransitionMap
 from flatland.envs.observations import TreeObsForRailEnv
 from flatland.envs.predictions import ShortestPathPredictorForRailEnv
 from flatland.envs.rail_env import RailEnv
 from flatland.envs.rail_generators import rail_from_grid_transition_map
 from flatland.envs.schedule_generators import random_schedule_generator
 from flatland.utils.rendertools import RenderTool
-from flatland.utils.simple_rail import make_simple_rail, make_simple_rail_unconnected
+from flatland.utils.simple_rail import make_simple_rail, make_simple_rail_unconnected, make_invalid_simple_rail
 
 
 def test_grid4_get_transitions():
@@ -178,3 +181,114 @@ def test_get_entry_directions():
     _assert(vertical_line, [True, False, True, False])
     _assert(south_symmetrical_switch, [True, True, False, True])
     _assert(north_symmetrical_switch, [False, True, True, True])
+
+
+def test_waypoint_graph():
+    rail, rail_map = make_simple_rail()
+    graph = rail.waypoint_graph()
+    assert rail.waypoint_graph() is graph
+
+    edges = set()
+    for row in range(rail.height):
+        for column in range(rail.width):
+            for direction in range(4):
+                node = graph.node(row, column, direction)
+                expected = []
+                for new_direction, valid in enumerate(rail.get_transitions(row, column, direction)):
+                    new_row, new_column = get_new_position((row, column), new_direction)
+                    if valid and 0 <= new_row < rail.height and 0 <= new_column < rail.width:
+                        expected.append(graph.node(new_row, new_column, new_direction))
+                        edges.add((node, expected[-1]))
+                assert sorted(graph.successors(node).tolist()) == sorted(expected)
+                assert graph.cell_and_direction(node) == (row, column, direction)
+    assert graph.number_of_edges == len(edges)
+    assert {(int(source), node) for node in range(graph.number_of_nodes) for source in
+            graph.predecessors(node)} == edges
+
+    # the graph is built again after the transitions of a cell have been set
+    rail.set_transitions((0, 0), 0)
+    assert rail.waypoint_graph() is not graph
+
+
+def test_waypoint_graph_distances():
+    rail, rail_map = make_simple_rail()
+    graph = rail.waypoint_graph()
+    # on the vertical line north of the switch, going south from (1, 3) reaches (2, 3) in one step
+    source = graph.node(1, 3, Grid4TransitionsEnum.SOUTH)
+    target = graph.node(2, 3, Grid4TransitionsEnum.SOUTH)
+    distances = graph.distances([source])
+    assert distances[source] == 0
+    assert distances[target] == 1
+    assert graph.distances([target], reverse=True)[source] == 1
+
+
+def test_to_bitplanes():
+    rail, rail_map = make_simple_rail()
+    bitplanes = rail.to_bitplanes()
+    assert bitplanes.shape == (rail.height, rail.width, 16)
+    entry_directions = rail.entry_directions()
+    transition_counts = rail.transition_counts()
+    for row in range(rail.height):
+        for column in range(rail.width):
+            cell = rail.get_full_transitions(row, column)
+            assert ''.join(map(str, bitplanes[row, column])) == format(cell, '016b')
+            assert entry_directions[row, column].tolist() == Grid4Transitions.get_entry_directions(cell)
+            assert transition_counts[row, column] == bin(cell).count("1")
+
+
+def test_invalid_cells():
+    for make_rail in [make_simple_rail, make_simple_rail_unconnected, make_invalid_simple_rail]:
+        rail, rail_map = make_rail()
+        for check_cells in [False, True]:
+            invalid_cells = rail.invalid_cells(check_cells=check_cells)
+            for row in range(rail.height):
+                for column in range(rail.width):
+                    assert invalid_cells[row, column] == (not rail.cell_neighbours_valid((row, column), check_cells))
+
+
+def test_fix_cells():
+    rail, rail_map = make_invalid_simple_rail()
+    cells = list(zip(*np.nonzero(rail.invalid_cells(check_cells=True))))
+    assert len(cells) > 0
+    expected, _ = make_invalid_simple_rail()
+    for cell in cells:
+        expected.fix_transitions(cell)
+    rail.fix_cells(cells)
+    assert np.array_equal(rail.grid, expected.grid)
+
+
+def test_sparse_grid_transition_map():
+    rail, rail_map = make_simple_rail()
+    sparse_rail = SparseGridTransitionMap(width=rail.width, height=rail.height, transitions=rail.transitions)
+    sparse_rail.grid = rail_map
+    assert sparse_rail.number_of_cells == np.count_nonzero(rail_map)
+    assert np.array_equal(sparse_rail.grid, rail_map)
+    # the fingerprint differs from that of the dense map, whose waypoint graph has other cell indices
+    fingerprint = sparse_rail.fingerprint()
+    assert fingerprint != rail.fingerprint()
+    for row in range(rail.height):
+        for column in range(rail.width):
+            assert sparse_rail.get_full_transitions(row, column) == rail.get_full_transitions(row, column)
+            assert (sparse_rail.cell_id(row, column) >= 0) == (rail_map[row, column] != 0)
+            for direction in range(4):
+                assert sparse_rail.get_transitions(row, column, direction) == \
+                    rail.get_transitions(row, column, direction)
+
+    # the waypoint graph has the nodes of the rail cells only, with the same distances
+    graph = rail.waypoint_graph()
+    sparse_graph = sparse_rail.waypoint_graph()
+    assert sparse_graph.number_of_nodes == 4 * sparse_rail.number_of_cells
+    assert sparse_graph.number_of_edges == graph.number_of_edges
+    source = (1, 3, Grid4TransitionsEnum.SOUTH)
+    assert np.array_equal(sparse_graph.to_grid(sparse_graph.distances([sparse_graph.node(*source)])),
+                          graph.to_grid(graph.distances([graph.node(*source)])))
+
+    # setting a transition of an empty cell adds a rail cell
+    grid = sparse_rail.grid
+    sparse_rail.set_transition((0, 0, Grid4TransitionsEnum.NORTH), Grid4TransitionsEnum.NORTH, 1)
+    assert sparse_rail.cell_id(0, 0) == sparse_rail.number_of_cells - 1
+    assert sparse_rail.get_transition((0, 0, Grid4TransitionsEnum.NORTH), Grid4TransitionsEnum.NORTH)
+    assert sparse_rail.grid is not grid
+    assert sparse_rail.grid[0, 0] != 0
+    assert sparse_rail.fingerprint() != fingerprint
+    assert sparse_rail.waypoint_graph() is not sparse_graph
@@ -0,0 +1,40 @@
+from flatland.envs.agent_index import AgentIndex
+from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+
+
+def _agents():
+    return [EnvAgent(initial_position=position, initial_direction=0, direction=0, target=(0, 0), handle=handle)
+            for handle, position in enumerate([(3, 3), (1, 1), (3, 3), (1, 1), (3, 3)])]
+
+
+def test_agent_index_departure_queues():
+    agents = _agents()
+    index = AgentIndex()
+    index.reset(agents)
+    assert list(index.ready_to_depart) == [0, 1, 2, 3, 4]
+    assert index.waiting_at((3, 3)) == [0, 2, 4]
+    assert index.waiting_at((1, 1)) == [1, 3]
+    assert index.waiting_at((2, 2)) == []
+
+    agents[2].status = RailAgentStatus.ACTIVE
+    index.update(2, agents[2])
+    assert index.waiting_at((3, 3)) == [0, 4]
+    assert list(index.active) == [2]
+
+    agents[1].status = RailAgentStatus.ACTIVE
+    agents[3].status = RailAgentStatus.ACTIVE
+    assert index.sync(agents) == [1, 3]
+    assert index.waiting_at((1, 1)) == []
+    assert (1, 1) not in index.departure_queues
+    assert index.live_handles().tolist() == [0, 1, 2, 3, 4]
+
+    agents[2].status = RailAgentStatus.DONE_REMOVED
+    index.update(2, agents[2])
+    assert list(index.done) == [2]
+    assert index.live_handles().tolist() == [0, 1, 3, 4]
+
+    # agents set back to ready to depart are queued in the order of their handles
+    agents[2].status = RailAgentStatus.READY_TO_DEPART
+    index.sync(agents)
+    assert index.waiting_at((3, 3)) == [0, 2, 4]
+    assert len(index.done) == 0
@@ -0,0 +1,106 @@
+import pickle
+
+import pytest
+
+from flatland.envs.agent_utils import EnvAgent, SpeedData, ticks_per_cell
+
+
+def test_ticks_per_cell():
+    assert [ticks_per_cell(speed) for speed in [1.0, 1. / 2., 1. / 3., 1. / 4.]] == [1, 2, 3, 4]
+    # the cell exit of the float position fraction had a tolerance of 1e-3
+    assert ticks_per_cell(0.33) == 4
+    assert ticks_per_cell(0.3333) == 3
+    assert ticks_per_cell(0.0) == 0
+
+
+def test_speed_data_position_fraction():
+    speed_data = SpeedData({'position_fraction': 0.0, 'speed': 1. / 3., 'transition_action_on_cellexit': 0})
+    assert speed_data.at_cell_start
+    speed_data.advance()
+    speed_data.advance()
+    assert speed_data.ticks == 2
+    assert speed_data['position_fraction'] == 2 / 3
+    assert not speed_data.cell_exit_due
+    speed_data.advance()
+    assert speed_data.cell_exit_due
+
+    speed_data['position_fraction'] = 0.0
+    assert speed_data.ticks == 0
+    speed_data['position_fraction'] = 0.5
+    speed_data['speed'] = 0.25
+    assert speed_data.ticks_per_cell == 4
+    assert speed_data.ticks == 2
+
+
+def test_speed_data_position_fraction_of_speed_not_one_over_n():
+    # the position fraction is the distance covered, as accumulated by the steps before the ticks
+    speed_data = SpeedData({'position_fraction': 0.0, 'speed': 0.3, 'transition_action_on_cellexit': 0})
+    assert speed_data.ticks_per_cell == 4
+    speed_data.advance()
+    speed_data.advance()
+    assert speed_data['position_fraction'] == pytest.approx(0.6)
+    speed_data.advance()
+    assert speed_data['position_fraction'] == pytest.approx(0.9)
+    assert not speed_data.cell_exit_due
+    # setting the speed again keeps the ticks
+    speed_data['speed'] = 0.3
+    assert speed_data.ticks == 3
+    speed_data.advance()
+    assert speed_data.cell_exit_due
+
+
+def test_env_agent_speed_data_converted():
+    agent = EnvAgent(initial_position=(0, 0), initial_direction=0, direction=0, target=(1, 1), moving=False,
+                     speed_data={'position_fraction': 0.5, 'speed': 0.5, 'transition_action_on_cellexit': 0})
+    assert isinstance(agent.speed_data, SpeedData)
+    assert agent.speed_data.ticks == 1
+    agent.speed_data = {'position_fraction': 0.0, 'speed': 0.25, 'transition_action_on_cellexit': 0}
+    assert agent.speed_data.ticks_per_cell == 4
+    agent = pickle.loads(pickle.dumps(agent))
+    assert agent.speed_data.ticks_per_cell == 4
+
+
+def test_env_agent_data_views():
+    agent = EnvAgent(initial_position=(0, 0), initial_direction=0, direction=0, target=(1, 1), moving=False,
+                     speed_data={'position_fraction': 0.0, 'speed': 0.5, 'transition_action_on_cellexit': 0},
+                     malfunction_data={'malfunction': 0, 'malfunction_rate': 0.1, 'next_malfunction': 0,
+                                       'nr_malfunctions': 0})
+    assert not hasattr(agent, '__dict__')
+    assert agent.speed_data == {'position_fraction': 0.0, 'speed': 0.5, 'transition_action_on_cellexit': 0}
+
+    # the views write to the fields of the agent and the other way around
+    agent.speed_data['transition_action_on_cellexit'] = 2
+    assert agent.transition_action_on_cellexit == 2
+    agent.speed_data.advance()
+    assert agent.ticks == 1
+    assert agent.position_fraction == 0.5
+    agent.malfunction = 3
+    assert agent.malfunction_data['malfunction'] == 3
+    assert 'moving_before_malfunction' not in agent.malfunction_data
+    agent.malfunction_data['moving_before_malfunction'] = True
+    assert agent.moving_before_malfunction
+    agent.malfunction_data['custom'] = 'value'
+    assert dict(agent.malfunction_data) == {'malfunction': 3, 'malfunction_rate': 0.1, 'next_malfunction': 0,
+                                            'nr_malfunctions': 0, 'moving_before_malfunction': True,
+                                            'custom': 'value'}
+
+    # the serialized agent holds plain dicts
+    assert type(agent.to_agent().speed_data) is dict
+    assert agent == pickle.loads(pickle.dumps(agent))
+
+
+def test_env_agent_dynamic_state():
+    agent = EnvAgent(initial_position=(0, 0), initial_direction=0, direction=0, target=(1, 1), moving=False,
+                     speed_data={'position_fraction': 0.0, 'speed': 1. / 3., 'transition_action_on_cellexit': 0})
+    state = agent.get_dynamic_state()
+    agent.position = (0, 0)
+    agent.advance()
+    agent.malfunction_data['malfunction'] = 2
+    agent.speed_data['custom'] = 1
+    assert not agent.has_dynamic_state(state)
+    agent.set_dynamic_state(state)
+    assert agent.has_dynamic_state(state)
+    assert agent.position is None
+    assert agent.ticks == 0
+    assert agent.malfunction == 0
+    assert 'custom' not in agent.speed_data
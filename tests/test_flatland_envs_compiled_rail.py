@@ -0,0 +1,119 @@
+import numpy as np
+
+from flatland.core.env_observation_builder import DummyObservationBuilder
+from flatland.core.grid.grid4 import Grid4TransitionsEnum
+from flatland.core.transition_map import SparseGridTransitionMap
+from flatland.envs.compiled_rail import CompiledRail
+from flatland.envs.level_cache import LevelCache
+from flatland.envs.rail_env import RailEnv, RailEnvActions, RailEnvNextAction
+from flatland.envs.rail_generators import rail_from_grid_transition_map
+from flatland.envs.rail_env_shortest_paths import get_valid_move_actions_, get_new_position_for_action, \
+    get_action_for_move
+from flatland.envs.schedule_generators import random_schedule_generator
+from flatland.envs.step_engine import VectorizedStepEngine
+from flatland.utils.simple_rail import make_simple_rail
+
+
+def test_compiled_rail_transitions():
+    rail, rail_map = make_simple_rail()
+    compiled_rail = CompiledRail(rail)
+    for r in range(rail_map.shape[0]):
+        for c in range(rail_map.shape[1]):
+            for direction in range(4):
+                assert tuple(compiled_rail.transitions[compiled_rail.cell(r, c), direction]) == \
+                    rail.get_transitions(r, c, direction)
+
+
+def test_compiled_rail_actions():
+    rail, _ = make_simple_rail()
+    compiled_rail = CompiledRail(rail)
+
+    # dead-end: moving forward turns around
+    assert compiled_rail.resolve((3, 0), Grid4TransitionsEnum.WEST, RailEnvActions.MOVE_FORWARD) == \
+        (True, (3, 1), Grid4TransitionsEnum.EAST)
+    assert not compiled_rail.resolve((3, 0), Grid4TransitionsEnum.WEST, RailEnvActions.MOVE_LEFT)[0]
+    # switch: turning right towards north, left is not possible
+    assert compiled_rail.resolve((3, 3), Grid4TransitionsEnum.WEST, RailEnvActions.MOVE_RIGHT) == \
+        (True, (2, 3), Grid4TransitionsEnum.NORTH)
+    assert not compiled_rail.resolve((3, 3), Grid4TransitionsEnum.WEST, RailEnvActions.MOVE_LEFT)[0]
+    # stopping and doing nothing keep the direction
+    assert compiled_rail.resolve((3, 2), Grid4TransitionsEnum.EAST, RailEnvActions.STOP_MOVING) == \
+        (True, (3, 3), Grid4TransitionsEnum.EAST)
+
+    assert list(get_valid_move_actions_(Grid4TransitionsEnum.WEST, (3, 6), rail)) == [
+        RailEnvNextAction(RailEnvActions.MOVE_LEFT, (4, 6), Grid4TransitionsEnum.SOUTH),
+        RailEnvNextAction(RailEnvActions.MOVE_FORWARD, (3, 5), Grid4TransitionsEnum.WEST)]
+    assert get_new_position_for_action((3, 6), Grid4TransitionsEnum.WEST, RailEnvActions.MOVE_LEFT, rail) == \
+        ((4, 6), Grid4TransitionsEnum.SOUTH)
+    assert get_new_position_for_action((3, 6), Grid4TransitionsEnum.WEST, RailEnvActions.MOVE_RIGHT, rail) is None
+    assert get_action_for_move((3, 6), Grid4TransitionsEnum.WEST, (3, 5), Grid4TransitionsEnum.WEST, rail) == \
+        RailEnvActions.MOVE_FORWARD
+    assert get_action_for_move((3, 6), Grid4TransitionsEnum.WEST, (2, 6), Grid4TransitionsEnum.NORTH, rail) is None
+
+
+def test_compiled_rail_recompiled_on_change():
+    rail, rail_map = make_simple_rail()
+    compiled_rail = CompiledRail.for_rail(rail)
+    assert CompiledRail.for_rail(rail) is compiled_rail
+
+    rail.set_transition((3, 3, Grid4TransitionsEnum.WEST), Grid4TransitionsEnum.NORTH, 0)
+    assert CompiledRail.for_rail(rail) is not compiled_rail
+    assert not CompiledRail.for_rail(rail).move((3, 3), Grid4TransitionsEnum.WEST, RailEnvActions.MOVE_RIGHT)
+
+    compiled_rail = CompiledRail.for_rail(rail)
+    rail.grid = np.copy(rail_map)
+    assert CompiledRail.for_rail(rail) is not compiled_rail
+
+
+def test_compiled_rail_reused_by_fingerprint():
+    rail, rail_map = make_simple_rail()
+    cache = LevelCache(max_compiled_rails=1)
+    compiled_rail = CompiledRail.for_rail(rail, fingerprint=rail.fingerprint(), cache=cache)
+    assert CompiledRail.for_rail(rail, fingerprint=rail.fingerprint()) is compiled_rail
+
+    # the same level loaded again shares the tables through the cache only
+    rail_reloaded, _ = make_simple_rail()
+    assert rail_reloaded.fingerprint() == rail.fingerprint()
+    assert CompiledRail.for_rail(rail_reloaded, fingerprint=rail_reloaded.fingerprint()).action_valid is not \
+        compiled_rail.action_valid
+    rail_reloaded, _ = make_simple_rail()
+    compiled_rail_reloaded = CompiledRail.for_rail(rail_reloaded, fingerprint=rail_reloaded.fingerprint(),
+                                                   cache=cache)
+    assert compiled_rail_reloaded.grid is rail_reloaded.grid
+    assert compiled_rail_reloaded.action_valid is compiled_rail.action_valid
+
+    # a cell written directly into the grid changes the fingerprint
+    rail_reloaded.grid[3, 3] = 0
+    assert rail_reloaded.fingerprint() != rail.fingerprint()
+    compiled_rail_modified = CompiledRail.for_rail(rail_reloaded, fingerprint=rail_reloaded.fingerprint(),
+                                                   cache=cache)
+    assert len(cache.compiled_rails) == 1
+    assert compiled_rail_modified.cell(3, 3) == -1
+    assert compiled_rail.transitions[compiled_rail.cell(3, 3)].any()
+
+
+def test_compiled_rail_of_sparse_rail():
+    rail, rail_map = make_simple_rail()
+    sparse_rail = SparseGridTransitionMap(width=rail.width, height=rail.height, transitions=rail.transitions)
+    sparse_rail.grid = rail_map
+    compiled_rail = CompiledRail(rail)
+    sparse_compiled_rail = CompiledRail.for_rail(sparse_rail)
+    assert sparse_rail._dense_grid is None
+    assert sparse_compiled_rail.number_of_cells == sparse_rail.number_of_cells
+    rows, columns = np.indices(rail_map.shape)
+    cells = compiled_rail.cell_index(rows, columns)
+    sparse_cells = sparse_compiled_rail.cell_index(rows, columns)
+    assert np.array_equal(sparse_cells >= 0, cells >= 0)
+    assert sparse_compiled_rail.cell(3, 3) == sparse_rail.cell_id(3, 3)
+    for name in ['action_direction', 'action_valid', 'move_direction', 'move_valid']:
+        assert np.array_equal(getattr(sparse_compiled_rail, name)[sparse_cells], getattr(compiled_rail, name)[cells])
+
+    # the environment is reset and stepped without building the dense grid of the sparse rail
+    for step_engine in [None, VectorizedStepEngine()]:
+        env = RailEnv(width=rail.width, height=rail.height, rail_generator=rail_from_grid_transition_map(sparse_rail),
+                      schedule_generator=random_schedule_generator(), number_of_agents=2,
+                      obs_builder_object=DummyObservationBuilder(), step_engine=step_engine)
+        env.reset()
+        for _ in range(5):
+            env.step({0: RailEnvActions.MOVE_FORWARD, 1: RailEnvActions.MOVE_FORWARD})
+        assert sparse_rail._dense_grid is None
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from flatland.envs.agent_utils import RailAgentStatus
+from flatland.envs.malfunction_generators import malfunction_from_params, MalfunctionParameters, \
+    no_malfunction_generator
+from flatland.envs.rail_env import RailEnv, RailEnvActions
+from flatland.envs.rail_env_shortest_paths import get_valid_move_actions_
+from flatland.envs.step_engine import VectorizedStepEngine
+from test_utils import make_sparse_env, agent_state
+
+
+def _make_env(step_engine=None, malfunctions='shared'):
+    """
+    Malfunctions drawn from the 'shared' random stream of the environment, from per-agent 'streams' or 'none'.
+    """
+    malfunction_generator_and_process_data = malfunction_from_params(
+        MalfunctionParameters(malfunction_rate=10, min_duration=2, max_duration=6))
+    if malfunctions == 'none':
+        malfunction_generator_and_process_data = no_malfunction_generator()
+    return make_sparse_env(step_engine, number_of_agents=2, speed_ration_map={1. / 3.: 0.5, 1. / 4.: 0.5},
+                           malfunction_generator_and_process_data=malfunction_generator_and_process_data,
+                           agent_random_streams=malfunctions == 'streams', random_seed=3)
+
+
+def _decision_actions(env: RailEnv):
+    actions = {}
+    for agent in env.agents:
+        if agent.status == RailAgentStatus.READY_TO_DEPART:
+            actions[agent.handle] = RailEnvActions.MOVE_FORWARD
+        elif agent.status == RailAgentStatus.ACTIVE and env.action_required(agent):
+            distances = env.distance_map.get()[agent.handle]
+            best = min(get_valid_move_actions_(agent.direction, agent.position, env.rail),
+                       key=lambda a: distances[(*a.next_position, a.next_direction)])
+            actions[agent.handle] = best.action
+    return actions
+
+
+# the skipped steps modify the agents, which the vectorized engine pulls into its arrays
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine()], ids=['step_agents', 'vectorized'])
+# without shared random stream, the steps up to the next event are skipped at once
+@pytest.mark.parametrize('malfunctions', ['shared', 'streams', 'none'])
+def test_advance_until_decision_same_as_stepping(step_engine, malfunctions):
+    env = _make_env(malfunctions=malfunctions)
+    env_events = _make_env(step_engine, malfunctions=malfunctions)
+    skipped = 0
+    while not env.dones["__all__"]:
+        actions = _decision_actions(env)
+        env.step(actions)
+        env_events.step(actions)
+
+        # reference: step without actions as long as no agent can act
+        rewards = np.zeros(env.get_num_agents())
+        steps = 0
+        info = None
+        while not env.dones["__all__"] and not any(env.event_backend.decision_required(a) for a in env.agents):
+            _, rewards_dict, _, info = env.step({})
+            rewards += list(rewards_dict.values())
+            steps += 1
+
+        _, rewards_events, dones_events, info_events, steps_events = env_events.advance_until_decision()
+        assert steps == steps_events
+        if info is not None:
+            assert info == info_events
+        # the rewards of the steps skipped at once are multiplied instead of summed up
+        assert np.allclose(rewards, list(rewards_events.values()))
+        assert env.dones == dones_events
+        assert env._elapsed_steps == env_events._elapsed_steps
+        assert agent_state(env) == agent_state(env_events)
+        assert np.array_equal(env.agent_positions, env_events.agent_positions)
+        skipped += steps
+    assert skipped > 0
+    assert any(agent.status >= RailAgentStatus.DONE for agent in env.agents)
+    if malfunctions != 'none':
+        assert any(agent.malfunction_data['nr_malfunctions'] > 0 for agent in env.agents)
+
+
+@pytest.mark.parametrize('malfunctions', ['shared', 'streams', 'none'])
+def test_advance_until_decision_max_steps(malfunctions):
+    env = _make_env(malfunctions=malfunctions)
+    env_events = _make_env(malfunctions=malfunctions)
+    advanced = 0
+    for max_steps in [1, 3, 7] * 10:
+        if env.dones["__all__"]:
+            break
+        actions = _decision_actions(env)
+        env.step(actions)
+        env_events.step(actions)
+        elapsed_steps = env_events._elapsed_steps
+        _, rewards_events, _, info_events, steps = env_events.advance_until_decision(max_steps=max_steps)
+        assert steps <= max_steps
+        assert env_events._elapsed_steps == elapsed_steps + steps
+
+        # the info is the one of the last step, also if it was skipped
+        rewards = np.zeros(env.get_num_agents())
+        for _ in range(steps):
+            _, rewards_dict, _, info = env.step({})
+            rewards += list(rewards_dict.values())
+        if steps > 0:
+            assert info == info_events
+        assert np.allclose(rewards, list(rewards_events.values()))
+        assert agent_state(env) == agent_state(env_events)
+        advanced += steps
+    assert advanced > 0
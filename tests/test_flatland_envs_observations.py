@@ -2,17 +2,22 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
+import pytest
 
 from flatland.core.grid.grid4 import Grid4TransitionsEnum
 from flatland.core.grid.grid4_utils import get_new_position
 from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+from flatland.envs.observation_pipeline import PendingObservations, ProcessObservationPipeline, \
+    ThreadObservationPipeline
 from flatland.envs.observations import GlobalObsForRailEnv, TreeObsForRailEnv
 from flatland.envs.predictions import ShortestPathPredictorForRailEnv
+from flatland.core.env_observation_builder import LazyObservations
 from flatland.envs.rail_env import RailEnv, RailEnvActions
 from flatland.envs.rail_generators import rail_from_grid_transition_map
 from flatland.envs.schedule_generators import random_schedule_generator
 from flatland.utils.rendertools import RenderTool
 from flatland.utils.simple_rail import make_simple_rail
+from test_utils import make_sparse_env
 
 """Tests for `flatland` package."""
 
@@ -314,3 +319,80 @@ def test_reward_function_waiting(rendering=False):
                                                                                                    actual_reward,
                                                                                                    expected_reward)
         iteration += 1
+
+
+def _make_tree_obs_env(**kwargs):
+    env = make_sparse_env(number_of_agents=5, speed_ration_map={1.: 0.5, 1. / 2.: 0.5},
+                          obs_builder_object=TreeObsForRailEnv(max_depth=3,
+                                                               predictor=ShortestPathPredictorForRailEnv(10)),
+                          random_seed=None, **kwargs)
+    obs, _ = env.reset(random_seed=1)
+    return env, obs
+
+
+def test_lazy_and_decision_observations():
+    env, obs = _make_tree_obs_env()
+    env_lazy, obs_lazy = _make_tree_obs_env(lazy_observations=True)
+    env_decisions, obs_decisions = _make_tree_obs_env(lazy_observations=True, decision_observations=True)
+    np_random = np.random.RandomState(1)
+    decisions = 0
+    for step in range(40):
+        assert isinstance(obs_lazy, LazyObservations)
+        assert list(obs_lazy.keys()) == list(obs.keys())
+        # only access some of the observations
+        for handle in range(step % 2, env.get_num_agents(), 2):
+            assert repr(obs_lazy[handle]) == repr(obs[handle]), "step {}".format(step)
+        assert list(obs_decisions.keys()) == [i for i, agent in enumerate(env.agents) if env.action_required(agent)]
+        for handle, observation in obs_decisions.items():
+            assert repr(observation) == repr(obs[handle]), "step {}".format(step)
+        decisions += len(obs_decisions)
+
+        actions = dict(enumerate(np_random.randint(1, 4, env.get_num_agents())))
+        obs, _, _, _ = env.step(actions)
+        previous_obs_lazy = obs_lazy
+        obs_lazy, _, _, _ = env_lazy.step(actions)
+        obs_decisions, _, _, _ = env_decisions.step(actions)
+    assert 0 < decisions < 40 * env.get_num_agents()
+
+    # the observations not accessed before the step cannot be computed any more
+    with pytest.raises(RuntimeError):
+        previous_obs_lazy[(step + 1) % 2]
+
+    # nor after the environment is rolled back
+    snapshot = env_lazy.snapshot()
+    env_lazy.step({})
+    obs_lazy = env_lazy.obs_dict
+    env_lazy.restore(snapshot)
+    with pytest.raises(RuntimeError):
+        obs_lazy[0]
+
+
+@pytest.mark.parametrize("pipeline", [ThreadObservationPipeline, ProcessObservationPipeline])
+def test_observation_pipeline(pipeline):
+    env, obs = _make_tree_obs_env()
+    env_pipeline, obs_pipeline = _make_tree_obs_env(observation_pipeline=pipeline())
+    env_decisions, obs_decisions = _make_tree_obs_env(observation_pipeline=pipeline(), decision_observations=True)
+    np_random = np.random.RandomState(1)
+    for step in range(20):
+        assert isinstance(obs_pipeline, PendingObservations)
+        assert list(obs_pipeline.keys()) == list(obs.keys())
+        for handle in obs.keys():
+            assert repr(obs_pipeline[handle]) == repr(obs[handle]), "step {}".format(step)
+        assert list(obs_decisions.keys()) == [i for i, agent in enumerate(env.agents) if env.action_required(agent)]
+        for handle, observation in obs_decisions.items():
+            assert repr(observation) == repr(obs[handle]), "step {}".format(step)
+
+        actions = dict(enumerate(np_random.randint(1, 4, env.get_num_agents())))
+        obs, _, _, _ = env.step(actions)
+        # the observations of every other step are not read before the next step
+        if step % 2 == 0:
+            env_pipeline.step(actions)
+            obs_pipeline, _, _, _ = env_pipeline.step({})
+            obs, _, _, _ = env.step({})
+        else:
+            obs_pipeline, _, _, _ = env_pipeline.step(actions)
+        obs_decisions, _, _, _ = env_decisions.step(actions)
+        if step % 2 == 0:
+            obs_decisions, _, _, _ = env_decisions.step({})
+    env_pipeline.observation_pipeline.close()
+    env_decisions.observation_pipeline.close()
@@ -1,17 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import io
+import json
+
 import numpy as np
+import pytest
 
 from flatland.core.grid.rail_env_grid import RailEnvTransitions
 from flatland.core.transition_map import GridTransitionMap
-from flatland.envs.agent_utils import EnvAgent
+from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+from flatland.envs.malfunction_generators import malfunction_from_params, MalfunctionParameters
 from flatland.envs.observations import GlobalObsForRailEnv, TreeObsForRailEnv
 from flatland.envs.predictions import ShortestPathPredictorForRailEnv
-from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_env import RailEnv, RailEnvActions
 from flatland.envs.rail_generators import complex_rail_generator, rail_from_file
 from flatland.envs.rail_generators import rail_from_grid_transition_map
 from flatland.envs.schedule_generators import random_schedule_generator, complex_schedule_generator, schedule_from_file
+from flatland.envs.state_hash import StateHash
+from flatland.envs.step_engine import JitStepEngine, VectorizedStepEngine
 from flatland.utils.simple_rail import make_simple_rail
+from test_utils import make_sparse_env, agent_state
 
 """Tests for `flatland` package."""
 
@@ -262,3 +270,239 @@ def test_rail_env_reset():
 
     assert np.all(np.array_equal(rails_initial, rails_loaded))
     assert agents_initial == agents_loaded
+
+
+def _make_env_with_malfunctions(step_engine=None, **kwargs):
+    env = make_sparse_env(step_engine, number_of_agents=6, speed_ration_map={1.: 0.5, 1. / 3.: 0.5},
+                          malfunction_generator_and_process_data=malfunction_from_params(
+                              MalfunctionParameters(malfunction_rate=20, min_duration=2, max_duration=5)),
+                          random_seed=1, **kwargs)
+    np_random = np.random.RandomState(3)
+    actions = [dict(enumerate(np_random.randint(0, 5, env.get_num_agents()))) for _ in range(200)]
+    return env, actions
+
+
+def _dynamic_state(env: RailEnv):
+    return (agent_state(env), env.agent_positions.tolist(), env._elapsed_steps, dict(env.dones),
+            list(env.active_agents), env.np_random.get_state()[2])
+
+
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine()], ids=['step_agents', 'vectorized'])
+# with agent random streams, restoring the last snapshot only restores the agents the steps may have changed
+@pytest.mark.parametrize('agent_random_streams', [False, True])
+def test_snapshot_restore(step_engine, agent_random_streams):
+    env, actions = _make_env_with_malfunctions(step_engine, agent_random_streams=agent_random_streams)
+
+    def state():
+        return _dynamic_state(env)
+
+    env.record_steps = True
+    for step in range(50):
+        env.step(actions[step])
+    snapshot = env.snapshot()
+    expected = state()
+    branch = []
+    env.start_journal()
+    for step in range(50, 200):
+        branch.append((env.step(actions[step])[1], state()))
+    assert any(agent.malfunction_data['nr_malfunctions'] > 0 for agent in env.agents)
+
+    # a snapshot can be restored several times, also after undoing steps
+    for _ in range(2):
+        env.restore(snapshot)
+        assert state() == expected
+        # the recorded steps and the journal of the abandoned branch are dropped
+        assert len(env.cur_episode) == 50
+        assert len(env.journal) == 0
+        for step in range(50, 200):
+            assert (env.step(actions[step])[1], state()) == branch[step - 50], "step {}".format(step)
+        env.undo()
+        env.undo()
+
+    # a snapshot older than the last one is restored as well
+    env.restore(snapshot)
+    for step in range(50, 120):
+        env.step(actions[step])
+    later = env.snapshot()
+    env.restore(snapshot)
+    assert state() == expected
+    env.restore(later)
+    assert state() == branch[119 - 50][1]
+
+    # the steps undone after the last snapshot are restored as well
+    env.step(actions[120])
+    env.step(actions[121])
+    last = env.snapshot()
+    env.undo()
+    env.undo()
+    env.restore(last)
+    assert state() == branch[121 - 50][1]
+
+
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine(), JitStepEngine(jit=True)],
+                         ids=['step_agents', 'vectorized', 'jit'])
+def test_journal_undo(step_engine):
+    env, actions = _make_env_with_malfunctions(step_engine)
+    for step in range(40):
+        env.step(actions[step])
+    env.start_journal()
+    states = [_dynamic_state(env)]
+    branch = []
+    for step in range(40, 200):
+        branch.append(env.step(actions[step])[1])
+        states.append(_dynamic_state(env))
+    assert any(agent.malfunction_data['nr_malfunctions'] > 0 for agent in env.agents)
+    # the journal only keeps the agents changed by a step
+    env.journal.commit()
+    assert min(len(entry.agents) for entry in env.journal.entries) < env.get_num_agents()
+
+    # depth-first: undo a few steps and redo them, then undo all the steps
+    for _ in range(5):
+        env.undo()
+    assert _dynamic_state(env) == states[-6]
+    for step in range(195, 200):
+        assert env.step(actions[step])[1] == branch[step - 40]
+        assert _dynamic_state(env) == states[step - 39]
+    for step in reversed(range(40, 200)):
+        env.undo()
+        assert _dynamic_state(env) == states[step - 40], "step {}".format(step)
+    assert len(env.journal) == 0
+
+
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine()], ids=['step_agents', 'vectorized'])
+def test_perf_stats(step_engine):
+    env = make_sparse_env(step_engine, number_of_agents=4,
+                          obs_builder_object=TreeObsForRailEnv(max_depth=2,
+                                                               predictor=ShortestPathPredictorForRailEnv(10)),
+                          random_seed=1, record_steps=True)
+    env._max_episode_steps = 50
+    episodes = []
+    perf_stats = env.enable_perf_stats(on_episode_end=lambda stats: episodes.append(stats.as_dict()))
+    while not env.dones["__all__"]:
+        env.step({i: 2 for i in env.get_agent_handles()})
+
+    assert len(episodes) == 1
+    assert episodes[0]['steps'] == env._elapsed_steps
+    for phase in ['malfunction', 'actions', 'movement', 'info', 'prediction', 'observations', 'recording']:
+        assert perf_stats.time[phase] > 0, phase
+        # each phase is counted once per step, not once per agent
+        assert perf_stats.calls[phase] == env._elapsed_steps, phase
+    assert sum(perf_stats.time.values()) <= perf_stats.step_time
+
+    output = io.StringIO()
+    perf_stats.dump(output)
+    assert 'prediction' in output.getvalue()
+    output = io.StringIO()
+    perf_stats.dump(output, fmt='json')
+    assert json.loads(output.getvalue())['steps'] == env._elapsed_steps
+
+    # a step after the end of the episode is timed as well and leaves no step open
+    env.step({})
+    assert perf_stats.steps == env._elapsed_steps
+    calls = dict(perf_stats.calls)
+    env.reset(random_seed=1)
+    assert perf_stats.calls == calls
+
+    env.disable_perf_stats()
+    assert env.obs_builder.perf_stats is None
+
+
+def _expected_action_mask(env: RailEnv, agent: EnvAgent):
+    if agent.status == RailAgentStatus.READY_TO_DEPART:
+        return [True] * 5
+    if agent.status != RailAgentStatus.ACTIVE:
+        return [True, False, False, False, False]
+    mask = [True, False, False, False, True]
+    for action in [RailEnvActions.MOVE_LEFT, RailEnvActions.MOVE_FORWARD, RailEnvActions.MOVE_RIGHT]:
+        _, new_cell_valid, _, _, transition_valid = env._check_action_on_agent(action, agent)
+        mask[action] = new_cell_valid and transition_valid
+    return mask
+
+
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine()], ids=['step_agents', 'vectorized'])
+def test_action_masks(step_engine):
+    env = make_sparse_env(step_engine, number_of_agents=6, random_seed=None, action_masks=True)
+    _, info = env.reset(random_seed=1)
+    assert info['action_mask'].shape == (6, 5)
+    assert info['action_mask'].all()
+    snapshot = env.snapshot()
+    np_random = np.random.RandomState(3)
+    for _ in range(100):
+        _, _, _, info = env.step(dict(enumerate(np_random.randint(0, 5, env.get_num_agents()))))
+        for agent in env.agents:
+            assert info['action_mask'][agent.handle].tolist() == _expected_action_mask(env, agent)
+    assert any(agent.status == RailAgentStatus.ACTIVE for agent in env.agents)
+
+    _, _, _, info = env.step_arrays(np.full(env.get_num_agents(), RailEnvActions.MOVE_FORWARD))
+    for agent in env.agents:
+        assert info['action_mask'][agent.handle].tolist() == _expected_action_mask(env, agent)
+
+    # the agents rolled back by restore() are updated as well
+    env.restore(snapshot)
+    _, _, _, info = env.step({})
+    assert info['action_mask'].all()
+
+
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine()], ids=['step_agents', 'vectorized'])
+def test_simulate_episode(step_engine):
+    env, actions = _make_env_with_malfunctions(step_engine)
+    actions = np.array([[action_dict[i] for i in range(env.get_num_agents())] for action_dict in actions])
+    snapshot = env.snapshot()
+    expected = []
+    for step_actions in actions:
+        _, rewards, _, info = env.step(dict(enumerate(step_actions)))
+        expected.append(([(-1, -1) if agent.position is None else agent.position for agent in env.agents],
+                         [agent.direction for agent in env.agents], list(info['status'].values()),
+                         list(rewards.values())))
+        if env.dones["__all__"]:
+            break
+    expected_state = _dynamic_state(env)
+
+    env.restore(snapshot)
+    episode = env.simulate_episode(actions)
+    assert len(episode.rewards) == len(expected)
+    for step, (positions, directions, statuses, rewards) in enumerate(expected):
+        assert [tuple(position) for position in episode.positions[step].tolist()] == positions, "step {}".format(step)
+        assert episode.directions[step].tolist() == directions
+        assert episode.statuses[step].tolist() == statuses
+        assert episode.rewards[step].tolist() == rewards
+    assert _dynamic_state(env) == expected_state
+    assert env.step_engine is step_engine
+
+    # the steps continue from the simulated ones
+    env.restore(snapshot)
+    half = len(expected) // 2
+    env.simulate_episode(actions[:half])
+    for step in range(half, len(expected)):
+        _, rewards, _, info = env.step(dict(enumerate(actions[step])))
+        assert list(info['status'].values()) == expected[step][2], "step {}".format(step)
+        assert list(rewards.values()) == expected[step][3], "step {}".format(step)
+    assert _dynamic_state(env) == expected_state
+
+
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine()], ids=['step_agents', 'vectorized'])
+def test_state_hash(step_engine):
+    env, actions = _make_env_with_malfunctions(step_engine, incremental_state_hash=True)
+
+    def full_hash():
+        state_hash = StateHash()
+        state_hash.reset(env.agents, env.width)
+        return state_hash.value
+
+    assert env.state_hash == full_hash()
+    hashes = [env.state_hash]
+    for step in range(100):
+        if step == 50:
+            snapshot = env.snapshot()
+            env.start_journal()
+        env.step(actions[step])
+        assert env.state_hash == full_hash(), "step {}".format(step)
+        hashes.append(env.state_hash)
+    assert len(set(hashes)) > 10
+
+    env.undo()
+    assert env.state_hash == hashes[-2]
+    env.restore(snapshot)
+    assert env.state_hash == hashes[50]
+    env.reset(random_seed=2)
+    assert env.state_hash == full_hash()
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from flatland.core.env_observation_builder import DummyObservationBuilder
+from flatland.envs.compiled_rail import CompiledRail
+from flatland.envs.malfunction_generators import no_malfunction_generator
+from flatland.envs.shared_level import SharedLevel
+from test_utils import make_sparse_env
+
+
+def _make_level():
+    # the environments on the level are made without malfunctions
+    env = make_sparse_env(number_of_agents=4, malfunction_generator_and_process_data=no_malfunction_generator(),
+                          random_seed=1)
+    return env, SharedLevel.from_env(env)
+
+
+def _run(env, steps=50):
+    np_random = np.random.RandomState(3)
+    trajectory = []
+    for _ in range(steps):
+        _, rewards, _, _ = env.step(dict(enumerate(np_random.randint(0, 5, env.get_num_agents()))))
+        trajectory.append((rewards, [(agent.position, agent.direction) for agent in env.agents]))
+    return trajectory
+
+
+def test_shared_level_envs_reference_one_rail():
+    env, level = _make_level()
+    envs = [level.make_env(obs_builder_object=DummyObservationBuilder()) for _ in range(3)]
+    for shared_env in envs:
+        shared_env.reset(random_seed=1)
+        assert shared_env.rail.grid is level.grid
+        assert shared_env.distance_map.get() is level.distance_map
+        assert CompiledRail.for_rail(shared_env.rail).action_valid is CompiledRail.for_rail(envs[0].rail).action_valid
+    assert np.array_equal(level.distance_map, env.distance_map.get())
+    with pytest.raises(ValueError):
+        envs[0].rail.grid[0, 0] = 1
+
+    expected = _run(env)
+    for shared_env in envs:
+        assert _run(shared_env) == expected
+
+
+def test_shared_level_save_load(tmpdir):
+    env, level = _make_level()
+    level.save(str(tmpdir))
+    loaded = SharedLevel.load(str(tmpdir))
+    assert isinstance(loaded.grid, np.memmap) and not loaded.grid.flags.writeable
+    assert np.array_equal(loaded.grid, level.grid)
+    assert np.array_equal(loaded.distance_map, level.distance_map)
+    assert loaded.fingerprint == level.fingerprint
+
+    shared_env = loaded.make_env(obs_builder_object=DummyObservationBuilder())
+    shared_env.reset(random_seed=1)
+    assert _run(shared_env) == _run(env)
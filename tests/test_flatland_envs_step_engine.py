@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from flatland.envs.malfunction_generators import no_malfunction_generator
+from flatland.envs.agent_utils import RailAgentStatus
+from flatland.envs.rail_env import RailEnv, RailEnvActions
+from flatland.envs.rail_env_shortest_paths import get_valid_move_actions_
+from flatland.envs.step_engine import JitStepEngine, VectorizedStepEngine
+from test_utils import make_sparse_env, agent_state
+
+
+def _shortest_path_actions(env: RailEnv, np_random: np.random.RandomState):
+    """
+    Mostly follows the shortest paths, with random stops, illegal and missing actions in between.
+    """
+    actions = {}
+    for agent in env.agents:
+        if np_random.rand() < 0.3:
+            action = np_random.randint(-1, 6)
+            if action != 5:
+                actions[agent.handle] = action
+            continue
+        if agent.status == RailAgentStatus.READY_TO_DEPART:
+            actions[agent.handle] = RailEnvActions.MOVE_FORWARD
+        elif agent.status == RailAgentStatus.ACTIVE:
+            distances = env.distance_map.get()[agent.handle]
+            best = min(get_valid_move_actions_(agent.direction, agent.position, env.rail),
+                       key=lambda a: distances[(*a.next_position, a.next_direction)])
+            actions[agent.handle] = best.action
+    return actions
+
+
+def _run_episodes_side_by_side(remove_agents_at_target, number_of_agents=8, step_engine=VectorizedStepEngine,
+                               **kwargs):
+    env = make_sparse_env(remove_agents_at_target=remove_agents_at_target, number_of_agents=number_of_agents, **kwargs)
+    env_engine = make_sparse_env(step_engine(), remove_agents_at_target=remove_agents_at_target,
+                           number_of_agents=number_of_agents, **kwargs)
+    np_random = np.random.RandomState(42)
+
+    assert agent_state(env) == agent_state(env_engine)
+    for step in range(env._max_episode_steps):
+        actions = _shortest_path_actions(env, np_random)
+        _, rewards, dones, info = env.step(actions)
+        _, rewards_engine, dones_engine, info_engine = env_engine.step(actions)
+
+        assert rewards == rewards_engine, "step {}".format(step)
+        assert dones == dones_engine, "step {}".format(step)
+        assert info == info_engine, "step {}".format(step)
+        assert agent_state(env) == agent_state(env_engine), "step {}".format(step)
+        assert np.array_equal(env.agent_positions, env_engine.agent_positions), "step {}".format(step)
+        # the steps keep the agent index up to date
+        assert env.agent_index.sync(env.agents) == [], "step {}".format(step)
+        assert env_engine.agent_index.sync(env_engine.agents) == [], "step {}".format(step)
+        if dones["__all__"]:
+            break
+    # make sure the episode covered arrivals
+    assert any(agent.status >= RailAgentStatus.DONE for agent in env.agents)
+
+
+@pytest.mark.parametrize('remove_agents_at_target', [True, False])
+def test_vectorized_step_engine_same_as_step_agent(remove_agents_at_target):
+    _run_episodes_side_by_side(remove_agents_at_target)
+
+
+@pytest.mark.parametrize('remove_agents_at_target', [True, False])
+def test_jit_step_engine_same_as_step_agent(remove_agents_at_target):
+    # runs the kernel uncompiled if numba is not installed
+    _run_episodes_side_by_side(remove_agents_at_target, number_of_agents=20,
+                               step_engine=lambda: JitStepEngine(jit=True))
+
+
+def test_vectorized_step_engine_same_as_step_agent_skipping_finished_agents():
+    # done agents are not stepped if they draw no malfunctions or draw them from their own streams
+    _run_episodes_side_by_side(remove_agents_at_target=False, agent_random_streams=True)
+    _run_episodes_side_by_side(remove_agents_at_target=False,
+                               malfunction_generator_and_process_data=no_malfunction_generator())
+
+
+def test_vectorized_step_engine_same_as_step_agent_with_shared_start_cells():
+    _run_episodes_side_by_side(remove_agents_at_target=True, number_of_agents=20)
+
+
+@pytest.mark.parametrize('step_engine', [None, VectorizedStepEngine()], ids=['step_agents', 'vectorized'])
+def test_step_arrays_same_as_step(step_engine):
+    env = make_sparse_env()
+    env_arrays = make_sparse_env(step_engine)
+    obs, info_arrays = env_arrays.reset_arrays(random_seed=10)
+    np_random = np.random.RandomState(42)
+
+    rewards_buffer, dones_buffer = env_arrays.rewards_array, env_arrays.dones_array
+    for step in range(env._max_episode_steps):
+        action_dict = _shortest_path_actions(env, np_random)
+        actions = np.zeros(env.get_num_agents(), dtype=int)
+        for handle, action in action_dict.items():
+            actions[handle] = action
+        _, rewards, dones, info = env.step(action_dict)
+        _, rewards_array, dones_array, info_arrays = env_arrays.step_arrays(actions)
+
+        # the arrays are the buffers allocated at reset
+        assert rewards_array is rewards_buffer and dones_array is dones_buffer
+        assert info_arrays is env_arrays.info_arrays
+        assert rewards_array.tolist() == [rewards[i] for i in range(env.get_num_agents())], "step {}".format(step)
+        assert dones_array.tolist() == [dones[i] for i in range(env.get_num_agents())], "step {}".format(step)
+        for key in ['action_required', 'malfunction', 'speed', 'status']:
+            assert info_arrays[key].tolist() == list(info[key].values()), "step {} {}".format(step, key)
+        assert env_arrays.dones["__all__"] == dones["__all__"]
+        assert agent_state(env) == agent_state(env_arrays), "step {}".format(step)
+        if dones["__all__"]:
+            break
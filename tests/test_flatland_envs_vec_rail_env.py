@@ -0,0 +1,91 @@
+import numpy as np
+
+from flatland.envs.observations import GlobalObsForRailEnv, TreeObsForRailEnv
+from flatland.envs.rail_env import RailEnv, RailEnvActions
+from flatland.envs.subproc_vec_rail_env import SubprocVecRailEnv
+from flatland.envs.vec_rail_env import VecRailEnv, pad_stack
+from test_utils import make_sparse_env
+
+
+def _make_env(size: int, number_of_agents: int, obs_builder) -> RailEnv:
+    return make_sparse_env(number_of_agents=number_of_agents, size=size, max_num_cities=3,
+                           obs_builder_object=obs_builder, random_seed=None)
+
+
+def test_pad_stack():
+    stacked = pad_stack([np.array([1, 2]), np.array([3])], fill=-1)
+    assert stacked.tolist() == [[1, 2], [3, -1]]
+
+
+def test_vec_rail_env_padding():
+    vec_env = VecRailEnv([_make_env(25, 2, GlobalObsForRailEnv()), _make_env(30, 3, GlobalObsForRailEnv())],
+                         reset_kwargs={'random_seed': 1})
+    observations, info = vec_env.reset()
+    assert info['agent_mask'].tolist() == [[True, True, False], [True, True, True]]
+    assert len(observations) == 3
+    assert observations[0].shape == (2, 3, 30, 30, 16)
+    assert not observations[0][0, :, 25:].any()
+    assert not observations[0][0, 2].any()
+
+    observations, rewards, dones, info = vec_env.step(np.full((2, 3), RailEnvActions.MOVE_FORWARD))
+    assert rewards.shape == dones.shape == (2, 3)
+    assert dones[0, 2] and rewards[0, 2] == 0
+    assert info['status'].shape == (2, 3)
+    assert not info['episode_done'].any()
+
+
+def test_vec_rail_env_matches_single_envs():
+    vec_env = VecRailEnv([_make_env(25, 2, TreeObsForRailEnv(max_depth=1)) for _ in range(2)],
+                         reset_kwargs={'random_seed': 1})
+    single_env = _make_env(25, 2, TreeObsForRailEnv(max_depth=1))
+    single_env.reset(random_seed=1)
+    vec_env.reset()
+    for env in vec_env.envs + [single_env]:
+        env._max_episode_steps = 20
+
+    for step in range(25):
+        observations, rewards, dones, info = vec_env.step(np.full((2, 2), RailEnvActions.MOVE_FORWARD))
+        assert observations.shape == (2, 2)
+        _, single_rewards, single_dones, _ = single_env.step({0: RailEnvActions.MOVE_FORWARD,
+                                                              1: RailEnvActions.MOVE_FORWARD})
+        assert rewards[0].tolist() == rewards[1].tolist() == list(single_rewards.values())
+        if single_dones["__all__"]:
+            assert info['episode_done'].all()
+            assert vec_env.terminal_observations[0] is not None
+            single_env.reset(random_seed=1)
+            single_env._max_episode_steps = 20
+    for env in vec_env.envs:
+        assert env._elapsed_steps == 5
+
+
+def _encode_global_observation(observation):
+    return np.concatenate(observation, axis=-1)
+
+
+def test_subproc_vec_rail_env_matches_vec_rail_env():
+    sizes_and_agents = [(25, 2), (25, 3)]
+    vec_env = VecRailEnv([_make_env(size, n, GlobalObsForRailEnv()) for size, n in sizes_and_agents],
+                         reset_kwargs={'random_seed': 1})
+    subproc_env = SubprocVecRailEnv(
+        [lambda size=size, n=n: _make_env(size, n, GlobalObsForRailEnv()) for size, n in sizes_and_agents],
+        max_agents=3, observation_shape=(25, 25, 23), encode_observation=_encode_global_observation,
+        reset_kwargs={'random_seed': 1})
+    try:
+        observations, info = vec_env.reset()
+        subproc_observations, subproc_info = subproc_env.reset()
+        assert np.array_equal(subproc_observations, np.concatenate(observations, axis=-1))
+        for key in info:
+            assert np.array_equal(subproc_info[key], info[key]), key
+
+        np_random = np.random.RandomState(1)
+        for _ in range(30):
+            actions = np_random.randint(0, 5, (2, 3))
+            observations, rewards, dones, info = vec_env.step(actions)
+            subproc_observations, subproc_rewards, subproc_dones, subproc_info = subproc_env.step(actions)
+            assert np.array_equal(subproc_observations, np.concatenate(observations, axis=-1))
+            assert np.array_equal(subproc_rewards, rewards)
+            assert np.array_equal(subproc_dones, dones)
+            for key in info:
+                assert np.array_equal(subproc_info[key], info[key]), key
+    finally:
+        subproc_env.close()
@@ -1,5 +1,6 @@
 from flatland.envs.malfunction_generators import malfunction_from_params, malfunction_from_file, \
     single_malfunction_generator, MalfunctionParameters
+from flatland.envs.random_streams import AgentRandomStreams
 from flatland.envs.rail_env import RailEnv, RailEnvActions
 from flatland.envs.rail_generators import rail_from_grid_transition_map
 from flatland.envs.schedule_generators import random_schedule_generator
@@ -105,3 +106,81 @@ def test_single_malfunction_generator():
             # Go forward all the time
             tot_malfunctions += agent.malfunction_data['nr_malfunctions']
         assert tot_malfunctions == 1
+
+
+def test_agent_random_streams():
+    streams = AgentRandomStreams()
+    streams.reset(seed=1, episode=0)
+    draws = {(handle, step): streams.for_agent(handle, step).rand(3).tolist() for handle in range(4) for step in
+             range(5)}
+    # the draws of an agent at a step do not depend on the order of the calls
+    for handle, step in reversed(list(draws.keys())):
+        assert streams.for_agent(handle, step).rand(3).tolist() == draws[(handle, step)]
+    assert len(set(tuple(draw) for draw in draws.values())) == len(draws)
+
+    streams.reset(seed=1, episode=1)
+    assert streams.for_agent(0, 0).rand(3).tolist() != draws[(0, 0)]
+
+
+def test_malfunctions_from_agent_random_streams():
+    """
+    With agent random streams, the malfunctions of an agent do not depend on the other agents.
+    """
+    rail, rail_map = make_simple_rail2()
+
+    def make_env():
+        env = RailEnv(width=25, height=30, rail_generator=rail_from_grid_transition_map(rail),
+                      schedule_generator=random_schedule_generator(seed=5), number_of_agents=6,
+                      malfunction_generator_and_process_data=malfunction_from_params(
+                          MalfunctionParameters(malfunction_rate=10, min_duration=2, max_duration=5)),
+                      agent_random_streams=True)
+        env.reset(random_seed=1)
+        return env
+
+    def malfunctions(env):
+        env.reset(False, False, random_seed=1)
+        steps = []
+        for _ in range(50):
+            env.step({})
+            steps.append([dict(agent.malfunction_data) for agent in env.agents[:3]])
+        return steps
+
+    env = make_env()
+    expected = malfunctions(env)
+    assert any(agent.malfunction_data['nr_malfunctions'] > 0 for agent in env.agents[:3])
+
+    env = make_env()
+    env.agents = env.agents[:3]
+    assert malfunctions(env) == expected
+
+
+def test_agent_random_streams_reproduced_by_reseeding():
+    """
+    A reused environment reseeded with the same seed draws the same malfunctions again.
+    """
+    rail, rail_map = make_simple_rail2()
+
+    def make_env():
+        return RailEnv(width=25, height=30, rail_generator=rail_from_grid_transition_map(rail),
+                       schedule_generator=random_schedule_generator(seed=5), number_of_agents=6,
+                       malfunction_generator_and_process_data=malfunction_from_params(
+                           MalfunctionParameters(malfunction_rate=10, min_duration=2, max_duration=5)),
+                       agent_random_streams=True)
+
+    def episode(env):
+        steps = []
+        for _ in range(50):
+            env.step({i: RailEnvActions.MOVE_FORWARD for i in env.get_agent_handles()})
+            steps.append([(agent.position, dict(agent.malfunction_data)) for agent in env.agents])
+        return steps
+
+    env = make_env()
+    env.reset(random_seed=7)
+    expected = episode(env)
+    assert any(agent.malfunction_data['nr_malfunctions'] > 0 for agent in env.agents)
+
+    env.reset(False, False, random_seed=1)
+    assert episode(env) != expected
+    env.reset(False, False)
+    env.reset(False, False, random_seed=7)
+    assert episode(env) == expected
@@ -4,9 +4,13 @@ from typing import List, Tuple, Optional
 import numpy as np
 from attr import attrs, attrib
 
+from flatland.core.env_observation_builder import DummyObservationBuilder
 from flatland.core.grid.grid4 import Grid4TransitionsEnum
 from flatland.envs.agent_utils import EnvAgent, RailAgentStatus
+from flatland.envs.malfunction_generators import malfunction_from_params, MalfunctionParameters
 from flatland.envs.rail_env import RailEnvActions, RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
 from flatland.utils.rendertools import RenderTool
 
 
@@ -131,3 +135,39 @@ def run_replay_config(env: RailEnv, test_configs: List[ReplayConfig], rendering:
             replay = test_config.replay[step]
 
             _assert(a, rewards_dict[a], replay.reward, 'reward')
+
+
+def make_sparse_env(step_engine=None, number_of_agents=8, speed_ration_map=None,
+                    malfunction_generator_and_process_data=None, random_seed=10, size=30, max_num_cities=4,
+                    obs_builder_object=None, **kwargs) -> RailEnv:
+    """
+    Creates a small sparse RailEnv with malfunctions and resets it with `random_seed` unless it is None, further
+    keyword arguments are passed to the RailEnv.
+    """
+    if speed_ration_map is None:
+        speed_ration_map = {1.: 0.25, 1. / 2.: 0.25, 1. / 3.: 0.25, 1. / 4.: 0.25}
+    if malfunction_generator_and_process_data is None:
+        malfunction_generator_and_process_data = malfunction_from_params(
+            MalfunctionParameters(malfunction_rate=50, min_duration=2, max_duration=5))
+    if obs_builder_object is None:
+        obs_builder_object = DummyObservationBuilder()
+    env = RailEnv(width=size, height=size,
+                  rail_generator=sparse_rail_generator(max_num_cities=max_num_cities, max_rails_between_cities=2,
+                                                       seed=5, grid_mode=False),
+                  schedule_generator=sparse_schedule_generator(speed_ration_map),
+                  number_of_agents=number_of_agents,
+                  obs_builder_object=obs_builder_object,
+                  malfunction_generator_and_process_data=malfunction_generator_and_process_data,
+                  step_engine=step_engine, **kwargs)
+    if random_seed is not None:
+        env.reset(random_seed=random_seed)
+    return env
+
+
+def agent_state(env: RailEnv):
+    """
+    The dynamic state of the agents, to compare two environments stepped side by side.
+    """
+    return [(agent.position, agent.direction, agent.old_position, agent.old_direction, agent.status, agent.moving,
+             agent.speed_data['position_fraction'], agent.speed_data['transition_action_on_cellexit'],
+             dict(agent.malfunction_data)) for agent in env.agents]